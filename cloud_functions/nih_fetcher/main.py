@@ -1,26 +1,161 @@
 import requests
 import os
+import io
+import gzip
 import json
-from google.cloud import storage
+import random
+import time
 from datetime import datetime
 
+# Configuration
+NIH_REPORTER_API_URL = os.environ.get("NIH_REPORTER_API_URL", "https://api.reporter.nih.gov/v2/projects/search")
+PAGE_SIZE = 500  # Max limit per request
+MAX_OFFSET = 14999  # RePORTER rejects larger offsets
+MAX_RETRIES = 5
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class GCSStorage:
+    """Writes objects to a Google Cloud Storage bucket"""
+
+    def __init__(self, bucket_name):
+        from google.cloud import storage
+        self.bucket_name = bucket_name
+        self.bucket = storage.Client().bucket(bucket_name)
+
+    def write(self, name, data, content_type, content_encoding=None):
+        blob = self.bucket.blob(name)
+        if content_encoding:
+            blob.content_encoding = content_encoding
+        blob.upload_from_string(data, content_type=content_type)
+
+    def uri(self, name):
+        return f"gs://{self.bucket_name}/{name}"
+
+
+class LocalStorage:
+    """Local-filesystem stand-in for GCSStorage (same object names, under `root`)"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def write(self, name, data, content_type, content_encoding=None):
+        path = os.path.join(self.root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data if isinstance(data, bytes) else data.encode("utf-8"))
+
+    def uri(self, name):
+        return os.path.join(self.root, name)
+
+
+def storage_from_env():
+    """Pick the storage backend from STORAGE_BACKEND (gcs, the default, or local)"""
+    backend = os.environ.get("STORAGE_BACKEND", "gcs")
+    if backend == "local":
+        return LocalStorage(os.environ.get("LOCAL_STORAGE_DIR", "/tmp/nih_fetcher"))
+    bucket_name = os.environ.get("GCS_BUCKET_NAME")
+    if not bucket_name:
+        return None
+    return GCSStorage(bucket_name)
+
+
+def post_with_retries(session, url, payload, max_retries=MAX_RETRIES, timeout=30):
+    """POST with exponential backoff (plus jitter) on timeouts, 429 and 5xx"""
+    for attempt in range(max_retries + 1):
+        try:
+            response = session.post(url, json=payload, timeout=timeout)
+            if response.status_code not in RETRY_STATUS:
+                response.raise_for_status()
+                return response.json()
+            error = requests.exceptions.HTTPError(f"HTTP {response.status_code}", response=response)
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+            error = e
+        if attempt == max_retries:
+            raise error
+        delay = min(30, 2 ** attempt) + random.uniform(0, 1)
+        print(f"Warning: {error}; retrying in {delay:.1f}s (attempt {attempt + 1}/{max_retries})...")
+        time.sleep(delay)
+
+
+def encode_chunk(records):
+    """gzip-compressed NDJSON for one page of records"""
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode="wb") as gz:
+        for record in records:
+            gz.write(json.dumps(record).encode("utf-8"))
+            gz.write(b"\n")
+    return buf.getvalue()
+
+
+def stream_projects(storage, search_criteria, prefix, api_url=NIH_REPORTER_API_URL, session=None):
+    """
+    Page through RePORTER, writing each page as its own gzip NDJSON chunk
+    Only one page is held in memory at a time. A manifest listing the chunks is
+    written last, so readers can tell a complete export from a partial one.
+    Returns the manifest dict.
+    """
+    session = session or requests.Session()
+    payload = dict(search_criteria, offset=0, limit=PAGE_SIZE)
+    manifest = {
+        "source": api_url,
+        "criteria": search_criteria["criteria"],
+        "started_at": datetime.now().isoformat(),
+        "total_available": None,
+        "records": 0,
+        "chunks": [],
+        "truncated": False,
+        "complete": False
+    }
+
+    page = 0
+    try:
+        while True:
+            payload["offset"] = page * PAGE_SIZE
+            print(f"Fetching page {page + 1} (offset: {payload['offset']})...")
+            data = post_with_retries(session, api_url, payload)
+
+            if manifest["total_available"] is None:
+                manifest["total_available"] = data.get("meta", {}).get("total", 0)
+                print(f"Found {manifest['total_available']} total records.")
+
+            projects = data.get("results", [])
+            if not projects:
+                break
+
+            name = f"{prefix}/part-{page:05d}.ndjson.gz"
+            storage.write(name, encode_chunk(projects), "application/x-ndjson", content_encoding="gzip")
+            manifest["chunks"].append({"name": name, "records": len(projects)})
+            manifest["records"] += len(projects)
+
+            if manifest["records"] >= manifest["total_available"]:
+                break  # All records fetched
+            page += 1
+            if page * PAGE_SIZE > MAX_OFFSET:
+                print(f"Warning: hit RePORTER offset limit; {manifest['total_available'] - manifest['records']} records not fetched.")
+                manifest["truncated"] = True
+                break
+
+        manifest["complete"] = True
+    finally:
+        manifest["finished_at"] = datetime.now().isoformat()
+        storage.write(f"{prefix}/manifest.json", json.dumps(manifest, indent=2), "application/json")
+
+    return manifest
+
+
 def fetch_nih_data(request):
     """
     Fetches Smart and Connected Health (SCH) project data from NIH RePORTER API
-    and stores the raw JSON response in a Google Cloud Storage bucket.
+    and streams it, page by page, as gzip NDJSON chunks plus a manifest into a
+    Google Cloud Storage bucket (or a local directory with STORAGE_BACKEND=local).
     """
-    
-    # Configuration
-    NIH_REPORTER_API_URL = "https://api.reporter.nih.gov/v2/projects/search"
-    GCS_BUCKET_NAME = os.environ.get("GCS_BUCKET_NAME")
-    
-    if not GCS_BUCKET_NAME:
+
+    storage = storage_from_env()
+    if storage is None:
         print("Error: GCS_BUCKET_NAME environment variable not set.")
         return "Error: GCS_BUCKET_NAME environment variable not set.", 500
 
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(GCS_BUCKET_NAME)
-
     search_criteria = {
         "criteria": {
             "advanced_text_search": {
@@ -28,64 +163,30 @@ def fetch_nih_data(request):
                 "search_term": "\"Smart and Connected Health\"",
                 "operator": "and"
             }
-        },
-        "offset": 0,
-        "limit": 500  # Max limit per request
+        }
     }
 
-    all_projects = []
-    page = 0
-    total_records = None
+    timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    prefix = f"nih_raw_data/nih_sch_projects_{timestamp}"
 
     print(f"Starting NIH RePORTER data fetch for '{search_criteria['criteria']['advanced_text_search']['search_term']}'...")
 
-    while True:
-        search_criteria["offset"] = page * search_criteria["limit"]
-        print(f"Fetching page {page + 1} (offset: {search_criteria['offset']})...")
-
-        try:
-            response = requests.post(NIH_REPORTER_API_URL, json=search_criteria, timeout=30)
-            response.raise_for_status()  # Raise an exception for HTTP errors
-            data = response.json()
-
-            if total_records is None:
-                total_records = data.get("total", 0)
-                print(f"Found {total_records} total records.")
-            
-            projects = data.get("results", [])
-            all_projects.extend(projects)
-
-            if len(all_projects) >= total_records:
-                break # All records fetched
-            
-            page += 1
+    try:
+        manifest = stream_projects(storage, search_criteria, prefix)
+    except requests.exceptions.RequestException as e:
+        print(f"Error fetching data from NIH RePORTER API: {e}")
+        return f"Error fetching data: {e}", 500
+    except json.JSONDecodeError as e:
+        print(f"Error decoding JSON response: {e}")
+        return f"Error decoding JSON: {e}", 500
+    except Exception as e:
+        print(f"Error writing data to storage: {e}")
+        return f"Error writing data to storage: {e}", 500
 
-        except requests.exceptions.Timeout:
-            print(f"Warning: Request timed out for page {page + 1}. Retrying or skipping...")
-            # Implement retry logic if necessary, for now, just continue
-            page += 1 # Move to next page to avoid infinite loop on timeout
-        except requests.exceptions.RequestException as e:
-            print(f"Error fetching data from NIH RePORTER API: {e}")
-            return f"Error fetching data: {e}", 500
-        except json.JSONDecodeError as e:
-            print(f"Error decoding JSON response: {e}")
-            print(f"Response content: {response.text}")
-            return f"Error decoding JSON: {e}", 500
-
-    if not all_projects:
+    if not manifest["records"]:
         print("No projects found for the given criteria.")
         return "No projects found.", 200
 
-    # Save to GCS
-    timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
-    blob_name = f"nih_raw_data/nih_sch_projects_{timestamp}.json"
-    blob = bucket.blob(blob_name)
-    
-    try:
-        blob.upload_from_string(json.dumps(all_projects, indent=2), content_type="application/json")
-        print(f"Successfully uploaded {len(all_projects)} projects to gs://{GCS_BUCKET_NAME}/{blob_name}")
-        return f"Successfully fetched and stored {len(all_projects)} NIH SCH projects.", 200
-    except Exception as e:
-        print(f"Error uploading data to GCS: {e}")
-        return f"Error uploading data to GCS: {e}", 500
-
+    print(f"Successfully wrote {manifest['records']} projects in {len(manifest['chunks'])} chunks "
+          f"to {storage.uri(prefix)}/")
+    return f"Successfully fetched and stored {manifest['records']} NIH SCH projects.", 200
@@ -0,0 +1,73 @@
+"""
+Benchmark the NSF fetcher against a local HTTP stub
+Compares pages/sec of the sequential loop and the parallel window.
+
+    python bench_local.py --awards 2000 --latency 0.2 --concurrency 8
+"""
+
+import argparse
+import json
+import tempfile
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import main
+
+
+def make_stub(n_awards, latency):
+    """Stub of awards.json: 1-based offset, rpp page size, metadata.totalCount"""
+    awards = [{"id": str(1000000 + i), "title": f"Award {i}"} for i in range(n_awards)]
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            query = parse_qs(urlparse(self.path).query)
+            offset = int(query.get("offset", ["1"])[0]) - 1
+            rpp = int(query.get("rpp", ["25"])[0])
+            time.sleep(latency)
+            body = json.dumps({"response": {
+                "metadata": {"totalCount": n_awards},
+                "award": awards[offset:offset + rpp]
+            }}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--awards", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.2, help="Stub latency per request (s)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    server = make_stub(args.awards, args.latency)
+    api_url = f"http://127.0.0.1:{server.server_address[1]}/awards.json"
+    results = {}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = main.LocalStorage(tmp)
+        for mode in ("sequential", "parallel"):
+            manifest = main.stream_awards(storage, {"keyword": "bench"}, f"bench/{mode}",
+                                          mode=mode, concurrency=args.concurrency, api_url=api_url)
+            assert manifest["records"] == args.awards, manifest["records"]
+            results[mode] = manifest["pages_per_sec"]
+
+    server.shutdown()
+    print(f"\nsequential: {results['sequential']:.1f} pages/sec")
+    print(f"parallel:   {results['parallel']:.1f} pages/sec "
+          f"({results['parallel'] / results['sequential']:.1f}x, concurrency={args.concurrency})")
+
+
+if __name__ == "__main__":
+    main_cli()
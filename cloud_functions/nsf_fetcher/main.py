@@ -1,78 +1,258 @@
 import requests
 import os
+import io
+import gzip
 import json
-from google.cloud import storage
+import math
+import random
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from requests.adapters import HTTPAdapter
+
+# Configuration
+NSF_AWARDS_API_URL = os.environ.get("NSF_AWARDS_API_URL", "https://api.nsf.gov/services/v1/awards.json")
+RESULTS_PER_PAGE = 25  # Max results per page
+CONCURRENCY = int(os.environ.get("NSF_CONCURRENCY", "8"))
+FETCH_MODE = os.environ.get("NSF_FETCH_MODE", "parallel")  # parallel or sequential
+CHUNK_RECORDS = 1000  # Awards per gzip NDJSON chunk object
+MAX_RETRIES = 5
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class GCSStorage:
+    """Writes objects to a Google Cloud Storage bucket"""
+
+    def __init__(self, bucket_name):
+        from google.cloud import storage
+        self.bucket_name = bucket_name
+        self.bucket = storage.Client().bucket(bucket_name)
+
+    def write(self, name, data, content_type, content_encoding=None):
+        blob = self.bucket.blob(name)
+        if content_encoding:
+            blob.content_encoding = content_encoding
+        blob.upload_from_string(data, content_type=content_type)
+
+    def uri(self, name):
+        return f"gs://{self.bucket_name}/{name}"
+
+
+class LocalStorage:
+    """Local-filesystem stand-in for GCSStorage (same object names, under `root`)"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def write(self, name, data, content_type, content_encoding=None):
+        path = os.path.join(self.root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data if isinstance(data, bytes) else data.encode("utf-8"))
+
+    def uri(self, name):
+        return os.path.join(self.root, name)
+
+
+def storage_from_env():
+    """Pick the storage backend from STORAGE_BACKEND (gcs, the default, or local)"""
+    backend = os.environ.get("STORAGE_BACKEND", "gcs")
+    if backend == "local":
+        return LocalStorage(os.environ.get("LOCAL_STORAGE_DIR", "/tmp/nsf_fetcher"))
+    bucket_name = os.environ.get("GCS_BUCKET_NAME")
+    if not bucket_name:
+        return None
+    return GCSStorage(bucket_name)
+
+
+def make_session(concurrency=CONCURRENCY):
+    """HTTP session with a connection pool large enough for `concurrency` workers"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def fetch_page(session, search_params, page, api_url=NSF_AWARDS_API_URL,
+               max_retries=MAX_RETRIES, timeout=30):
+    """
+    Fetch one page (0-based) of awards, retrying with exponential backoff
+    Returns (awards, total count reported by the API or None)
+    """
+    params = dict(search_params, rpp=RESULTS_PER_PAGE, offset=page * RESULTS_PER_PAGE + 1)
+    for attempt in range(max_retries + 1):
+        try:
+            response = session.get(api_url, params=params, timeout=timeout)
+            if response.status_code not in RETRY_STATUS:
+                response.raise_for_status()
+                body = response.json().get("response", {})
+                total = body.get("metadata", {}).get("totalCount")
+                return body.get("award", []), total
+            error = requests.exceptions.HTTPError(f"HTTP {response.status_code}", response=response)
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+            error = e
+        if attempt == max_retries:
+            raise error
+        delay = min(30, 2 ** attempt) + random.uniform(0, 1)
+        print(f"Warning: page {page + 1}: {error}; retrying in {delay:.1f}s...")
+        time.sleep(delay)
+
+
+def iter_pages_sequential(session, search_params, api_url=NSF_AWARDS_API_URL):
+    """Original loop: one page at a time until an empty page comes back"""
+    page = 0
+    while True:
+        awards, _ = fetch_page(session, search_params, page, api_url)
+        if not awards:
+            return
+        yield awards
+        page += 1
+
+
+def iter_pages_parallel(session, search_params, api_url=NSF_AWARDS_API_URL, concurrency=CONCURRENCY):
+    """
+    Probe the result count with the first page, then keep up to `concurrency`
+    page requests in flight. Pages are yielded strictly in order.
+    If the API does not report a total, the window keeps sliding until an
+    empty page comes back.
+    """
+    first, total = fetch_page(session, search_params, 0, api_url)
+    if not first:
+        return
+    yield first
+
+    last_page = math.ceil(total / RESULTS_PER_PAGE) - 1 if total is not None else None
+    if total is not None:
+        print(f"Found {total} total awards ({last_page + 1} pages).")
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        inflight = deque()
+        next_page = 1
+        while True:
+            while len(inflight) < concurrency and (last_page is None or next_page <= last_page):
+                inflight.append(pool.submit(fetch_page, session, search_params, next_page, api_url))
+                next_page += 1
+            if not inflight:
+                return
+            awards, _ = inflight.popleft().result()
+            if not awards:
+                for future in inflight:
+                    future.cancel()
+                return
+            yield awards
+
+
+def encode_chunk(records):
+    """gzip-compressed NDJSON for a list of records"""
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode="wb") as gz:
+        for record in records:
+            gz.write(json.dumps(record).encode("utf-8"))
+            gz.write(b"\n")
+    return buf.getvalue()
+
+
+def stream_awards(storage, search_params, prefix, mode=FETCH_MODE, concurrency=CONCURRENCY,
+                  api_url=NSF_AWARDS_API_URL, session=None):
+    """
+    Fetch every page, de-duplicate on award id and write ordered gzip NDJSON
+    chunks of CHUNK_RECORDS awards plus a manifest. Returns the manifest dict.
+    """
+    session = session or make_session(concurrency)
+    if mode == "sequential":
+        pages = iter_pages_sequential(session, search_params, api_url)
+    else:
+        pages = iter_pages_parallel(session, search_params, api_url, concurrency)
+
+    manifest = {
+        "source": api_url,
+        "params": search_params,
+        "mode": mode,
+        "concurrency": concurrency if mode != "sequential" else 1,
+        "started_at": datetime.now().isoformat(),
+        "pages": 0,
+        "records": 0,
+        "duplicates": 0,
+        "chunks": [],
+        "complete": False
+    }
+    seen = set()
+    buffer = []
+    start = time.time()
+
+    def flush():
+        name = f"{prefix}/part-{len(manifest['chunks']):05d}.ndjson.gz"
+        storage.write(name, encode_chunk(buffer), "application/x-ndjson", content_encoding="gzip")
+        manifest["chunks"].append({"name": name, "records": len(buffer)})
+        buffer.clear()
+
+    try:
+        for awards in pages:
+            manifest["pages"] += 1
+            for award in awards:
+                award_id = award.get("id")
+                if award_id in seen:
+                    manifest["duplicates"] += 1
+                    continue
+                seen.add(award_id)
+                buffer.append(award)
+            if len(buffer) >= CHUNK_RECORDS:
+                flush()
+        if buffer:
+            flush()
+        manifest["records"] = len(seen)
+        manifest["complete"] = True
+    finally:
+        elapsed = time.time() - start
+        manifest["elapsed_sec"] = elapsed
+        manifest["pages_per_sec"] = manifest["pages"] / elapsed if elapsed else 0.0
+        manifest["finished_at"] = datetime.now().isoformat()
+        storage.write(f"{prefix}/manifest.json", json.dumps(manifest, indent=2), "application/json")
+
+    print(f"Fetched {manifest['pages']} pages in {elapsed:.1f}s "
+          f"({manifest['pages_per_sec']:.1f} pages/sec, mode={mode}).")
+    return manifest
+
 
 def fetch_nsf_data(request):
     """
     Fetches Smart and Connected Health (SCH) project data from the NSF Awards API
-    and stores the raw JSON response in a Google Cloud Storage bucket.
+    and stores it as ordered, de-duplicated gzip NDJSON chunks plus a manifest
+    in a Google Cloud Storage bucket (or a local directory with STORAGE_BACKEND=local).
     """
-    
-    # Configuration
-    NSF_AWARDS_API_URL = "https://api.nsf.gov/services/v1/awards.json"
-    GCS_BUCKET_NAME = os.environ.get("GCS_BUCKET_NAME")
-    
-    if not GCS_BUCKET_NAME:
+
+    storage = storage_from_env()
+    if storage is None:
         print("Error: GCS_BUCKET_NAME environment variable not set.")
         return "Error: GCS_BUCKET_NAME environment variable not set.", 500
 
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(GCS_BUCKET_NAME)
-
     search_params = {
-        "keyword": '"Smart and Connected Health"',
-        "rpp": 25,  # Max results per page
-        "offset": 1
+        "keyword": '"Smart and Connected Health"'
     }
 
-    all_awards = []
-    page = 0
+    timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    prefix = f"nsf_raw_data/nsf_sch_awards_{timestamp}"
 
-    print(f"Starting NSF Awards data fetch for keyword '{search_params['keyword']}'...")
+    print(f"Starting NSF Awards data fetch for keyword '{search_params['keyword']}' ({FETCH_MODE})...")
 
-    while True:
-        search_params["offset"] = (page * search_params["rpp"]) + 1
-        print(f"Fetching page {page + 1} (offset: {search_params['offset']})...")
+    try:
+        manifest = stream_awards(storage, search_params, prefix)
+    except requests.exceptions.RequestException as e:
+        print(f"Error fetching data from NSF Awards API: {e}")
+        return f"Error fetching data: {e}", 500
+    except json.JSONDecodeError as e:
+        print(f"Error decoding JSON response: {e}")
+        return f"Error decoding JSON: {e}", 500
+    except Exception as e:
+        print(f"Error writing data to storage: {e}")
+        return f"Error writing data to storage: {e}", 500
 
-        try:
-            response = requests.get(NSF_AWARDS_API_URL, params=search_params, timeout=30)
-            response.raise_for_status()
-            data = response.json()
-            
-            awards = data.get("response", {}).get("award", [])
-            if not awards:
-                print("No more awards found. Ending fetch.")
-                break
-            
-            all_awards.extend(awards)
-            page += 1
-
-        except requests.exceptions.Timeout:
-            print(f"Warning: Request timed out for page {page + 1}. Retrying or skipping...")
-            page += 1
-        except requests.exceptions.RequestException as e:
-            print(f"Error fetching data from NSF Awards API: {e}")
-            return f"Error fetching data: {e}", 500
-        except json.JSONDecodeError as e:
-            print(f"Error decoding JSON response: {e}")
-            print(f"Response content: {response.text}")
-            return f"Error decoding JSON: {e}", 500
-
-    if not all_awards:
+    if not manifest["records"]:
         print("No awards found for the given criteria.")
         return "No awards found.", 200
 
-    # Save to GCS
-    timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
-    blob_name = f"nsf_raw_data/nsf_sch_awards_{timestamp}.json"
-    blob = bucket.blob(blob_name)
-    
-    try:
-        blob.upload_from_string(json.dumps(all_awards, indent=2), content_type="application/json")
-        print(f"Successfully uploaded {len(all_awards)} awards to gs://{GCS_BUCKET_NAME}/{blob_name}")
-        return f"Successfully fetched and stored {len(all_awards)} NSF SCH awards.", 200
-    except Exception as e:
-        print(f"Error uploading data to GCS: {e}")
-        return f"Error uploading data to GCS: {e}", 500
+    print(f"Successfully wrote {manifest['records']} awards in {len(manifest['chunks'])} chunks "
+          f"to {storage.uri(prefix)}/")
+    return f"Successfully fetched and stored {manifest['records']} NSF SCH awards.", 200
@@ -2,18 +2,31 @@
 """
 Inspect and validate NIH Parquet files in GCS
 Project: od-cl-odss-conroyri-f75a
+Every file is profiled in one parallel, streaming pass (column_profiler.py:
+row group at a time, HyperLogLog distinct counts, top-k values, text length
+histograms). Profiles are cached under data/profiles/raw/ and reused while a
+file's size/generation is unchanged, so a newly added year is the only file read.
+
+Usage:
+  python3 scripts/00_inspect_parquet_files.py
+  python3 scripts/00_inspect_parquet_files.py --workers 16 --force
 """
 
 from google.cloud import storage
-import pandas as pd
 import pyarrow.parquet as pq
 from pathlib import Path
+import argparse
 import json
+import os
 from collections import defaultdict
 import sys
 
+from column_profiler import load_profile, profile_many
+from parquet_meta import open_file
+
 PROJECT_ID = "od-cl-odss-conroyri-f75a"
 BUCKET_NAME = "od-cl-odss-conroyri-nih-raw-data"
+PROFILE_DIR = "data/profiles/raw"
 
 storage_client = storage.Client(project=PROJECT_ID)
 
@@ -84,74 +97,64 @@ def list_all_files():
     parquet_files = [blob.name for blob in blobs if blob.name.endswith('.parquet')]
     return parquet_files
 
-def inspect_parquet_file(file_path):
-    """Download and inspect a single Parquet file"""
+def inspect_parquet_file(file_path, profile):
+    """Report on a single Parquet file from its streamed column profile"""
     
     print(f"\n{'='*70}")
     print(f"INSPECTING: {file_path}")
     print(f"{'='*70}\n")
     
-    # Download to temp location
-    bucket = storage_client.bucket(BUCKET_NAME)
-    blob = bucket.blob(file_path)
-    
-    temp_file = f"/tmp/{Path(file_path).name}"
+    uri = f"gs://{BUCKET_NAME}/{file_path}"
     
-    print(f"Downloading to {temp_file}...", end="", flush=True)
-    blob.download_to_filename(temp_file)
-    print(" ✓")
+    # Read Parquet metadata (footer only)
+    print("--- Parquet Metadata ---")
+    with open_file(uri) as f:
+        parquet_file = pq.ParquetFile(f)
+        print(f"Number of row groups: {parquet_file.num_row_groups}")
+        print(f"Number of columns: {len(parquet_file.schema)}")
+        print(f"Total rows: {parquet_file.metadata.num_rows:,}")
+        types = {field.name: str(field.type) for field in parquet_file.schema_arrow}
+        sample = next(parquet_file.iter_batches(batch_size=3), None)
     
-    # Read Parquet metadata
-    print("\n--- Parquet Metadata ---")
-    parquet_file = pq.ParquetFile(temp_file)
-    print(f"Number of row groups: {parquet_file.num_row_groups}")
-    print(f"Number of columns: {len(parquet_file.schema)}")
-    print(f"Total rows: {parquet_file.metadata.num_rows:,}")
-    
-    # Read into pandas for detailed inspection
-    print("\n--- Loading data sample ---")
-    df = pd.read_parquet(temp_file)
-    
-    print(f"DataFrame shape: {df.shape[0]:,} rows × {df.shape[1]} columns")
-    print(f"Memory usage: {df.memory_usage(deep=True).sum() / (1024**2):.1f} MB")
+    summary = profile.summary()
+    columns = list(summary)
+    total_rows = parquet_file.metadata.num_rows
     
     # Schema
     print("\n--- Column Schema ---")
-    print(f"{'Column Name':<40} {'Type':<15} {'Non-Null':<12} {'Null %'}")
-    print("-" * 80)
+    print(f"{'Column Name':<40} {'Type':<15} {'Non-Null':<12} {'Null %':<8} {'~Distinct'}")
+    print("-" * 92)
     
-    for col in df.columns:
-        dtype = str(df[col].dtype)
-        non_null = df[col].notna().sum()
-        null_pct = (df[col].isna().sum() / len(df)) * 100
-        print(f"{col:<40} {dtype:<15} {non_null:>10,}  {null_pct:>6.1f}%")
+    for col, s in summary.items():
+        non_null = s['rows'] - round(s['null_rate'] * s['rows'])
+        print(f"{col:<40} {types[col][:15]:<15} {non_null:>10,}  {s['null_rate'] * 100:>6.1f}%  {s['approx_distinct']:>10,}")
     
     # Key columns detection
     print("\n--- Key Columns Detected ---")
     key_columns = []
     
     # Common NIH field names
-    id_cols = [col for col in df.columns if any(
+    id_cols = [col for col in columns if any(
         x in col.upper() for x in ['APPLICATION_ID', 'APPL_ID', 'PROJECT_NUM', 'CORE_PROJECT']
     )]
     
-    title_cols = [col for col in df.columns if any(
+    title_cols = [col for col in columns if any(
         x in col.upper() for x in ['PROJECT_TITLE', 'TITLE']
     )]
     
-    abstract_cols = [col for col in df.columns if any(
+    abstract_cols = [col for col in columns if any(
         x in col.upper() for x in ['ABSTRACT', 'PHR']
     )]
     
-    fiscal_cols = [col for col in df.columns if any(
+    fiscal_cols = [col for col in columns if any(
         x in col.upper() for x in ['FISCAL_YEAR', 'FY', 'YEAR']
     )]
     
-    ic_cols = [col for col in df.columns if any(
+    ic_cols = [col for col in columns if any(
         x in col.upper() for x in ['IC_NAME', 'INSTITUTE', 'CENTER', 'AGENCY']
     )]
     
-    cost_cols = [col for col in df.columns if any(
+    cost_cols = [col for col in columns if any(
         x in col.upper() for x in ['TOTAL_COST', 'AWARD_AMOUNT', 'FUNDING']
     )]
     
@@ -172,54 +175,51 @@ def inspect_parquet_file(file_path):
     # Data quality checks
     print("\n--- Data Quality Checks ---")
     
-    # Check for ID column
+    # Check for ID column (HyperLogLog estimate, ~1% error)
     if id_cols:
         id_col = id_cols[0]
-        unique_ids = df[id_col].nunique()
-        total_rows = len(df)
-        print(f"  Unique IDs: {unique_ids:,} / {total_rows:,} rows", end="")
-        if unique_ids == total_rows:
-            print(" ✓ (No duplicates)")
+        unique_ids = summary[id_col]['approx_distinct']
+        print(f"  Unique IDs: ~{unique_ids:,} / {total_rows:,} rows", end="")
+        if unique_ids >= 0.98 * total_rows:
+            print(" ✓ (No duplicates beyond sketch error)")
         else:
-            print(f" ⚠ ({total_rows - unique_ids:,} duplicates)")
+            print(f" ⚠ (~{total_rows - unique_ids:,} duplicates)")
     
     # Check text fields
-    if title_cols:
-        title_col = title_cols[0]
-        avg_length = df[title_col].str.len().mean()
-        empty = df[title_col].isna().sum()
-        print(f"  Title avg length: {avg_length:.0f} chars, {empty:,} empty")
-    
-    if abstract_cols:
-        abstract_col = abstract_cols[0]
-        avg_length = df[abstract_col].str.len().mean()
-        empty = df[abstract_col].isna().sum()
-        print(f"  Abstract avg length: {avg_length:.0f} chars, {empty:,} empty")
-    
-    # Fiscal year distribution
+    for label, cols in [('Title', title_cols), ('Abstract', abstract_cols)]:
+        if cols:
+            s = summary[cols[0]]
+            empty = round(s['null_rate'] * s['rows'])
+            print(f"  {label} avg length: {s.get('mean_length', 0):.0f} chars, {empty:,} empty")
+            if 'length_histogram' in s:
+                print(f"    length histogram: " + ", ".join(
+                    f"{b}: {n:,}" for b, n in s['length_histogram'].items() if n))
+    
+    # Fiscal year distribution (exact: top-k counts are exact below TOPK_CAPACITY values)
+    fy_dist = {}
     if fiscal_cols:
         fy_col = fiscal_cols[0]
         print(f"\n  Fiscal year distribution:")
-        fy_dist = df[fy_col].value_counts().sort_index()
+        fy_dist = {int(year) if isinstance(year, float) and year.is_integer() else year: count
+                   for year, count in sorted(profile.columns[fy_col].topk.counts.items())}
         for year, count in fy_dist.items():
             print(f"    FY{year}: {count:,} records")
     
     # Show sample rows
     print("\n--- Sample Data (first 3 rows) ---")
-    sample_cols = key_columns[:3] if key_columns else df.columns[:5]
-    print(df[sample_cols].head(3).to_string(index=False))
-    
-    # Clean up
-    Path(temp_file).unlink()
+    sample_cols = key_columns[:3] if key_columns else columns[:5]
+    if sample is not None:
+        print(sample.to_pandas()[sample_cols].to_string(index=False))
     
     return {
         'file': file_path,
-        'rows': len(df),
-        'columns': list(df.columns),
+        'rows': total_rows,
+        'columns': columns,
         'id_columns': id_cols,
         'has_title': bool(title_cols),
         'has_abstract': bool(abstract_cols),
-        'fiscal_years': fy_dist.to_dict() if fiscal_cols else {}
+        'fiscal_years': fy_dist,
+        'profile': summary
     }
 
 def generate_loading_script(parquet_files, metadata_list):
@@ -344,6 +344,11 @@ load_parquet(
 def main():
     """Main execution"""
     
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--force', action='store_true', help='Re-profile unchanged files')
+    args = parser.parse_args()
+    
     print(f"\n{'#'*70}")
     print(f"# NIH Parquet File Inspector")
     print(f"# Project: {PROJECT_ID}")
@@ -362,19 +367,19 @@ def main():
     print(f"Found {len(parquet_files)} Parquet files")
     print(f"{'='*70}")
     
-    # Ask user how many to inspect in detail
-    if len(parquet_files) > 5:
-        print(f"\nInspecting first 5 files in detail...")
-        print("(To inspect all, modify the script)")
-        files_to_inspect = parquet_files[:5]
-    else:
-        files_to_inspect = parquet_files
+    # Profile every file in parallel; unchanged files reuse their cached profile
+    jobs = [(f"gs://{BUCKET_NAME}/{name}", os.path.join(PROFILE_DIR, f"{name}.json"))
+            for name in parquet_files]
+    errors = profile_many(jobs, workers=args.workers, force=args.force)
     
     # Inspect each file
     metadata_list = []
-    for file_path in files_to_inspect:
+    for file_path, (uri, profile_file) in zip(parquet_files, jobs):
+        if uri in errors:
+            print(f"\n❌ Error inspecting {file_path}: {errors[uri]}")
+            continue
         try:
-            meta = inspect_parquet_file(file_path)
+            meta = inspect_parquet_file(file_path, load_profile(profile_file))
             metadata_list.append(meta)
         except Exception as e:
             print(f"\n❌ Error inspecting {file_path}: {e}")
@@ -2,317 +2,401 @@
 """
 Download NIH ExPORTER data using RePORTER API
 Project: od-cl-odss-conroyri-f75a
-Simplified version - downloads all projects directly
+Concurrent version - keeps N requests in flight per year and across years,
+paced by a shared token-bucket rate limiter (see reporter_client.py).
+Years larger than the 15K offset limit are split into slices that each fit.
+Abstract fetches are pipelined: each page of projects queues its abstract
+batches as soon as it arrives.
+Every page is checkpointed as a Parquet fragment (see reporter_store.py), so
+an interrupted run resumes where it stopped. Output is a YEAR=-partitioned
+dataset: data/raw/reporter/{projects,abstracts}/YEAR={year}/*.parquet
+With --delta, only records changed since each year's stored high-water mark
+are fetched and upserted by appl_id.
 """
 
-import requests
-import pandas as pd
-import json
+import argparse
 import time
-from datetime import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, date
 import subprocess
-import sys
+
+from reporter_client import (
+    ReporterClient, API_BASE_URL, MAX_SLICE_RECORDS, count_records, plan_slices
+)
+from reporter_store import ReporterStore, STORE_DIR
 
 # Configuration
 PROJECT_ID = "od-cl-odss-conroyri-f75a"
 BUCKET = "gs://od-cl-odss-conroyri-nih-raw-data"
-API_BASE_URL = "https://api.reporter.nih.gov/v2/projects/search"
 
 # Fiscal years to download
 FISCAL_YEARS = list(range(2020, 2026))  # 2020-2025
 
-# API limits
-MAX_OFFSET = 14999
+# API limits (MAX_OFFSET handling lives in reporter_client.plan_slices)
 BATCH_SIZE = 500
+ABSTRACT_BATCH_SIZE = 100
+
+# Field whose per-year maximum is the high-water mark for --delta runs
+DELTA_FIELD = "date_added"
+
+PROJECT_FIELDS = [
+    "ApplId",
+    "SubprojectId",
+    "FiscalYear",
+    "Organization",
+    "AwardAmount",
+    "AwardNoticeDate",
+    "Agency",
+    "AgencyIcFundings",
+    "ContactPiName",
+    "FullProjectNum",
+    "OrgCity",
+    "OrgCountry",
+    "OrgDept",
+    "OrgDistrict",
+    "OrgDuns",
+    "OrgFips",
+    "OrgName",
+    "OrgState",
+    "OrgZipcode",
+    "PhrText",
+    "PiIds",
+    "PiNames",
+    "ProgramOfficerName",
+    "ProjectStartDate",
+    "ProjectEndDate",
+    "ProjectTerms",
+    "ProjectTitle",
+    "ProjectNum",
+    "ProjectSerialNum",
+    "StudySection",
+    "StudySectionName",
+    "SuffixCode",
+    "DateAdded"
+]
+
+ABSTRACT_FIELDS = [
+    "ApplId",
+    "AbstractText",
+    "PhrText",
+    "ProjectTitle"
+]
+
+
+def projects_payload(criteria, offset):
+    """Search payload for one page of a slice"""
+    return {
+        "criteria": criteria,
+        "offset": offset,
+        "limit": BATCH_SIZE,
+        "include_fields": PROJECT_FIELDS,
+        "sort_field": "ApplId",
+        "sort_order": "asc"
+    }
+
+
+def abstracts_payload(appl_ids):
+    """Search payload for one batch of abstracts"""
+    return {
+        "criteria": {
+            "appl_ids": appl_ids
+        },
+        "offset": 0,
+        "limit": len(appl_ids),
+        "include_fields": ABSTRACT_FIELDS
+    }
+
 
-def download_projects_for_year(fiscal_year):
+def compact_and_upload(store, kind, fiscal_year):
+    """Compact a year's fragments into the YEAR= dataset and copy to GCS"""
+    local_path, rows = store.compact(kind, fiscal_year)
+    if not local_path:
+        return 0
+    print(f"  ✓ FY{fiscal_year}: {rows:,} unique {kind} in {local_path}")
+
+    gcs_path = f"{BUCKET}/reporter/{kind}/YEAR={fiscal_year}/{kind}_{fiscal_year}.parquet"
+    result = subprocess.run([
+        'gsutil', 'cp', local_path, gcs_path
+    ], capture_output=True, text=True)
+
+    if result.returncode == 0:
+        print(f"  ✓ Uploaded to {gcs_path}")
+    else:
+        print(f"  ⚠ Upload warning: {result.stderr}")
+
+    return rows
+
+
+class AbstractPipeline:
     """
-    Download all projects for a fiscal year
-    Downloads in batches up to the 15K offset limit
+    Fetches abstracts for one fiscal year, one project page at a time
+    Batches are submitted to the shared request pool as soon as a page of
+    project IDs arrives, so abstracts download while projects are still paging.
+    Each project page's abstracts are checkpointed as one fragment, written
+    only when all of its batches succeeded.
     """
-    
-    print(f"\n{'='*60}")
-    print(f"Downloading Projects for FY{fiscal_year}")
-    print(f"{'='*60}")
-    
-    all_projects = []
-    offset = 0
-    
-    while offset < MAX_OFFSET:
-        print(f"  Fetching records {offset:,} to {offset + BATCH_SIZE:,}...", end="", flush=True)
-        
-        payload = {
-            "criteria": {
-                "fiscal_years": [fiscal_year]
-            },
-            "offset": offset,
-            "limit": BATCH_SIZE,
-            "include_fields": [
-                "ApplId",
-                "SubprojectId", 
-                "FiscalYear",
-                "Organization",
-                "AwardAmount",
-                "AwardNoticeDate",
-                "Agency",
-                "AgencyIcFundings",
-                "ContactPiName",
-                "FullProjectNum",
-                "OrgCity",
-                "OrgCountry",
-                "OrgDept",
-                "OrgDistrict",
-                "OrgDuns",
-                "OrgFips",
-                "OrgName",
-                "OrgState",
-                "OrgZipcode",
-                "PhrText",
-                "PiIds",
-                "PiNames",
-                "ProgramOfficerName",
-                "ProjectStartDate",
-                "ProjectEndDate",
-                "ProjectTerms",
-                "ProjectTitle",
-                "ProjectNum",
-                "ProjectSerialNum",
-                "StudySection",
-                "StudySectionName",
-                "SuffixCode"
-            ],
-            "sort_field": "ApplId",
-            "sort_order": "asc"
-        }
-        
-        try:
-            response = requests.post(API_BASE_URL, json=payload, timeout=60)
-            response.raise_for_status()
-            
-            data = response.json()
-            results = data.get("results", [])
-            
-            if not results:
-                print(" No more records")
-                break
-            
-            all_projects.extend(results)
-            total_count = data.get("meta", {}).get("total", 0)
-            print(f" ✓ ({len(results)} records, {total_count:,} total available)")
-            
-            # Check if we've reached the end or hit the offset limit
-            if offset + BATCH_SIZE >= total_count:
-                print(f"  ✓ All records retrieved for FY{fiscal_year}")
-                break
-            
-            if offset + BATCH_SIZE >= MAX_OFFSET:
-                print(f"  ⚠ Hit API offset limit of {MAX_OFFSET}")
-                print(f"  Retrieved {len(all_projects):,} of {total_count:,} total projects")
-                print(f"  Missing ~{total_count - len(all_projects):,} projects")
-                break
-            
-            offset += BATCH_SIZE
-            time.sleep(0.3)  # Rate limiting
-            
-        except requests.exceptions.RequestException as e:
-            print(f"\n    Error: {e}")
-            time.sleep(2)
-            break
-        except Exception as e:
-            print(f"\n    Unexpected error: {e}")
-            break
-    
-    if all_projects:
-        # Convert to DataFrame
-        df = pd.json_normalize(all_projects)
-        df = df.drop_duplicates(subset=['appl_id'])
-        
-        print(f"\n  Total unique projects downloaded: {len(df):,}")
-        
-        # Save locally
-        local_path = f"data/raw/projects_fy{fiscal_year}.csv"
-        df.to_csv(local_path, index=False, encoding='utf-8')
-        print(f"  ✓ Saved to {local_path}")
-        
-        # Upload to GCS
-        gcs_path = f"{BUCKET}/projects/fy{fiscal_year}/projects_fy{fiscal_year}.csv"
-        result = subprocess.run([
-            'gsutil', 'cp', local_path, gcs_path
-        ], capture_output=True, text=True)
-        
-        if result.returncode == 0:
-            print(f"  ✓ Uploaded to {gcs_path}")
-        else:
-            print(f"  ⚠ Upload warning: {result.stderr}")
-        
-        return len(df)
-    
-    return 0
-
-def download_abstracts_for_year(fiscal_year):
+
+    def __init__(self, client, pool, store, fiscal_year):
+        self.client = client
+        self.pool = pool
+        self.store = store
+        self.fiscal_year = fiscal_year
+        self.pages = []
+        self.seen = set()
+        self.failed = 0
+        self.lock = threading.Lock()
+
+    def submit_page(self, page_key, appl_ids):
+        key = self.store.page_key('abstracts', {'project_page': page_key}, 0)
+        if self.store.is_done(key):
+            return
+        with self.lock:
+            appl_ids = [i for i in appl_ids if i not in self.seen]
+            self.seen.update(appl_ids)
+        futures = [
+            self.pool.submit(self.client.search, abstracts_payload(appl_ids[i:i + ABSTRACT_BATCH_SIZE]))
+            for i in range(0, len(appl_ids), ABSTRACT_BATCH_SIZE)
+        ]
+        with self.lock:
+            self.pages.append((key, futures))
+
+    def collect(self):
+        failed = 0
+        for key, futures in self.pages:
+            abstracts = []
+            try:
+                for future in futures:
+                    abstracts.extend(future.result().get("results", []))
+            except Exception as e:
+                failed += 1
+                print(f"\n  Error (FY{self.fiscal_year} abstracts): {e}")
+                continue
+            self.store.write_fragment('abstracts', self.fiscal_year, key, abstracts)
+        self.failed = failed
+        if failed:
+            print(f"  ⚠ FY{self.fiscal_year}: {failed} abstract pages failed after retries "
+                  f"(re-run to resume)")
+
+
+def slice_offsets(total):
+    """Page offsets needed to read a slice of `total` records"""
+    return list(range(0, min(total, MAX_SLICE_RECORDS), BATCH_SIZE))
+
+
+def year_criteria(store, fiscal_year, delta=False, delta_field=DELTA_FIELD):
     """
-    Download abstracts for a fiscal year
-    Uses project IDs from already-downloaded projects file
+    Criteria and plan key for a fiscal year
+    In delta mode only records whose `delta_field` is on or after the stored
+    high-water mark are requested; the boundary day is re-fetched on purpose
+    and de-duplicated by the upsert.
     """
-    
-    print(f"\n{'='*60}")
-    print(f"Downloading Abstracts for FY{fiscal_year}")
-    print(f"{'='*60}")
-    
-    # Load project IDs from the projects file
-    try:
-        projects_df = pd.read_csv(f"data/raw/projects_fy{fiscal_year}.csv")
-    except FileNotFoundError:
-        print(f"  ⚠ Projects file not found for FY{fiscal_year}, skipping abstracts")
-        return 0
-    
-    project_ids = projects_df['appl_id'].unique().tolist()
-    print(f"  Found {len(project_ids):,} projects to get abstracts for")
-    
-    all_abstracts = []
-    
-    # Get abstracts in batches
-    batch_size = 100
-    total_batches = (len(project_ids) + batch_size - 1) // batch_size
-    
-    for i in range(0, len(project_ids), batch_size):
-        batch = project_ids[i:i+batch_size]
-        batch_num = i // batch_size + 1
-        
-        if batch_num % 20 == 0:  # Print every 20 batches
-            print(f"  Batch {batch_num}/{total_batches}...", end="", flush=True)
-        
-        payload = {
-            "criteria": {
-                "appl_ids": batch
-            },
-            "offset": 0,
-            "limit": batch_size,
-            "include_fields": [
-                "ApplId",
-                "AbstractText",
-                "PhrText",
-                "ProjectTitle"
-            ]
-        }
-        
+    criteria = {"fiscal_years": [fiscal_year]}
+    if not delta:
+        return criteria, str(fiscal_year)
+
+    state = store.get_sync_state(fiscal_year, delta_field)
+    if state is None:
+        print(f"  FY{fiscal_year}: no {delta_field} high-water mark yet, running full download")
+        return criteria, str(fiscal_year)
+
+    from_date = state['high_water_mark'][:10]
+    criteria[delta_field] = {"from_date": from_date, "to_date": date.today().isoformat()}
+    print(f"  FY{fiscal_year}: delta since {delta_field} >= {from_date}")
+    # Keyed by the previous sync, so an interrupted delta resumes but a new one refetches
+    return criteria, f"{fiscal_year}:{delta_field}>={from_date}@{state['synced_at']}"
+
+
+def download_projects_for_year(client, pool, store, fiscal_year, on_page=None,
+                               replan=False, delta=False, delta_field=DELTA_FIELD):
+    """
+    Download all projects for a fiscal year into checkpointed fragments
+    Years above the 15K offset limit are partitioned (IC, award notice date,
+    activity code) until every slice fits; the plan is saved in the manifest
+    so a restarted run reuses it and skips pages that already completed.
+    Missing pages are requested concurrently through the shared pool.
+    `on_page(page_key, appl_ids)` is called for every page, fetched or resumed.
+    Returns (records matching the criteria, number of failed pages).
+    """
+
+    criteria, plan_key = year_criteria(store, fiscal_year, delta, delta_field)
+    plan = None if replan else store.get_plan(plan_key)
+    if plan is None:
+        year_total = count_records(client, criteria)
+        print(f"  FY{fiscal_year}: {year_total:,} total available")
+        slices = plan_slices(client, pool, criteria, total=year_total)
+        plan = {'total': year_total, 'slices': slices}
+        store.save_plan(plan_key, plan)
+    else:
+        print(f"  FY{fiscal_year}: resuming saved plan ({plan['total']:,} total available)")
+
+    pages = [(s, offset) for s in plan['slices'] for offset in slice_offsets(s['total'])]
+    futures = {}
+    resumed = 0
+    for s, offset in pages:
+        key = store.page_key('projects', s['criteria'], offset, plan_key)
+        if store.is_done(key):
+            resumed += 1
+            if on_page:
+                on_page(key, store.fragment_ids(key))
+            continue
+        future = pool.submit(client.search, projects_payload(s['criteria'], offset))
+        futures[future] = (key, s, offset)
+
+    print(f"  FY{fiscal_year}: {len(plan['slices'])} slices, {len(pages)} pages "
+          f"({resumed} already complete, {len(futures)} to fetch)")
+
+    failed_pages = 0
+    for future in as_completed(futures):
+        key, s, offset = futures[future]
         try:
-            response = requests.post(API_BASE_URL, json=payload, timeout=60)
-            response.raise_for_status()
-            
-            results = response.json().get("results", [])
-            all_abstracts.extend(results)
-            
-            if batch_num % 20 == 0:
-                print(f" ✓ ({len(all_abstracts):,} total)")
-            
-            time.sleep(0.3)  # Rate limiting
-            
+            results = future.result().get("results", [])
         except Exception as e:
-            if batch_num % 20 == 0:
-                print(f"\n  Error: {e}")
+            failed_pages += 1
+            print(f"\n  Error (FY{fiscal_year} slice {s['criteria']} offset {offset:,}): {e}")
             continue
-    
-    if all_abstracts:
-        # Convert to DataFrame
-        df = pd.json_normalize(all_abstracts)
-        df = df.drop_duplicates(subset=['appl_id'])
-        
-        print(f"\n  Total unique abstracts: {len(df):,}")
-        
-        # Save locally
-        local_path = f"data/raw/abstracts_fy{fiscal_year}.csv"
-        df.to_csv(local_path, index=False, encoding='utf-8')
-        print(f"  ✓ Saved to {local_path}")
-        
-        # Upload to GCS
-        gcs_path = f"{BUCKET}/abstracts/fy{fiscal_year}/abstracts_fy{fiscal_year}.csv"
-        result = subprocess.run([
-            'gsutil', 'cp', local_path, gcs_path
-        ], capture_output=True, text=True)
-        
-        if result.returncode == 0:
-            print(f"  ✓ Uploaded to {gcs_path}")
-        else:
-            print(f"  ⚠ Upload warning: {result.stderr}")
-        
-        return len(df)
-    
-    return 0
+        store.write_fragment('projects', fiscal_year, key, results)
+        if on_page and results:
+            on_page(key, [p['appl_id'] for p in results])
+
+    if failed_pages:
+        print(f"  ⚠ FY{fiscal_year}: {failed_pages} pages failed after retries (re-run to resume)")
+
+    incomplete = [s for s in plan['slices'] if not s['complete']]
+    if incomplete:
+        print(f"  ⚠ FY{fiscal_year}: {len(incomplete)} slices over the offset limit")
+
+    return plan['total'], failed_pages + len(incomplete)
+
+
+def process_year(client, pool, store, fiscal_year, replan=False,
+                 delta=False, delta_field=DELTA_FIELD):
+    """Download (or delta-sync) projects and pipelined abstracts for one fiscal year"""
+    year_start = time.time()
+    abstracts = AbstractPipeline(client, pool, store, fiscal_year)
+    is_delta = delta and store.get_high_water_mark(fiscal_year, delta_field) is not None
+
+    matched, failures = download_projects_for_year(
+        client, pool, store, fiscal_year,
+        on_page=abstracts.submit_page,
+        replan=replan,
+        delta=delta,
+        delta_field=delta_field
+    )
+    project_count = compact_and_upload(store, 'projects', fiscal_year)
+    if is_delta:
+        print(f"  ✓ FY{fiscal_year}: upserted {matched:,} changed projects")
+    elif project_count < matched:
+        print(f"  ⚠ FY{fiscal_year}: have {project_count:,} of {matched:,} total projects")
+    else:
+        print(f"  ✓ FY{fiscal_year}: all {matched:,} records retrieved")
+
+    abstracts.collect()
+    abstract_count = compact_and_upload(store, 'abstracts', fiscal_year)
+
+    # Only advance the high-water mark once every page is safely stored
+    if failures == 0 and abstracts.failed == 0:
+        hwm = store.update_high_water_mark(fiscal_year, delta_field)
+        if hwm:
+            print(f"  ✓ FY{fiscal_year}: {delta_field} high-water mark now {hwm}")
+
+    return {
+        'year': fiscal_year,
+        'projects': project_count,
+        'abstracts': abstract_count,
+        'time_min': (time.time() - year_start) / 60
+    }
+
 
 def main():
     """Main execution"""
-    
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--years', type=int, nargs='+', default=FISCAL_YEARS,
+                        help='Fiscal years to download (default: 2020-2025)')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='Requests kept in flight across all years (default: 8)')
+    parser.add_argument('--rate', type=float, default=3.0,
+                        help='Shared request rate limit in requests/sec (default: 3)')
+    parser.add_argument('--api-url', default=API_BASE_URL,
+                        help='RePORTER search endpoint (override for a local stand-in)')
+    parser.add_argument('--store', default=STORE_DIR,
+                        help=f'Checkpoint/dataset directory (default: {STORE_DIR})')
+    parser.add_argument('--replan', action='store_true',
+                        help='Re-probe slice plans instead of resuming saved ones')
+    parser.add_argument('--delta', action='store_true',
+                        help='Only fetch records changed since the last successful sync and upsert them')
+    parser.add_argument('--delta-field', default=DELTA_FIELD,
+                        choices=['date_added', 'award_notice_date'],
+                        help=f'High-water mark field for --delta (default: {DELTA_FIELD})')
+    args = parser.parse_args()
+
     print(f"\n{'#'*60}")
     print(f"# NIH Data Download Pipeline (API Method)")
     print(f"# Project: {PROJECT_ID}")
-    print(f"# Simplified version - direct download")
+    print(f"# Concurrent version - {args.concurrency} in flight, {args.rate:g} req/s limit")
     print(f"# Start time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     print(f"{'#'*60}\n")
-    
+
     start_time = time.time()
-    total_projects = 0
-    total_abstracts = 0
-    
+    client = ReporterClient(api_url=args.api_url, concurrency=args.concurrency, rate=args.rate)
+    store = ReporterStore(args.store)
+
     year_stats = []
-    
-    for year in FISCAL_YEARS:
-        year_start = time.time()
-        
-        try:
-            # Download projects
-            project_count = download_projects_for_year(year)
-            total_projects += project_count
-            
-            # Download abstracts
-            abstract_count = download_abstracts_for_year(year)
-            total_abstracts += abstract_count
-            
-            year_elapsed = time.time() - year_start
-            year_stats.append({
-                'year': year,
-                'projects': project_count,
-                'abstracts': abstract_count,
-                'time_min': year_elapsed / 60
-            })
-            
-        except Exception as e:
-            print(f"\n❌ Error processing FY{year}: {e}")
-            import traceback
-            traceback.print_exc()
-            continue
-    
+
+    # Year orchestrators only wait on futures; all HTTP work goes through `pool`
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool, \
+            ThreadPoolExecutor(max_workers=len(args.years)) as year_pool:
+        year_futures = {
+            year_pool.submit(process_year, client, pool, store, year,
+                             args.replan, args.delta, args.delta_field): year
+            for year in args.years
+        }
+        for future in as_completed(year_futures):
+            year = year_futures[future]
+            try:
+                year_stats.append(future.result())
+            except Exception as e:
+                print(f"\n❌ Error processing FY{year}: {e}")
+                import traceback
+                traceback.print_exc()
+
+    client.close()
+    year_stats.sort(key=lambda s: s['year'])
+    total_projects = sum(s['projects'] for s in year_stats)
+    total_abstracts = sum(s['abstracts'] for s in year_stats)
     total_elapsed = time.time() - start_time
-    
+
     print(f"\n{'='*60}")
     print(f"DOWNLOAD COMPLETE")
     print(f"{'='*60}")
     print(f"Total time: {total_elapsed/60:.1f} minutes")
     print(f"Total projects: {total_projects:,}")
     print(f"Total abstracts: {total_abstracts:,}")
-    
+    client.stats.report("API throughput")
+
     print(f"\n{'='*60}")
     print(f"Summary by Year:")
     print(f"{'='*60}")
     for stat in year_stats:
         print(f"  FY{stat['year']}: {stat['projects']:,} projects, "
               f"{stat['abstracts']:,} abstracts ({stat['time_min']:.1f} min)")
-    
+
     # List local files
     print(f"\n{'='*60}")
     print(f"Downloaded files:")
     print(f"{'='*60}")
-    result = subprocess.run(['ls', '-lh', 'data/raw/'], 
-                          capture_output=True, text=True)
+    result = subprocess.run(['ls', '-lhR', args.store],
+                            capture_output=True, text=True)
     print(result.stdout)
-    
+
     print(f"\n{'='*60}")
     print(f"Cloud Storage:")
     print(f"{'='*60}")
-    result = subprocess.run(['gsutil', 'ls', f'{BUCKET}/projects/'], 
-                          capture_output=True, text=True)
+    result = subprocess.run(['gsutil', 'ls', f'{BUCKET}/reporter/projects/'],
+                            capture_output=True, text=True)
     print(result.stdout)
-    
+
     print(f"\nEnd time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     print(f"\nNext step: Load data to BigQuery")
     print(f"  python3 scripts/02_load_to_bigquery.py")
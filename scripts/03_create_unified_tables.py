@@ -2,13 +2,39 @@
 """
 Create unified tables across all fiscal years
 Project: od-cl-odss-conroyri-f75a
+
+projects_all, abstracts_all and grant_text are partitioned by FISCAL_YEAR
+(integer range partitions) and clustered by APPLICATION_ID (grant_text by
+IC_NAME, APPLICATION_ID). APPLICATION_ID is INT64 in projects_all and
+abstracts_all, so grant_text joins on typed keys; grant_text keeps its
+STRING APPLICATION_ID column for grant_text_sample and the embedding scripts.
+
+By default only fiscal years whose projects_fy{Y} / abstracts_fy{Y} tables
+are new or modified since the last run (per __TABLES__.last_modified_time,
+recorded in _unified_tables_state) are processed: each one replaces its
+partition in the three targets with MERGE ... ON FALSE in one transaction,
+scanning that year only. grant_text joins each project to the abstract of
+the same fiscal year, so a year's grant_text partition depends on that year alone.
+
+Usage:
+  python3 scripts/03_create_unified_tables.py            # new/changed years only
+  python3 scripts/03_create_unified_tables.py --full     # rebuild everything
+  python3 scripts/03_create_unified_tables.py --years 2023 2024
 """
 
 from google.cloud import bigquery
+import argparse
 import time
 
 PROJECT_ID = "od-cl-odss-conroyri-f75a"
 DATASET_ID = "nih_data"
+STATE_TABLE = "_unified_tables_state"
+PARTITIONING = "PARTITION BY RANGE_BUCKET(FISCAL_YEAR, GENERATE_ARRAY(1985, 2036, 1))"
+CLUSTERING = {
+    'projects_all': "CLUSTER BY APPLICATION_ID",
+    'abstracts_all': "CLUSTER BY APPLICATION_ID",
+    'grant_text': "CLUSTER BY IC_NAME, APPLICATION_ID"
+}
 
 client = bigquery.Client(project=PROJECT_ID)
 
@@ -24,40 +50,19 @@ def run_query(name, query):
     job.result()  # Wait for completion
     elapsed = time.time() - start
     
-    print(f"✓ Complete in {elapsed:.1f} seconds")
+    print(f"✓ Complete in {elapsed:.1f} seconds ({(job.total_bytes_processed or 0) / 1024**3:.2f} GB scanned)")
     return job
 
-print(f"\n{'#'*70}")
-print(f"# Creating Unified NIH Tables")
-print(f"# Project: {PROJECT_ID}")
-print(f"{'#'*70}\n")
-
-# 1. Create unified projects table
-projects_query = f"""
-CREATE OR REPLACE TABLE `{PROJECT_ID}.{DATASET_ID}.projects_all`
-AS
-SELECT * FROM `{PROJECT_ID}.{DATASET_ID}.projects_fy*`
-"""
-
-run_query("Creating Unified Projects Table", projects_query)
-
-# 2. Create unified abstracts table
-abstracts_query = f"""
-CREATE OR REPLACE TABLE `{PROJECT_ID}.{DATASET_ID}.abstracts_all`
-AS
-SELECT * FROM `{PROJECT_ID}.{DATASET_ID}.abstracts_fy*`
-"""
-
-run_query("Creating Unified Abstracts Table", abstracts_query)
+def table_ref(name):
+    return f"`{PROJECT_ID}.{DATASET_ID}.{name}`"
 
-# 3. Create combined grant text table (for embeddings)
-grant_text_query = f"""
-CREATE OR REPLACE TABLE `{PROJECT_ID}.{DATASET_ID}.grant_text`
-AS
+def grant_text_select(where=""):
+    """grant_text rows from projects_all x abstracts_all, joined on INT64 keys"""
+    return f"""
 SELECT 
     CAST(p.APPLICATION_ID AS STRING) AS APPLICATION_ID,
     p.PROJECT_TITLE,
-    CAST(p.YEAR AS INT64) AS FISCAL_YEAR,
+    p.FISCAL_YEAR,
     p.ADMINISTERING_IC AS IC_NAME,
     CAST(p.TOTAL_COST AS FLOAT64) AS TOTAL_COST,
     p.ORG_NAME,
@@ -75,26 +80,166 @@ SELECT
         IFNULL(p.PROJECT_TITLE, ''),
         IFNULL(a.ABSTRACT_TEXT, '')
     )) AS text_length
-FROM `{PROJECT_ID}.{DATASET_ID}.projects_all` p
-LEFT JOIN `{PROJECT_ID}.{DATASET_ID}.abstracts_all` a
-    ON CAST(p.APPLICATION_ID AS STRING) = CAST(a.APPLICATION_ID AS STRING)
+FROM {table_ref('projects_all')} p
+LEFT JOIN {table_ref('abstracts_all')} a
+    ON p.APPLICATION_ID = a.APPLICATION_ID
+    AND p.FISCAL_YEAR = a.FISCAL_YEAR
 WHERE 
     p.PROJECT_TITLE IS NOT NULL
     AND a.ABSTRACT_TEXT IS NOT NULL
     AND LENGTH(a.ABSTRACT_TEXT) > 100
     AND p.TOTAL_COST IS NOT NULL
     AND p.TOTAL_COST > 0
+    {where}
+"""
+
+def source_versions():
+    """{fiscal_year: {'projects': ms, 'abstracts': ms}} from the dataset's __TABLES__"""
+    rows = client.query(f"""
+SELECT table_id, last_modified_time
+FROM {table_ref('__TABLES__')}
+WHERE REGEXP_CONTAINS(table_id, r'^(projects|abstracts)_fy[0-9]{{4}}$')
+""").result()
+    versions = {}
+    for row in rows:
+        kind, year = row.table_id.split('_fy')
+        versions.setdefault(int(year), {'projects': None, 'abstracts': None})[kind] = row.last_modified_time
+    return versions
+
+def load_state():
+    client.query(f"""
+CREATE TABLE IF NOT EXISTS {table_ref(STATE_TABLE)} (
+    fiscal_year INT64, projects_modified INT64, abstracts_modified INT64, refreshed_at TIMESTAMP
+)""").result()
+    rows = client.query(f"SELECT * FROM {table_ref(STATE_TABLE)}").result()
+    return {row.fiscal_year: {'projects': row.projects_modified, 'abstracts': row.abstracts_modified}
+            for row in rows}
+
+def state_merge(year, version):
+    def lit(v):
+        return 'NULL' if v is None else str(int(v))
+    return f"""
+MERGE {table_ref(STATE_TABLE)} T
+USING (SELECT {year} AS fiscal_year, {lit(version['projects'])} AS projects_modified,
+              {lit(version['abstracts'])} AS abstracts_modified) S
+ON T.fiscal_year = S.fiscal_year
+WHEN MATCHED THEN UPDATE SET projects_modified = S.projects_modified,
+    abstracts_modified = S.abstracts_modified, refreshed_at = CURRENT_TIMESTAMP()
+WHEN NOT MATCHED THEN INSERT (fiscal_year, projects_modified, abstracts_modified, refreshed_at)
+    VALUES (S.fiscal_year, S.projects_modified, S.abstracts_modified, CURRENT_TIMESTAMP());
 """
 
-run_query("Creating Grant Text Table for Embeddings", grant_text_query)
+def targets_ready():
+    """True if all three targets exist with FISCAL_YEAR range partitioning"""
+    for name in CLUSTERING:
+        try:
+            table = client.get_table(f"{PROJECT_ID}.{DATASET_ID}.{name}")
+        except Exception:
+            return False
+        if table.range_partitioning is None or table.range_partitioning.field != 'FISCAL_YEAR':
+            return False
+    return True
+
+def full_rebuild(versions):
+    """Recreate the partitioned targets from every fiscal-year table"""
+    for kind in ['projects', 'abstracts']:
+        run_query(f"Creating Unified {kind.title()} Table", f"""
+CREATE OR REPLACE TABLE {table_ref(f'{kind}_all')}
+{PARTITIONING}
+{CLUSTERING[f'{kind}_all']}
+AS
+SELECT * REPLACE (SAFE_CAST(APPLICATION_ID AS INT64) AS APPLICATION_ID),
+    CAST(_TABLE_SUFFIX AS INT64) AS FISCAL_YEAR
+FROM {table_ref(f'{kind}_fy*')}
+""")
+
+    run_query("Creating Grant Text Table for Embeddings", f"""
+CREATE OR REPLACE TABLE {table_ref('grant_text')}
+{PARTITIONING}
+{CLUSTERING['grant_text']}
+AS
+{grant_text_select()}
+""")
+
+    client.query(f"TRUNCATE TABLE {table_ref(STATE_TABLE)}").result()
+    if versions:
+        client.query(''.join(state_merge(year, v) for year, v in sorted(versions.items()))).result()
+
+def partition_source(target, source, year):
+    """SELECT from one fiscal-year table, shaped (and cast) to the target's columns"""
+    source_cols = {f.name: f.field_type for f in client.get_table(f"{PROJECT_ID}.{DATASET_ID}.{source}").schema}
+    target_schema = client.get_table(f"{PROJECT_ID}.{DATASET_ID}.{target}").schema
+    dropped = set(source_cols) - {f.name for f in target_schema}
+    if dropped:
+        print(f"  ⚠️  {source}: columns not in {target}, skipped: {sorted(dropped)}")
+
+    select = []
+    for field in target_schema:
+        bq = {'INTEGER': 'INT64', 'FLOAT': 'FLOAT64', 'BOOLEAN': 'BOOL'}.get(field.field_type, field.field_type)
+        if field.name == 'FISCAL_YEAR':
+            select.append(f"{year} AS FISCAL_YEAR")
+        elif field.name not in source_cols:
+            select.append(f"CAST(NULL AS {bq}) AS {field.name}")
+        elif source_cols[field.name] == field.field_type:
+            select.append(field.name)
+        else:
+            select.append(f"SAFE_CAST({field.name} AS {bq}) AS {field.name}")
+    return f"SELECT {', '.join(select)} FROM {table_ref(source)}"
+
+def replace_partition(target, source_sql, year):
+    return f"""
+MERGE {table_ref(target)} T
+USING ({source_sql}) S
+ON FALSE
+WHEN NOT MATCHED BY SOURCE AND T.FISCAL_YEAR = {year} THEN DELETE
+WHEN NOT MATCHED THEN INSERT ROW;
+"""
+
+def refresh_year(year, version):
+    """Replace one fiscal year's partition in all three targets, atomically"""
+    statements = ["BEGIN TRANSACTION;"]
+    for kind in ['projects', 'abstracts']:
+        if version[kind] is not None:
+            source = partition_source(f'{kind}_all', f'{kind}_fy{year}', year)
+            statements.append(replace_partition(f'{kind}_all', source, year))
+    statements.append(replace_partition(
+        'grant_text', grant_text_select(f"AND p.FISCAL_YEAR = {year} AND a.FISCAL_YEAR = {year}"), year))
+    statements.append(state_merge(year, version))
+    statements.append("COMMIT TRANSACTION;")
+    return run_query(f"Refreshing FY{year}", "\n".join(statements))
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--full', action='store_true', help='Rebuild all targets from every fiscal year')
+parser.add_argument('--years', nargs='+', type=int, help='Refresh these years even if unchanged')
+args = parser.parse_args()
+
+print(f"\n{'#'*70}")
+print(f"# Creating Unified NIH Tables")
+print(f"# Project: {PROJECT_ID}")
+print(f"{'#'*70}\n")
+
+versions = source_versions()
+state = load_state()
+
+if args.full or not targets_ready():
+    # 1-3. Full rebuild (first run, or targets not yet partitioned)
+    print(f"Full rebuild of {len(versions)} fiscal years")
+    full_rebuild(versions)
+else:
+    # 1-3. Incremental: only new or changed fiscal years
+    changed = sorted(y for y, v in versions.items() if state.get(y) != v or (args.years and y in args.years))
+    print(f"Fiscal years: {len(versions)} sources, {len(changed)} new or changed"
+          + (f": {', '.join(map(str, changed))}" if changed else ""))
+    for year in changed:
+        refresh_year(year, versions[year])
 
 # 4. Get statistics
 stats_query = f"""
 SELECT 
     'projects_all' as table_name,
     COUNT(*) as row_count,
-    MIN(CAST(YEAR AS INT64)) as min_year,
-    MAX(CAST(YEAR AS INT64)) as max_year,
+    MIN(FISCAL_YEAR) as min_year,
+    MAX(FISCAL_YEAR) as max_year,
     COUNT(DISTINCT ADMINISTERING_IC) as unique_ics
 FROM `{PROJECT_ID}.{DATASET_ID}.projects_all`
 
@@ -103,8 +248,8 @@ UNION ALL
 SELECT 
     'abstracts_all',
     COUNT(*),
-    MIN(CAST(YEAR AS INT64)),
-    MAX(CAST(YEAR AS INT64)),
+    MIN(FISCAL_YEAR),
+    MAX(FISCAL_YEAR),
     NULL
 FROM `{PROJECT_ID}.{DATASET_ID}.abstracts_all`
 
@@ -12,23 +12,40 @@ import numpy as np
 import time
 from datetime import datetime
 import json
-import torch
-from transformers import AutoTokenizer, AutoModel
-from tqdm import tqdm
+import argparse
 import os
 
+import embedding_store
+from bert_embedder import BACKENDS, EMBEDDING_DIM, PREFETCH_BATCHES, run_embedding
+
 PROJECT_ID = "od-cl-odss-conroyri-f75a"
 DATASET_ID = "nih_data"
-
-# Check for GPU
-device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-print(f"\nUsing device: {device}")
-if device.type == 'cpu':
-    print("⚠ No GPU detected. This will take 2-4 hours on CPU.")
-    print("  Consider using a GPU-enabled VM for faster processing.")
+TEXT_RECIPE = "PROJECT_TERMS"
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--backend', choices=BACKENDS, default='torch',
+                    help='torch (GPU if available), or ONNX Runtime on CPU: onnx / onnx-int8')
+parser.add_argument('--workers', type=int, default=1,
+                    help='Shard the input across this many CPU worker processes')
+parser.add_argument('--prefetch', type=int, default=PREFETCH_BATCHES,
+                    help='Batches tokenized ahead of the model on a background thread (0 = serial)')
+args = parser.parse_args()
+
+if args.backend == 'torch':
+    # Check for GPU
+    import torch
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    print(f"\nUsing device: {device}")
+    if device.type == 'cpu':
+        print("⚠ No GPU detected. This will take 2-4 hours on CPU.")
+        print("  Consider using a GPU-enabled VM for faster processing,")
+        print("  or ONNX Runtime on CPU with --backend onnx-int8 (see bert_embedder.py check).")
+    else:
+        print(f"✓ GPU detected: {torch.cuda.get_device_name(0)}")
+        print("  Estimated time: 15-30 minutes")
 else:
-    print(f"✓ GPU detected: {torch.cuda.get_device_name(0)}")
-    print("  Estimated time: 15-30 minutes")
+    device = 'cpu'
+    print(f"\nUsing ONNX Runtime on CPU ({args.backend}, {os.cpu_count()} cores)")
 
 bq_client = bigquery.Client(project=PROJECT_ID)
 
@@ -76,92 +93,52 @@ for idx, terms in enumerate(df['PROJECT_TERMS'].head(3)):
     print(f"  {idx+1}. {terms[:200]}...")
 print()
 
-# Load PubMedBERT model
-print("Loading PubMedBERT model...")
+# PubMedBERT model (loaded by run_embedding, in each worker when sharded)
 model_name = "microsoft/BiomedNLP-PubMedBERT-base-uncased-abstract-fulltext"
-tokenizer = AutoTokenizer.from_pretrained(model_name)
-model = AutoModel.from_pretrained(model_name)
-model.to(device)
-model.eval()
-print("✓ Model loaded\n")
 
 # Generate embeddings
 print("Generating embeddings from PROJECT_TERMS...")
-print(f"Batch processing {len(df):,} grants\n")
-
-BATCH_SIZE = 32 if device.type == 'cuda' else 8
-MAX_LENGTH = 512  # PubMedBERT max sequence length
-
-embeddings_list = []
-
-with torch.no_grad():
-    for i in tqdm(range(0, len(df), BATCH_SIZE), desc="Processing"):
-        batch_end = min(i + BATCH_SIZE, len(df))
-        batch = df.iloc[i:batch_end]
-        
-        # Use PROJECT_TERMS instead of combined_text
-        texts = []
-        for _, row in batch.iterrows():
-            # Use PROJECT_TERMS directly (already curated and concise)
-            text = str(row['PROJECT_TERMS'])
-            texts.append(text)
-        
-        try:
-            # Tokenize
-            inputs = tokenizer(
-                texts,
-                padding=True,
-                truncation=True,
-                max_length=MAX_LENGTH,
-                return_tensors='pt'
-            ).to(device)
-            
-            # Get embeddings
-            outputs = model(**inputs)
-            
-            # Use [CLS] token embedding (first token)
-            embeddings = outputs.last_hidden_state[:, 0, :].cpu().numpy()
-            
-            # Store results
-            for j, embedding in enumerate(embeddings):
-                idx = i + j
-                embeddings_list.append({
-                    'APPLICATION_ID': df.iloc[idx]['APPLICATION_ID'],
-                    'FISCAL_YEAR': int(df.iloc[idx]['FISCAL_YEAR']),
-                    'IC_NAME': df.iloc[idx]['IC_NAME'],
-                    'TOTAL_COST': float(df.iloc[idx]['TOTAL_COST']) if pd.notna(df.iloc[idx]['TOTAL_COST']) else 0.0,
-                    'PROJECT_TITLE': df.iloc[idx]['PROJECT_TITLE'],
-                    'PROJECT_TERMS': df.iloc[idx]['PROJECT_TERMS'],
-                    'embedding': embedding.tolist()
-                })
-        
-        except Exception as e:
-            print(f"\nError at batch {i}: {e}")
-            # Add zero vectors for failed batch
-            for j in range(len(batch)):
-                idx = i + j
-                embeddings_list.append({
-                    'APPLICATION_ID': df.iloc[idx]['APPLICATION_ID'],
-                    'FISCAL_YEAR': int(df.iloc[idx]['FISCAL_YEAR']),
-                    'IC_NAME': df.iloc[idx]['IC_NAME'],
-                    'TOTAL_COST': float(df.iloc[idx]['TOTAL_COST']) if pd.notna(df.iloc[idx]['TOTAL_COST']) else 0.0,
-                    'PROJECT_TITLE': df.iloc[idx]['PROJECT_TITLE'],
-                    'PROJECT_TERMS': df.iloc[idx]['PROJECT_TERMS'],
-                    'embedding': [0.0] * 768
-                })
-            continue
+print(f"Batch processing {len(df):,} grants"
+      + (f" across {args.workers} CPU workers" if args.workers > 1 else "") + "\n")
+
+# Use PROJECT_TERMS directly (already curated and concise); cached grants are not re-embedded
+texts = [str(t) for t in df['PROJECT_TERMS']]
+# Vectors are written straight into a preallocated float32 memmap
+output_prefix = 'data/processed/embeddings_project_terms_50k'
+embeddings = embedding_store.create(output_prefix, len(df), EMBEDDING_DIM)
+embeddings, embed_stats = run_embedding(df['APPLICATION_ID'].values, texts, model_name, args.backend,
+                                         device, args.workers, recipe=TEXT_RECIPE, out=embeddings,
+                                         prefetch=args.prefetch)
 
 elapsed = time.time() - start_time
-print(f"\n✓ Generated {len(embeddings_list):,} embeddings in {elapsed/60:.1f} minutes")
+print(f"\n✓ Generated {len(embeddings):,} embeddings in {elapsed/60:.1f} minutes "
+      f"({embed_stats['cache_hits']:,} from cache, {embed_stats['computed']:,} computed)")
+
+# Grants whose batch failed are NaN rows and were not cached: leave them out
+# of the store rather than publishing placeholders (the next run retries them)
+if embed_stats['failed']:
+    embedded = embedding_store.embedded_rows(embeddings)
+    print(f"  ⚠️  {(~embedded).sum():,} grants could not be embedded; left out of the store")
+    df = df[embedded].reset_index(drop=True)
+    embeddings = embedding_store.drop_rows(output_prefix, embeddings, embedded)
 
 # Save results
 print("\nSaving embeddings...")
-os.makedirs('data/processed', exist_ok=True)
-embeddings_df = pd.DataFrame(embeddings_list)
-
-# Save as Parquet
+metadata = pd.DataFrame({
+    'APPLICATION_ID': df['APPLICATION_ID'].values,
+    'FISCAL_YEAR': df['FISCAL_YEAR'].astype(int).values,
+    'IC_NAME': df['IC_NAME'].values,
+    'TOTAL_COST': df['TOTAL_COST'].astype(float).fillna(0.0).values,
+    'PROJECT_TITLE': df['PROJECT_TITLE'].values,
+    'PROJECT_TERMS': df['PROJECT_TERMS'].values,
+})
+embedding_store.finish(output_prefix, embeddings, metadata, model=model_name, backend=args.backend,
+                       text_recipe=TEXT_RECIPE)
+print(f"✓ Saved {embedding_store.matrix_path(output_prefix)} + {embedding_store.metadata_path(output_prefix)}")
+
+# Legacy Parquet (metadata + embedding list column) for the existing readers
 local_file = 'data/processed/embeddings_project_terms_50k.parquet'
-embeddings_df.to_parquet(local_file, compression='snappy')
+embedding_store.export_parquet(output_prefix, local_file)
 print(f"✓ Saved to {local_file}")
 print(f"  File size: {os.path.getsize(local_file) / 1024 / 1024:.1f} MB")
 
@@ -169,7 +146,8 @@ print(f"  File size: {os.path.getsize(local_file) / 1024 / 1024:.1f} MB")
 print("\nUploading to Cloud Storage...")
 import subprocess
 subprocess.run([
-    'gsutil', 'cp', local_file,
+    'gsutil', 'cp', local_file, embedding_store.matrix_path(output_prefix),
+    embedding_store.metadata_path(output_prefix),
     'gs://od-cl-odss-conroyri-nih-embeddings/sample/'
 ], check=True)
 print(f"✓ Uploaded to gs://od-cl-odss-conroyri-nih-embeddings/sample/")
@@ -177,12 +155,14 @@ print(f"✓ Uploaded to gs://od-cl-odss-conroyri-nih-embeddings/sample/")
 # Create manifest
 manifest = {
     'project_id': PROJECT_ID,
-    'sample_size': len(embeddings_df),
+    'sample_size': len(metadata),
     'embedding_dim': 768,
     'model': 'microsoft/BiomedNLP-PubMedBERT-base-uncased-abstract-fulltext',
     'text_source': 'PROJECT_TERMS',
     'device': str(device),
+    'backend': args.backend,
     'time_minutes': elapsed / 60,
+    **embed_stats,
     'avg_terms_length': float(df['PROJECT_TERMS'].str.len().mean()),
     'timestamp': datetime.now().isoformat()
 }
@@ -199,7 +179,7 @@ print("\n" + "="*70)
 print("EMBEDDINGS GENERATION COMPLETE")
 print("="*70)
 print(f"Total time: {elapsed/60:.1f} minutes")
-print(f"Embeddings: {len(embeddings_df):,}")
+print(f"Embeddings: {len(metadata):,}")
 print(f"Model: PubMedBERT")
 print(f"Text source: PROJECT_TERMS (curated NIH terminology)")
 print(f"Device: {device}")
@@ -1,190 +1,242 @@
 #!/usr/bin/env python3
 """
 Catalog ExPORTER parquet files - Simple and robust version
+
+Rows, schema, row-group count and column min/max come from the Parquet
+footers alone (parquet_meta.py), read in parallel. The catalog is persisted
+to data/exporter_catalog.json; on re-runs only files whose size or GCS
+generation changed are inspected again.
+
+Usage:
+  python3 scripts/15_catalog_exporter_data_v2.py
+  python3 scripts/15_catalog_exporter_data_v2.py --full          # ignore the cached catalog
+  python3 scripts/15_catalog_exporter_data_v2.py --path data/lake/exporter --no-upload
 """
 
+import argparse
 import subprocess
-import pandas as pd
 from datetime import datetime
 import json
 import os
+import time
+
+from parquet_meta import read_footers, summarize_footer
 
 PROJECT_ID = 'od-cl-odss-conroyri-f75a'
 BUCKET_NAME = 'od-cl-odss-conroyri-nih-embeddings'
 BUCKET_PATH = f'gs://{BUCKET_NAME}/exporter/'
-
-print("\n" + "="*70)
-print("# NIH ExPORTER Data Catalog")
-print("="*70 + "\n")
-
-# List all parquet files using gsutil
-print("Scanning for parquet files...")
-result = subprocess.run(
-    ['gsutil', 'ls', '-l', BUCKET_PATH + '**'],
-    capture_output=True,
-    text=True
-)
-
-lines = result.stdout.strip().split('\n')
-parquet_files = []
-
-for line in lines:
-    if '.parquet' in line and 'TOTAL:' not in line:
-        parts = line.split()
-        if len(parts) >= 3:
-            size_bytes = int(parts[0]) if parts[0].isdigit() else 0
-            filepath = parts[-1]
-            filename = filepath.split('/')[-1]
-            
-            parquet_files.append({
-                'filename': filename,
-                'full_path': filepath,
-                'size_mb': size_bytes / 1024**2,
-                'size_gb': size_bytes / 1024**3
-            })
-
-print(f"✓ Found {len(parquet_files)} parquet files\n")
-
-if len(parquet_files) == 0:
-    print("No parquet files found. Check path:")
-    print(f"  {BUCKET_PATH}")
-    exit(1)
-
-# Analyze each file
-catalog = {
-    'metadata': {
-        'catalog_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-        'project_id': PROJECT_ID,
-        'bucket': BUCKET_NAME,
-        'total_files': len(parquet_files)
-    },
-    'files': []
-}
-
-print("="*70)
-print("ANALYZING EACH FILE")
-print("="*70 + "\n")
-
-for file_info in sorted(parquet_files, key=lambda x: x['filename']):
-    print(f"📊 {file_info['filename']}")
-    print(f"   Path: {file_info['full_path']}")
-    print(f"   Size: {file_info['size_mb']:.2f} MB")
-    
-    # Try to read file metadata
-    try:
-        df = pd.read_parquet(file_info['full_path'], engine='pyarrow')
-        
-        file_info['rows'] = len(df)
-        file_info['columns'] = list(df.columns)
-        file_info['column_count'] = len(df.columns)
-        
-        # Identify type
-        cols_lower = [c.lower() for c in df.columns]
-        
-        if 'project_title' in cols_lower or 'core_project_num' in cols_lower:
-            file_info['type'] = 'projects'
-        elif 'abstract_text' in cols_lower:
-            file_info['type'] = 'abstracts'
-        elif 'pmid' in cols_lower:
-            file_info['type'] = 'publications'
-        elif 'patent_id' in cols_lower:
-            file_info['type'] = 'patents'
-        elif 'clinicaltrials_gov_id' in cols_lower:
-            file_info['type'] = 'clinical_studies'
-        elif 'org_name' in cols_lower:
-            file_info['type'] = 'organizations'
+CATALOG_JSON_PATH = 'data/exporter_catalog.json'
+MARKDOWN_PATH = 'data/EXPORTER_SUMMARY.md'
+YEAR_COLUMNS = ['FY', 'FISCAL_YEAR', 'YEAR']
+WORKERS = 16
+
+
+def list_parquet_files(path):
+    """Parquet files under a gs:// prefix or local directory, with size and generation"""
+    files = []
+    if path.startswith('gs://'):
+        from google.cloud import storage
+        bucket_name, _, prefix = path[len('gs://'):].partition('/')
+        for blob in storage.Client(project=PROJECT_ID).list_blobs(bucket_name, prefix=prefix):
+            if blob.name.endswith('.parquet'):
+                files.append({'full_path': f"gs://{bucket_name}/{blob.name}",
+                              'size_bytes': blob.size, 'generation': blob.generation})
+    else:
+        for root, _, names in os.walk(path):
+            for name in names:
+                if name.endswith('.parquet'):
+                    full = os.path.join(root, name)
+                    stat = os.stat(full)
+                    files.append({'full_path': full, 'size_bytes': stat.st_size,
+                                  'generation': stat.st_mtime_ns})
+
+    for f in files:
+        f['filename'] = f['full_path'].split('/')[-1]
+        f['size_mb'] = f['size_bytes'] / 1024**2
+        f['size_gb'] = f['size_bytes'] / 1024**3
+    return files
+
+
+def file_type(columns):
+    """Identify the ExPORTER table from its column names"""
+    cols_lower = [c.lower() for c in columns]
+    if 'project_title' in cols_lower or 'core_project_num' in cols_lower:
+        return 'projects'
+    if 'abstract_text' in cols_lower:
+        return 'abstracts'
+    if 'pmid' in cols_lower:
+        return 'publications'
+    if 'patent_id' in cols_lower:
+        return 'patents'
+    if 'clinicaltrials_gov_id' in cols_lower:
+        return 'clinical_studies'
+    if 'org_name' in cols_lower:
+        return 'organizations'
+    return 'other'
+
+
+def describe(file_info, footer):
+    """Fill a catalog entry from a (metadata, schema) footer"""
+    file_info.update(summarize_footer(*footer))
+    file_info['type'] = file_type(file_info['columns'])
+    file_info['sample_columns'] = file_info['columns'][:10]
+    for col in YEAR_COLUMNS:
+        stats = file_info['column_stats'].get(col, {})
+        if 'min' in stats:
+            file_info['min_year'] = int(stats['min'])
+            file_info['max_year'] = int(stats['max'])
+            break
+    return file_info
+
+
+def load_cached_catalog(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        cached = json.load(f)
+    return {f['full_path']: f for f in cached.get('files', []) if 'generation' in f}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--path', default=BUCKET_PATH, help='gs:// prefix or local directory')
+    parser.add_argument('--catalog', default=CATALOG_JSON_PATH)
+    parser.add_argument('--full', action='store_true', help='Re-inspect every file')
+    parser.add_argument('--workers', type=int, default=WORKERS)
+    parser.add_argument('--no-upload', action='store_true')
+    args = parser.parse_args()
+
+    print("\n" + "="*70)
+    print("# NIH ExPORTER Data Catalog")
+    print("="*70 + "\n")
+
+    print("Scanning for parquet files...")
+    parquet_files = list_parquet_files(args.path)
+    print(f"✓ Found {len(parquet_files)} parquet files\n")
+
+    if len(parquet_files) == 0:
+        print("No parquet files found. Check path:")
+        print(f"  {args.path}")
+        return 1
+
+    # Reuse entries whose size and generation are unchanged
+    cached = {} if args.full else load_cached_catalog(args.catalog)
+    entries, stale = [], []
+    for file_info in parquet_files:
+        old = cached.get(file_info['full_path'])
+        if (old and 'error' not in old and old['size_bytes'] == file_info['size_bytes']
+                and old['generation'] == file_info['generation']):
+            entries.append(old)
+        else:
+            stale.append(file_info)
+    print(f"  Cached: {len(entries)}, to inspect: {len(stale)}")
+
+    print("="*70)
+    print("READING FOOTERS")
+    print("="*70 + "\n")
+
+    start = time.time()
+    footers = read_footers([f['full_path'] for f in stale], workers=args.workers)
+    for file_info in stale:
+        footer = footers[file_info['full_path']]
+        if isinstance(footer, Exception):
+            print(f"⚠️  {file_info['filename']}: error reading footer: {str(footer)[:100]}")
+            file_info['error'] = str(footer)[:200]
         else:
-            file_info['type'] = 'other'
-        
-        # Get year range
-        if 'FISCAL_YEAR' in df.columns:
-            file_info['min_year'] = int(df['FISCAL_YEAR'].min())
-            file_info['max_year'] = int(df['FISCAL_YEAR'].max())
-        
-        print(f"   Type: {file_info['type']}")
-        print(f"   Rows: {file_info['rows']:,}")
-        print(f"   Columns: {file_info['column_count']}")
-        
-        if 'min_year' in file_info:
-            print(f"   Years: {file_info['min_year']}-{file_info['max_year']}")
-        
-        # Store first 10 column names
-        file_info['sample_columns'] = df.columns[:10].tolist()
-        
-    except Exception as e:
-        print(f"   ⚠️  Error reading: {str(e)[:100]}")
-        file_info['error'] = str(e)[:200]
-    
-    catalog['files'].append(file_info)
-    print()
-
-# Summary by type
-print("="*70)
-print("SUMMARY BY TYPE")
-print("="*70 + "\n")
-
-type_summary = {}
-for file in catalog['files']:
-    ftype = file.get('type', 'unknown')
-    if ftype not in type_summary:
-        type_summary[ftype] = {
-            'count': 0,
-            'total_rows': 0,
-            'total_size_mb': 0,
-            'files': []
-        }
-    type_summary[ftype]['count'] += 1
-    type_summary[ftype]['total_rows'] += file.get('rows', 0)
-    type_summary[ftype]['total_size_mb'] += file.get('size_mb', 0)
-    type_summary[ftype]['files'].append(file['filename'])
-
-for ftype, stats in sorted(type_summary.items()):
-    print(f"📁 {ftype.upper()}")
-    print(f"   Files: {stats['count']}")
-    print(f"   Rows: {stats['total_rows']:,}")
-    print(f"   Size: {stats['total_size_mb']:.1f} MB")
-    print()
-
-# Save JSON catalog
-os.makedirs('data', exist_ok=True)
-catalog_json_path = 'data/exporter_catalog.json'
-with open(catalog_json_path, 'w') as f:
-    json.dump(catalog, f, indent=2)
-
-print(f"✓ Saved: {catalog_json_path}")
-
-# Generate Markdown summary
-markdown = f"""# NIH ExPORTER Data Summary
-
-**Generated:** {catalog['metadata']['catalog_date']}  
-**Location:** `{BUCKET_PATH}`  
-**Total Files:** {len(parquet_files)}  
-**Total Size:** {sum(f['size_gb'] for f in parquet_files):.2f} GB
+            describe(file_info, footer)
+            years = f", FY {file_info['min_year']}-{file_info['max_year']}" if 'min_year' in file_info else ""
+            print(f"📊 {file_info['filename']}: {file_info['type']}, {file_info['rows']:,} rows, "
+                  f"{file_info['column_count']} columns, {file_info['row_groups']} row groups{years}")
+        entries.append(file_info)
+    print(f"\n✓ Inspected {len(stale)} footers in {time.time() - start:.1f}s")
+
+    catalog = {
+        'metadata': {
+            'catalog_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'project_id': PROJECT_ID,
+            'bucket': BUCKET_NAME,
+            'path': args.path,
+            'total_files': len(entries),
+            'inspected_files': len(stale)
+        },
+        'files': sorted(entries, key=lambda x: x['filename'])
+    }
+
+    # Summary by type
+    print("\n" + "="*70)
+    print("SUMMARY BY TYPE")
+    print("="*70 + "\n")
+
+    type_summary = {}
+    for file in catalog['files']:
+        ftype = file.get('type', 'unknown')
+        if ftype not in type_summary:
+            type_summary[ftype] = {
+                'count': 0,
+                'total_rows': 0,
+                'total_size_mb': 0,
+                'files': []
+            }
+        type_summary[ftype]['count'] += 1
+        type_summary[ftype]['total_rows'] += file.get('rows', 0)
+        type_summary[ftype]['total_size_mb'] += file.get('size_mb', 0)
+        type_summary[ftype]['files'].append(file['filename'])
+
+    for ftype, stats in sorted(type_summary.items()):
+        print(f"📁 {ftype.upper()}")
+        print(f"   Files: {stats['count']}")
+        print(f"   Rows: {stats['total_rows']:,}")
+        print(f"   Size: {stats['total_size_mb']:.1f} MB")
+        print()
+
+    # Save JSON catalog
+    os.makedirs(os.path.dirname(args.catalog) or '.', exist_ok=True)
+    tmp = f"{args.catalog}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(catalog, f, indent=2)
+    os.replace(tmp, args.catalog)
+
+    print(f"✓ Saved: {args.catalog}")
+
+    # Generate Markdown summary
+    markdown = f"""# NIH ExPORTER Data Summary
+
+**Generated:** {catalog['metadata']['catalog_date']}
+**Location:** `{args.path}`
+**Total Files:** {len(entries)}
+**Total Size:** {sum(f['size_gb'] for f in entries):.2f} GB
 
 ## Files by Type
 
 """
 
-for ftype, stats in sorted(type_summary.items()):
-    markdown += f"\n### {ftype.upper()}\n"
-    markdown += f"- Files: {stats['count']}\n"
-    markdown += f"- Rows: {stats['total_rows']:,}\n"
-    markdown += f"- Size: {stats['total_size_mb']:.1f} MB\n"
-    markdown += f"- Files: {', '.join(stats['files'])}\n"
-
-markdown_path = 'data/EXPORTER_SUMMARY.md'
-with open(markdown_path, 'w') as f:
-    f.write(markdown)
-
-print(f"✓ Saved: {markdown_path}")
-
-# Upload to GCS
-print("\nUploading to GCS...")
-subprocess.run(['gsutil', 'cp', catalog_json_path, f'{BUCKET_PATH}CATALOG.json'])
-subprocess.run(['gsutil', 'cp', markdown_path, f'{BUCKET_PATH}SUMMARY.md'])
-
-print("\n" + "="*70)
-print("✓ COMPLETE!")
-print("="*70)
-print(f"\n📄 Local: cat {markdown_path}")
-print(f"☁️  GCS: gsutil cat {BUCKET_PATH}SUMMARY.md")
+    for ftype, stats in sorted(type_summary.items()):
+        markdown += f"\n### {ftype.upper()}\n"
+        markdown += f"- Files: {stats['count']}\n"
+        markdown += f"- Rows: {stats['total_rows']:,}\n"
+        markdown += f"- Size: {stats['total_size_mb']:.1f} MB\n"
+        markdown += f"- Files: {', '.join(stats['files'])}\n"
+
+    markdown_path = os.path.join(os.path.dirname(args.catalog) or '.', os.path.basename(MARKDOWN_PATH))
+    with open(markdown_path, 'w') as f:
+        f.write(markdown)
+
+    print(f"✓ Saved: {markdown_path}")
+
+    if not args.no_upload and args.path.startswith('gs://'):
+        # Upload to GCS
+        print("\nUploading to GCS...")
+        subprocess.run(['gsutil', 'cp', args.catalog, f'{args.path}CATALOG.json'])
+        subprocess.run(['gsutil', 'cp', markdown_path, f'{args.path}SUMMARY.md'])
+
+    print("\n" + "="*70)
+    print("✓ COMPLETE!")
+    print("="*70)
+    print(f"\n📄 Local: cat {markdown_path}")
+    if args.path.startswith('gs://'):
+        print(f"☁️  GCS: gsutil cat {args.path}SUMMARY.md")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
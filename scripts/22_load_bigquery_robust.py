@@ -1,168 +1,230 @@
 #!/usr/bin/env python3
 """
 Robust BigQuery loader with schema conflict resolution
+
+1. Read the Parquet footers of every year file in parallel (no row data)
+2. Reconcile one target schema per table (parquet_meta.reconcile_schemas)
+3. Rewrite only the year files whose columns conflict with it, casting just
+   those columns, to {BUCKET}/temp/
+4. Create the table with the explicit schema and submit all per-year load
+   jobs concurrently (WRITE_APPEND against the fresh table)
+
+The table is recreated, so it holds exactly the years loaded. A --years
+subset would drop every other year and is refused without --replace.
+
+Usage:
+  python3 scripts/22_load_bigquery_robust.py
+  python3 scripts/22_load_bigquery_robust.py --tables projects --years 2020 2021 2022 --replace
 """
 
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 from google.cloud import bigquery
-import pandas as pd
-from tqdm import tqdm
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
+
+from parquet_meta import arrow_type_for, open_file, read_footers, reconcile_schemas
 
 PROJECT_ID = 'od-cl-odss-conroyri-f75a'
 DATASET_ID = 'nih_exporter'
 BUCKET = 'gs://od-cl-odss-conroyri-nih-embeddings/exporter'
+WORKERS = 16
+ALL_YEARS = list(range(1990, 2025))
+
+TABLES = {
+    'projects': 'projects_parquet',
+    'abstracts': 'abstracts_parquet',
+    'linktables': 'linktables_parquet'
+}
+
+
+def year_uri(folder, table_name, year):
+    return f'{BUCKET}/{folder}/YEAR={year}/{table_name}_{year}.parquet'
+
 
-client = bigquery.Client(project=PROJECT_ID)
+def rewrite_conflicting(uri, temp_uri, columns, target):
+    """Copy one file to temp_uri with only `columns` cast to their target type"""
+    with open_file(uri) as f:
+        table = pq.read_table(f)
+    for name in columns:
+        i = table.schema.get_field_index(name)
+        col = table.column(i)
+        if pa.types.is_dictionary(col.type):
+            col = col.cast(col.type.value_type)
+        table = table.set_column(i, name, pc.cast(col, arrow_type_for(target[name])))
 
-print("="*70)
-print("Loading NIH ExPORTER to BigQuery (Robust Version)")
-print("="*70)
+    fs, path = pafs.FileSystem.from_uri(temp_uri) if '://' in temp_uri else (pafs.LocalFileSystem(), temp_uri)
+    with fs.open_output_stream(path) as out:
+        pq.write_table(table, out, compression='snappy')
+    return temp_uri
 
-# Create dataset if needed
-dataset = bigquery.Dataset(f"{PROJECT_ID}.{DATASET_ID}")
-dataset.location = "US"
-try:
-    client.create_dataset(dataset, exists_ok=True)
-    print(f"✓ Dataset ready: {DATASET_ID}\n")
-except Exception as e:
-    print(f"Dataset exists: {e}\n")
 
-def load_table_robust(table_name, folder, years=range(1990, 2025)):
-    """Load table year by year with error handling"""
-    
+def load_table_robust(client, table_name, folder, years=ALL_YEARS, workers=WORKERS):
+    """Recreate a table from the given years, loaded concurrently against one reconciled schema"""
+
     print(f"\n{'='*70}")
     print(f"Loading {table_name.upper()}")
     print(f"{'='*70}")
-    
+    table_id = f'{PROJECT_ID}.{DATASET_ID}.{table_name}'
+
+    # Step 1: footers only, in parallel
+    start = time.time()
+    uris = {year: year_uri(folder, table_name, year) for year in years}
+    footers = read_footers(list(uris.values()), workers=workers)
+    schemas, failed_years = {}, []
+    for year, uri in uris.items():
+        result = footers[uri]
+        if isinstance(result, Exception):
+            failed_years.append((year, f"footer: {str(result)[:100]}"))
+            print(f"  ✗ {year}: cannot read footer ({str(result)[:50]})")
+        else:
+            schemas[year] = result[1]
+    print(f"  Read {len(schemas)} footers in {time.time() - start:.1f}s")
+    if not schemas:
+        return 0
+
+    # Step 2: reconciled schema
+    target, conflicts = reconcile_schemas(schemas)
+    print(f"  Target schema: {len(target)} columns")
+    for year, cols in sorted(conflicts.items()):
+        print(f"  ⚠️  {year}: conflicting columns {cols}")
+
+    # Step 3: rewrite only conflicting files, casting only conflicting columns
+    sources = {year: uris[year] for year in schemas}
+    if conflicts:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                year: pool.submit(rewrite_conflicting, uris[year],
+                                  f'{BUCKET}/temp/{table_name}_{year}_fixed.parquet', cols, target)
+                for year, cols in conflicts.items()
+            }
+            for year, future in futures.items():
+                try:
+                    sources[year] = future.result()
+                except Exception as e:
+                    sources.pop(year)
+                    failed_years.append((year, f"rewrite: {str(e)[:100]}"))
+                    print(f"  ✗ {year}: rewrite failed ({str(e)[:50]})")
+
+    # Step 4: fresh table with the explicit schema, then concurrent appends
+    schema = [bigquery.SchemaField(name, bq, mode='NULLABLE') for name, bq in target.items()]
+    client.delete_table(table_id, not_found_ok=True)
+    client.create_table(bigquery.Table(table_id, schema=schema))
+
+    job_config = bigquery.LoadJobConfig(
+        source_format=bigquery.SourceFormat.PARQUET,
+        write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+        schema=schema,
+        max_bad_records=0
+    )
+    start = time.time()
+    jobs = {year: client.load_table_from_uri(uri, table_id, job_config=job_config)
+            for year, uri in sorted(sources.items())}
+    print(f"  Submitted {len(jobs)} load jobs")
+
     loaded_years = []
-    failed_years = []
-    
-    for year in years:
-        uri = f'{BUCKET}/{folder}/YEAR={year}/{table_name}_{year}.parquet'
-        
-        job_config = bigquery.LoadJobConfig(
-            source_format=bigquery.SourceFormat.PARQUET,
-            write_disposition=(
-                bigquery.WriteDisposition.WRITE_TRUNCATE 
-                if year == years[0] 
-                else bigquery.WriteDisposition.WRITE_APPEND
-            ),
-            autodetect=True,
-            schema_update_options=[
-                bigquery.SchemaUpdateOption.ALLOW_FIELD_ADDITION,
-                bigquery.SchemaUpdateOption.ALLOW_FIELD_RELAXATION
-            ],
-            # Ignore schema errors by converting problematic types to strings
-            max_bad_records=0
-        )
-        
+    for year, job in jobs.items():
         try:
-            job = client.load_table_from_uri(
-                uri,
-                f'{PROJECT_ID}.{DATASET_ID}.{table_name}',
-                job_config=job_config
-            )
             job.result()
             loaded_years.append(year)
-            print(f"  ✓ {year}: {job.output_rows:,} rows", flush=True)
-            
+            fixed = " (fixed)" if year in conflicts else ""
+            print(f"  ✓ {year}: {job.output_rows:,} rows{fixed}", flush=True)
         except Exception as e:
-            error_msg = str(e)
-            if "type" in error_msg.lower() and "mismatch" in error_msg.lower():
-                # Schema conflict - try loading as string
-                print(f"  ⚠️  {year}: Schema conflict, retrying...", flush=True)
-                try:
-                    # Read parquet, convert problematic columns to string
-                    df = pd.read_parquet(uri)
-                    
-                    # Convert all columns to compatible types
-                    for col in df.columns:
-                        if df[col].dtype == 'object':
-                            df[col] = df[col].astype(str)
-                    
-                    # Write to temp location
-                    temp_uri = f'{BUCKET}/temp/{table_name}_{year}_fixed.parquet'
-                    df.to_parquet(temp_uri.replace('gs://', '/tmp/'), index=False)
-                    
-                    # Upload fixed file
-                    import subprocess
-                    subprocess.run(['gsutil', 'cp', f'/tmp/{table_name}_{year}_fixed.parquet', temp_uri])
-                    
-                    # Try loading again
-                    job = client.load_table_from_uri(
-                        temp_uri,
-                        f'{PROJECT_ID}.{DATASET_ID}.{table_name}',
-                        job_config=job_config
-                    )
-                    job.result()
-                    loaded_years.append(year)
-                    print(f"  ✓ {year}: {job.output_rows:,} rows (fixed)", flush=True)
-                    
-                except Exception as e2:
-                    failed_years.append((year, str(e2)[:100]))
-                    print(f"  ✗ {year}: Failed ({str(e2)[:50]})", flush=True)
-            else:
-                failed_years.append((year, error_msg[:100]))
-                print(f"  ✗ {year}: {error_msg[:50]}", flush=True)
-    
+            failed_years.append((year, str(e)[:100]))
+            print(f"  ✗ {year}: {str(e)[:50]}", flush=True)
+    print(f"  Loads finished in {time.time() - start:.1f}s")
+
     # Summary
     print(f"\n  Summary:")
     print(f"  ✓ Loaded: {len(loaded_years)} years")
     if failed_years:
         print(f"  ✗ Failed: {len(failed_years)} years")
-        for year, error in failed_years[:5]:
+        for year, error in sorted(failed_years)[:5]:
             print(f"    - {year}: {error}")
-    
+
     # Get final count
     try:
-        query = f"SELECT COUNT(*) as cnt FROM `{PROJECT_ID}.{DATASET_ID}.{table_name}`"
-        result = client.query(query).result()
-        count = list(result)[0]['cnt']
+        count = client.get_table(table_id).num_rows
         print(f"  📊 Total rows: {count:,}")
         return count
-    except:
+    except Exception:
         return 0
 
-# Load each table
-tables = {
-    'projects': 'projects_parquet',
-    'abstracts': 'abstracts_parquet',
-    'linktables': 'linktables_parquet'
-}
 
-totals = {}
-for table_name, folder in tables.items():
-    totals[table_name] = load_table_robust(table_name, folder)
-
-# Load single-file tables
-print(f"\n{'='*70}")
-print("Loading PATENTS")
-print(f"{'='*70}")
-
-job_config = bigquery.LoadJobConfig(
-    source_format=bigquery.SourceFormat.PARQUET,
-    write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
-    autodetect=True
-)
-
-try:
-    job = client.load_table_from_uri(
-        f'{BUCKET}/patents_parquet/patents_ALL.parquet',
-        f'{PROJECT_ID}.{DATASET_ID}.patents',
-        job_config=job_config
+def load_patents(client):
+    print(f"\n{'='*70}")
+    print("Loading PATENTS")
+    print(f"{'='*70}")
+
+    job_config = bigquery.LoadJobConfig(
+        source_format=bigquery.SourceFormat.PARQUET,
+        write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
+        autodetect=True
     )
-    job.result()
-    totals['patents'] = job.output_rows
-    print(f"✓ Patents: {job.output_rows:,} rows")
-except Exception as e:
-    print(f"✗ Patents failed: {e}")
-    totals['patents'] = 0
-
-print("\n" + "="*70)
-print("✓ LOAD COMPLETE!")
-print("="*70)
-
-print("\nFinal Summary:")
-for table, count in totals.items():
-    print(f"  {table}: {count:,} rows")
-
-print("\nTotal records loaded:", sum(totals.values()))
+
+    try:
+        job = client.load_table_from_uri(
+            f'{BUCKET}/patents_parquet/patents_ALL.parquet',
+            f'{PROJECT_ID}.{DATASET_ID}.patents',
+            job_config=job_config
+        )
+        job.result()
+        print(f"✓ Patents: {job.output_rows:,} rows")
+        return job.output_rows
+    except Exception as e:
+        print(f"✗ Patents failed: {e}")
+        return 0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tables', nargs='+', choices=list(TABLES) + ['patents'],
+                        default=list(TABLES) + ['patents'])
+    parser.add_argument('--years', nargs='+', type=int, default=ALL_YEARS)
+    parser.add_argument('--workers', type=int, default=WORKERS)
+    parser.add_argument('--replace', action='store_true',
+                        help='Allow a --years subset to replace the tables (the other years are dropped)')
+    args = parser.parse_args()
+    if not set(ALL_YEARS) <= set(args.years) and set(args.tables) - {'patents'} and not args.replace:
+        parser.error(f"the tables are recreated from --years only, dropping every other year of "
+                     f"{ALL_YEARS[0]}-{ALL_YEARS[-1]}; pass --replace to do that")
+
+    client = bigquery.Client(project=PROJECT_ID)
+
+    print("="*70)
+    print("Loading NIH ExPORTER to BigQuery (Robust Version)")
+    print("="*70)
+
+    # Create dataset if needed
+    dataset = bigquery.Dataset(f"{PROJECT_ID}.{DATASET_ID}")
+    dataset.location = "US"
+    try:
+        client.create_dataset(dataset, exists_ok=True)
+        print(f"✓ Dataset ready: {DATASET_ID}\n")
+    except Exception as e:
+        print(f"Dataset exists: {e}\n")
+
+    totals = {}
+    for table_name, folder in TABLES.items():
+        if table_name in args.tables:
+            totals[table_name] = load_table_robust(client, table_name, folder, args.years, args.workers)
+    if 'patents' in args.tables:
+        totals['patents'] = load_patents(client)
+
+    print("\n" + "="*70)
+    print("✓ LOAD COMPLETE!")
+    print("="*70)
+
+    print("\nFinal Summary:")
+    for table, count in totals.items():
+        print(f"  {table}: {count:,} rows")
+
+    print("\nTotal records loaded:", sum(totals.values()))
+
+
+if __name__ == "__main__":
+    main()
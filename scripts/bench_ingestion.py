@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Offline throughput benchmark for the ingestion fetchers
+Project: od-cl-odss-conroyri-f75a
+
+Starts the mock RePORTER/NSF server (mock_api_server.py) in-process and runs
+each fetcher implementation against it:
+  reporter_sequential  one request at a time, stops at the 15K offset limit
+                       (the pre-concurrency 01_download_nih_data_api.py loop)
+  reporter_concurrent  01_download_nih_data_api.py engine: partitioned slices,
+                       shared pool + token bucket, checkpointed fragments
+  nih_fetcher          cloud_functions/nih_fetcher streaming fetcher
+  nsf_sequential       cloud_functions/nsf_fetcher, NSF_FETCH_MODE=sequential
+  nsf_parallel         cloud_functions/nsf_fetcher, parallel page window
+and reports records/sec, retries (429/5xx responses) and latency percentiles.
+
+Usage:
+  python3 scripts/bench_ingestion.py --latency 0.2 --error-rate 0.02 --rate-limit 20
+  python3 scripts/bench_ingestion.py --reporter-fixture data/fixtures/reporter_fy2021.ndjson.gz \\
+      --only reporter_sequential reporter_concurrent
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from mock_api_server import add_server_args, build_state, start_server
+from reporter_client import ReporterClient, MAX_OFFSET
+from reporter_store import ReporterStore
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(SCRIPTS_DIR)
+
+IMPLEMENTATIONS = ['reporter_sequential', 'reporter_concurrent', 'nih_fetcher',
+                   'nsf_sequential', 'nsf_parallel']
+
+
+def load_module(name, path):
+    """Import a module from a file path (digit-prefixed scripts, cloud function main.py)"""
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class LatencyRecorder:
+    """requests response hook: records latency and status of every response"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.statuses = []
+
+    def __call__(self, response, *args, **kwargs):
+        with self.lock:
+            self.latencies.append(response.elapsed.total_seconds())
+            self.statuses.append(response.status_code)
+
+    def attach(self, session):
+        session.hooks['response'].append(self)
+        return session
+
+    def summary(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            statuses = list(self.statuses)
+
+        def pct(p):
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))] if latencies else 0.0
+
+        return {
+            'requests': len(statuses),
+            'retries': sum(1 for s in statuses if s == 429 or s >= 500),
+            'latency_p50': pct(0.50),
+            'latency_p95': pct(0.95),
+            'latency_p99': pct(0.99),
+        }
+
+
+# Implementations ------------------------------------------------------------
+# Each returns the number of records fetched.
+
+def run_reporter_sequential(base_url, years, recorder, tmp, args):
+    client = ReporterClient(api_url=f"{base_url}/v2/projects/search", concurrency=1,
+                            rate=args.client_rate)
+    recorder.attach(client.session)
+    records = 0
+    for fy in years:
+        offset = 0
+        while offset <= MAX_OFFSET:
+            data = client.search({"criteria": {"fiscal_years": [fy]}, "offset": offset, "limit": 500,
+                                  "sort_field": "ApplId", "sort_order": "asc"})
+            results = data.get("results", [])
+            records += len(results)
+            if not results or offset + 500 >= data.get("meta", {}).get("total", 0):
+                break
+            offset += 500
+    return records
+
+
+def run_reporter_concurrent(base_url, years, recorder, tmp, args):
+    download = load_module('download_nih_data_api',
+                           os.path.join(SCRIPTS_DIR, '01_download_nih_data_api.py'))
+    client = ReporterClient(api_url=f"{base_url}/v2/projects/search",
+                            concurrency=args.concurrency, rate=args.client_rate)
+    recorder.attach(client.session)
+    store = ReporterStore(os.path.join(tmp, 'reporter'))
+    records = 0
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for fy in years:
+            download.download_projects_for_year(client, pool, store, fy)
+            records += store.compact('projects', fy)[1]
+    return records
+
+
+def run_nih_fetcher(base_url, years, recorder, tmp, args):
+    nih = load_module('nih_fetcher_main', os.path.join(REPO_DIR, 'cloud_functions', 'nih_fetcher', 'main.py'))
+    session = recorder.attach(requests.Session())
+    criteria = {"criteria": {"fiscal_years": years}}
+    manifest = nih.stream_projects(nih.LocalStorage(tmp), criteria, 'nih_bench',
+                                   api_url=f"{base_url}/v2/projects/search", session=session)
+    return manifest['records']
+
+
+def run_nsf(mode):
+    def run(base_url, years, recorder, tmp, args):
+        nsf = load_module('nsf_fetcher_main', os.path.join(REPO_DIR, 'cloud_functions', 'nsf_fetcher', 'main.py'))
+        session = recorder.attach(nsf.make_session(args.concurrency))
+        manifest = nsf.stream_awards(nsf.LocalStorage(tmp), {"keyword": "bench"}, f"nsf_{mode}",
+                                     mode=mode, concurrency=args.concurrency,
+                                     api_url=f"{base_url}/services/v1/awards.json", session=session)
+        return manifest['records']
+    return run
+
+
+RUNNERS = {
+    'reporter_sequential': run_reporter_sequential,
+    'reporter_concurrent': run_reporter_concurrent,
+    'nih_fetcher': run_nih_fetcher,
+    'nsf_sequential': run_nsf('sequential'),
+    'nsf_parallel': run_nsf('parallel'),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_server_args(parser)
+    parser.add_argument('--only', nargs='+', choices=IMPLEMENTATIONS, default=IMPLEMENTATIONS)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--client-rate', type=float, default=50.0,
+                        help='Client-side token bucket rate for the RePORTER engines (req/s)')
+    parser.add_argument('--json', help='Also write results to this JSON file')
+    args = parser.parse_args()
+
+    state = build_state(args)
+    server, base_url = start_server(state)
+    years = sorted({r.get('fiscal_year') for r in state.reporter if r.get('fiscal_year')})
+
+    print(f"\n{'='*78}")
+    print(f"Ingestion benchmark against {base_url}")
+    print(f"RePORTER: {len(state.reporter):,} records (FY {years}), NSF: {len(state.nsf):,} awards")
+    print(f"latency={args.latency}s+{args.jitter}s error_rate={args.error_rate} "
+          f"rate_limit={args.rate_limit or 'none'} concurrency={args.concurrency}")
+    print(f"{'='*78}\n")
+
+    results = []
+    for name in args.only:
+        recorder = LatencyRecorder()
+        with tempfile.TemporaryDirectory() as tmp:
+            start = time.time()
+            try:
+                records = RUNNERS[name](base_url, years, recorder, tmp, args)
+                error = None
+            except Exception as e:
+                records, error = 0, str(e)
+            elapsed = time.time() - start
+        row = {'implementation': name, 'records': records, 'elapsed_sec': elapsed,
+               'records_per_sec': records / elapsed if elapsed else 0.0, 'error': error}
+        row.update(recorder.summary())
+        results.append(row)
+        status = f"❌ {error}" if error else "✓"
+        print(f"{status} {name}: {records:,} records in {elapsed:.1f}s")
+
+    server.shutdown()
+
+    print(f"\n{'implementation':<22}{'records':>9}{'rec/s':>10}{'reqs':>7}{'retries':>9}"
+          f"{'p50':>8}{'p95':>8}{'p99':>8}")
+    for r in results:
+        print(f"{r['implementation']:<22}{r['records']:>9,}{r['records_per_sec']:>10.1f}"
+              f"{r['requests']:>7}{r['retries']:>9}{r['latency_p50']:>8.3f}"
+              f"{r['latency_p95']:>8.3f}{r['latency_p99']:>8.3f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\n✓ Results saved to {args.json}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,677 @@
+#!/usr/bin/env python3
+"""
+Length-bucketed, token-budget batching for BERT [CLS] embeddings
+Project: od-cl-odss-conroyri-f75a
+The embedding scripts used to slice fixed row counts in table order and pad
+every batch to its longest text, so a single long abstract made the whole
+batch pay for 512 positions. BertEmbedder tokenizes everything once, sorts
+rows by token length and cuts batches by a padded-token budget
+(rows x longest row <= max_tokens), so short texts travel in large batches
+and long ones in small batches. Vectors are scattered back to input order.
+
+Input preparation overlaps with inference: a background thread tokenizes the
+texts PIPELINE_CHUNK at a time, plans each chunk's batches and pads them into
+ready tensors (pinned memory on GPU), while the calling thread only runs the
+model. A queue of at most `prefetch` prepared batches sits between the two,
+so memory stays flat however long the input is. prefetch=0 runs the same
+steps serially. The tokenizer and both backends release the GIL, so one
+producer thread is enough to keep the model busy.
+
+Backends:
+  torch       Hugging Face model (GPU if available)
+  onnx        exported ONNX graph on ONNX Runtime, CPU (same vectors as torch)
+  onnx-int8   the ONNX graph with dynamically quantized int8 weights
+The ONNX files are exported once per model to data/onnx/{model}/ (torch is
+only needed for the export). int8 vectors are close to, but not identical
+with, the fp32 ones, so they use their own embedding cache namespace
+(cache_model) and should pass `check` before a large run.
+
+Sharded runs (embed_sharded) split the input across CPU worker processes
+with pinned thread counts; each writes a fragment under data/embedding_shards/
+and the merge checks that every APPLICATION_ID is covered exactly once.
+
+Usage:
+  from bert_embedder import make_embedder, run_embedding
+  embedder = make_embedder(model_name, backend='onnx-int8')
+  vectors = embedder.embed(texts)            # (n, 768) float32, input order
+  vectors, stats = run_embedding(app_ids, texts, model_name, workers=8, recipe='PROJECT_TERMS')
+
+  python3 scripts/bert_embedder.py export --quantize
+  # Cosine agreement of the ONNX backends with the torch [CLS] vectors
+  python3 scripts/bert_embedder.py check --parquet grants_100k_stratified.parquet --column PROJECT_TERMS
+  # Fixed-size loop vs token-budget batches (serial / pipelined input), tokens/sec per backend
+  python3 scripts/bert_embedder.py benchmark --parquet grants_100k_stratified.parquet \\
+      --column PROJECT_TERMS --limit 2000 --backends torch onnx onnx-int8
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+from contextlib import closing
+
+import numpy as np
+
+MAX_LENGTH = 512
+EMBEDDING_DIM = 768
+# Padded tokens per forward pass: 8 x 512 on CPU, 32 x 512 on GPU (the old
+# worst-case batch shapes), capped at MAX_ROWS rows for very short texts
+CPU_MAX_TOKENS = 8 * MAX_LENGTH
+GPU_MAX_TOKENS = 32 * MAX_LENGTH
+MAX_ROWS = 256
+DEFAULT_MODEL = 'microsoft/BiomedNLP-PubMedBERT-base-uncased-abstract-fulltext'
+BACKENDS = ['torch', 'onnx', 'onnx-int8']
+ONNX_DIR = 'data/onnx'
+SHARD_DIR = 'data/embedding_shards'
+# Minimum per-text cosine with the torch vectors for `check` to pass
+MIN_COSINE = {'onnx': 0.9999, 'onnx-int8': 0.98}
+# Texts tokenized (and batch-planned) per chunk, and prepared batches queued ahead of the model
+PIPELINE_CHUNK = 4096
+PREFETCH_BATCHES = 8
+
+
+def plan_batches(lengths, max_tokens, max_rows=MAX_ROWS):
+    """
+    Row-index batches, longest texts first, each within the padded-token budget
+    A batch costs len(batch) * max(lengths in batch). Rows longer than the
+    budget still get a batch of their own.
+    """
+    lengths = np.asarray(lengths)
+    order = np.argsort(-lengths, kind='stable')
+    batches, start = [], 0
+    while start < len(order):
+        # Sorted descending, so the first row of the batch sets its padded width
+        rows = max(1, min(max_rows, max_tokens // max(int(lengths[order[start]]), 1)))
+        batches.append(order[start:start + rows])
+        start += rows
+    return batches
+
+
+def fixed_batches(n, batch_size):
+    """The previous schedule: consecutive rows, batch_size at a time"""
+    return [np.arange(i, min(i + batch_size, n)) for i in range(0, n, batch_size)]
+
+
+def prefetch(items, depth):
+    """
+    Iterate over `items` produced on a background thread, at most depth ahead
+    An exception in the producer is re-raised in the consumer; closing the
+    consumer early stops the producer.
+    """
+    import queue
+    import threading
+
+    done = object()
+    buffer = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put((item, None)):
+                    return
+            put((done, None))
+        except BaseException as e:
+            put((done, e))
+
+    thread = threading.Thread(target=produce, name='embedding-input', daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = buffer.get()
+            if item is done:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+def padding_stats(lengths, batches):
+    lengths = np.asarray(lengths)
+    real = int(lengths.sum())
+    padded = int(sum(len(b) * lengths[b].max() for b in batches if len(b)))
+    return {'batches': len(batches), 'real_tokens': real, 'padded_tokens': padded,
+            'padding_efficiency': real / padded if padded else 1.0}
+
+
+class BertEmbedder:
+    """[CLS] vectors from a Hugging Face BERT model with token-budget batching"""
+
+    backend = 'torch'
+
+    def __init__(self, model_name, device=None, max_length=MAX_LENGTH, max_tokens=None, max_rows=MAX_ROWS,
+                 tokenizer=None, model=None, prefetch=PREFETCH_BATCHES, chunk_size=PIPELINE_CHUNK):
+        import torch
+        from transformers import AutoTokenizer, AutoModel
+
+        self.torch = torch
+        self.device = torch.device(device or ('cuda' if torch.cuda.is_available() else 'cpu'))
+        self.tokenizer = tokenizer or AutoTokenizer.from_pretrained(model_name)
+        self.model = model or AutoModel.from_pretrained(model_name)
+        self.model.to(self.device)
+        self.model.eval()
+        self.dim = getattr(self.model.config, 'hidden_size', EMBEDDING_DIM)
+        self._setup(model_name, max_length, max_tokens or (GPU_MAX_TOKENS if self.device.type == 'cuda'
+                                                          else CPU_MAX_TOKENS), max_rows, prefetch, chunk_size)
+
+    def _setup(self, model_name, max_length, max_tokens, max_rows, prefetch, chunk_size):
+        self.model_name = model_name
+        self.max_length = max_length
+        self.max_tokens = max_tokens
+        self.max_rows = max_rows
+        self.prefetch = prefetch
+        self.chunk_size = chunk_size
+        self.stats = {}
+        self.totals = {}
+
+    @property
+    def cache_model(self):
+        """Embedding cache model key: quantized backends get their own namespace"""
+        return self.model_name if self.backend in ('torch', 'onnx') else f"{self.model_name}+{self.backend}"
+
+    def tokenize(self, texts):
+        """Token ids per text (truncated, with special tokens, unpadded)"""
+        return self.tokenizer([str(t) for t in texts], truncation=True, max_length=self.max_length,
+                              padding=False, return_attention_mask=False,
+                              return_token_type_ids=False)['input_ids']
+
+    def prepare(self, input_ids):
+        """Padded model inputs for one batch (pinned, ready for a non-blocking copy, on GPU)"""
+        inputs = self.tokenizer.pad({'input_ids': input_ids}, padding=True, return_tensors='pt')
+        if self.device.type == 'cuda':
+            inputs = {k: v.pin_memory() for k, v in inputs.items()}
+        return inputs
+
+    def run(self, inputs):
+        """[CLS] vectors for one batch from prepare()"""
+        inputs = {k: v.to(self.device, non_blocking=True) for k, v in inputs.items()}
+        with self.torch.no_grad():
+            outputs = self.model(**inputs)
+        return outputs.last_hidden_state[:, 0, :].float().cpu().numpy()
+
+    def forward(self, input_ids):
+        """[CLS] vectors for one batch of unpadded token id lists"""
+        return self.run(self.prepare(input_ids))
+
+    def prepared_batches(self, texts, batches=None):
+        """
+        (rows, token lengths, model inputs) per batch
+        Without an explicit schedule, texts are tokenized chunk_size at a time
+        and each chunk gets its own token-budget plan, so only one chunk of
+        token ids is alive at once.
+        """
+        if batches is not None:
+            input_ids = self.tokenize(texts)
+            lengths = np.fromiter((len(ids) for ids in input_ids), dtype=np.int64, count=len(input_ids))
+            for batch in batches:
+                yield batch, lengths[batch], self.prepare([input_ids[i] for i in batch])
+            return
+        for start in range(0, len(texts), self.chunk_size):
+            input_ids = self.tokenize(texts[start:start + self.chunk_size])
+            lengths = np.fromiter((len(ids) for ids in input_ids), dtype=np.int64, count=len(input_ids))
+            for batch in plan_batches(lengths, self.max_tokens, self.max_rows):
+                yield start + batch, lengths[batch], self.prepare([input_ids[i] for i in batch])
+
+    def embed(self, texts, batches=None, progress=True):
+        """
+        (n, dim) float32 vectors in input order
+        A batch that fails is logged and left as NaN rows, which the
+        embedding cache does not store, so those rows are retried next run.
+        """
+        from tqdm import tqdm
+
+        texts = list(texts)
+        source = self.prepared_batches(texts, batches)
+        if self.prefetch:
+            source = prefetch(source, self.prefetch)
+
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        lengths = np.zeros(len(texts), dtype=np.int64)
+        planned, failed, waited = [], 0, 0.0
+        start = time.time()
+        with tqdm(total=len(texts), desc="Embedding", disable=not progress) as pbar, closing(source):
+            while True:
+                # Time the model spends waiting for input (the whole preparation when serial)
+                t0 = time.time()
+                item = next(source, None)
+                waited += time.time() - t0
+                if item is None:
+                    break
+                batch, batch_lengths, inputs = item
+                lengths[batch] = batch_lengths
+                planned.append(batch)
+                try:
+                    vectors[batch] = self.run(inputs)
+                except Exception as e:
+                    vectors[batch] = np.nan
+                    failed += len(batch)
+                    print(f"\nError in batch of {len(batch)} (longest {batch_lengths.max()} tokens): {e}")
+                pbar.update(len(batch))
+        elapsed = time.time() - start
+
+        self.stats = dict(padding_stats(lengths, planned), rows=len(texts), failed_rows=failed,
+                          seconds=elapsed, input_wait_seconds=waited, prefetch=self.prefetch,
+                          tokens_per_sec=float(lengths.sum() / elapsed) if elapsed else 0.0)
+        add_totals(self.totals, self.stats)
+        return vectors
+
+
+def add_totals(totals, stats):
+    """Fold one embed() call's stats into running totals (cached_embed calls embed once per chunk)"""
+    for key in ['rows', 'failed_rows', 'batches', 'real_tokens', 'padded_tokens', 'seconds', 'input_wait_seconds']:
+        totals[key] = totals.get(key, 0) + stats.get(key, 0)
+    totals['padding_efficiency'] = totals['real_tokens'] / totals['padded_tokens'] if totals['padded_tokens'] else 1.0
+    totals['tokens_per_sec'] = totals['real_tokens'] / totals['seconds'] if totals['seconds'] else 0.0
+    return totals
+
+
+# ONNX Runtime backend --------------------------------------------------------
+
+def onnx_paths(model_name, root=ONNX_DIR):
+    """(fp32 path, int8 path) of the exported graphs for model_name"""
+    from embedding_cache import slug
+    directory = os.path.join(root, slug(model_name))
+    return os.path.join(directory, 'model.onnx'), os.path.join(directory, 'model.int8.onnx')
+
+
+def export_onnx(model_name, root=ONNX_DIR, quantize=False, opset=14):
+    """Export the [CLS] head of model_name to ONNX (and int8) once; returns (fp32, int8) paths"""
+    fp32_path, int8_path = onnx_paths(model_name, root)
+    if not os.path.exists(fp32_path):
+        import torch
+        from transformers import AutoTokenizer, AutoModel
+
+        class ClsHead(torch.nn.Module):
+            def __init__(self, model):
+                super().__init__()
+                self.model = model
+
+            def forward(self, input_ids, attention_mask, token_type_ids):
+                return self.model(input_ids=input_ids, attention_mask=attention_mask,
+                                  token_type_ids=token_type_ids).last_hidden_state[:, 0, :]
+
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModel.from_pretrained(model_name).eval()
+        sample = tokenizer(['onnx export sample', 'a second, longer onnx export sample text'],
+                           padding=True, return_tensors='pt')
+        inputs = ('input_ids', 'attention_mask', 'token_type_ids')
+        os.makedirs(os.path.dirname(fp32_path), exist_ok=True)
+        tmp = f"{fp32_path}.tmp"
+        with torch.no_grad():
+            torch.onnx.export(ClsHead(model), tuple(sample[k] for k in inputs), tmp,
+                              input_names=list(inputs), output_names=['cls'], opset_version=opset,
+                              dynamic_axes={**{k: {0: 'batch', 1: 'sequence'} for k in inputs},
+                                            'cls': {0: 'batch'}})
+        os.replace(tmp, fp32_path)
+        tokenizer.save_pretrained(os.path.dirname(fp32_path))
+        print(f"  Exported {model_name} -> {fp32_path}")
+    if quantize and not os.path.exists(int8_path):
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        tmp = f"{int8_path}.tmp"
+        quantize_dynamic(fp32_path, tmp, weight_type=QuantType.QInt8)
+        os.replace(tmp, int8_path)
+        print(f"  Quantized (int8 weights) -> {int8_path}")
+    return fp32_path, int8_path
+
+
+class OnnxBertEmbedder(BertEmbedder):
+    """BertEmbedder running the exported graph on ONNX Runtime (CPU)"""
+
+    def __init__(self, model_name, quantized=False, max_length=MAX_LENGTH, max_tokens=None, max_rows=MAX_ROWS,
+                 threads=None, root=ONNX_DIR, prefetch=PREFETCH_BATCHES, chunk_size=PIPELINE_CHUNK):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        self.backend = 'onnx-int8' if quantized else 'onnx'
+        fp32_path, int8_path = export_onnx(model_name, root, quantize=quantized)
+        self.path = int8_path if quantized else fp32_path
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = threads or os.cpu_count() or 1
+        self.session = ort.InferenceSession(self.path, options, providers=['CPUExecutionProvider'])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        self.tokenizer = AutoTokenizer.from_pretrained(os.path.dirname(fp32_path))
+        self.device = 'cpu'
+        dim = self.session.get_outputs()[0].shape[-1]
+        self.dim = dim if isinstance(dim, int) else EMBEDDING_DIM
+        self._setup(model_name, max_length, max_tokens or CPU_MAX_TOKENS, max_rows, prefetch, chunk_size)
+
+    def prepare(self, input_ids):
+        inputs = self.tokenizer.pad({'input_ids': input_ids}, padding=True, return_tensors='np')
+        feed = {'input_ids': inputs['input_ids'].astype(np.int64),
+                'attention_mask': inputs['attention_mask'].astype(np.int64)}
+        feed['token_type_ids'] = np.zeros_like(feed['input_ids'])
+        return {k: feed[k] for k in self.input_names}
+
+    def run(self, inputs):
+        return self.session.run(['cls'], inputs)[0].astype(np.float32)
+
+
+def make_embedder(model_name, backend='torch', device=None, **kwargs):
+    """BertEmbedder for one of BACKENDS"""
+    if backend == 'torch':
+        return BertEmbedder(model_name, device, **kwargs)
+    if backend in ('onnx', 'onnx-int8'):
+        return OnnxBertEmbedder(model_name, quantized=backend == 'onnx-int8', **kwargs)
+    raise ValueError(f"Unknown backend {backend!r}; expected one of {BACKENDS}")
+
+
+def cosine_rows(a, b):
+    """Per-row cosine similarity of two equally shaped matrices"""
+    a = a / np.maximum(np.linalg.norm(a, axis=1, keepdims=True), 1e-12)
+    b = b / np.maximum(np.linalg.norm(b, axis=1, keepdims=True), 1e-12)
+    return (a * b).sum(axis=1)
+
+
+def check(texts, model_name, backends=('onnx', 'onnx-int8')):
+    """Cosine agreement of each backend with the torch CPU [CLS] vectors"""
+    reference = BertEmbedder(model_name, 'cpu').embed(texts, progress=False)
+    results = {}
+    for backend in backends:
+        cos = cosine_rows(reference, make_embedder(model_name, backend).embed(texts, progress=False))
+        results[backend] = {'texts': len(texts), 'mean_cosine': float(cos.mean()), 'min_cosine': float(cos.min()),
+                            'p01_cosine': float(np.percentile(cos, 1)), 'threshold': MIN_COSINE[backend],
+                            'passed': bool(cos.min() >= MIN_COSINE[backend])}
+    return results
+
+
+# Sharded CPU runs ------------------------------------------------------------
+# One worker process per shard, each with its own pinned thread count: torch
+# intra-op threading scales poorly with small batches, separate processes do
+# not. Workers are subprocesses running `bert_embedder.py shard`, so the
+# calling script is never re-imported. Every worker writes its own fragment
+# and a finished fragment is skipped when an interrupted run is repeated.
+
+def shard_rows(lengths, n_shards):
+    """Row positions per shard: rows dealt round-robin by length so shards get equal work"""
+    order = np.argsort(-np.asarray(lengths), kind='stable')
+    return [np.sort(order[k::n_shards]) for k in range(n_shards)]
+
+
+def _id_array(ids):
+    ids = np.asarray(ids)
+    return ids.astype(str) if ids.dtype == object else ids
+
+
+def run_shard(run_dir, shard):
+    """Worker: embed one shard of run_dir/inputs.parquet into run_dir/shard-{k}.*"""
+    import pandas as pd
+    from embedding_cache import cached_embed
+
+    with open(os.path.join(run_dir, 'run.json')) as f:
+        config = json.load(f)
+    inputs = pd.read_parquet(os.path.join(run_dir, 'inputs.parquet'))
+    rows = shard_rows(inputs['text'].str.len().to_numpy(), config['workers'])[shard]
+    texts = inputs['text'].iloc[rows].tolist()
+
+    kwargs = {'max_tokens': config['max_tokens'], 'prefetch': config.get('prefetch', PREFETCH_BATCHES)}
+    if config['backend'] == 'torch':
+        import torch
+        torch.set_num_threads(config['threads'])
+    else:
+        kwargs['threads'] = config['threads']
+    embedder = make_embedder(config['model'], config['backend'], 'cpu', **kwargs)
+    base = os.path.join(run_dir, f"shard-{shard:03d}")
+    vectors = np.lib.format.open_memmap(f"{base}.vecs.npy", mode='w+', dtype=np.float32,
+                                        shape=(len(rows), embedder.dim))
+    if config['recipe']:
+        # The parent compacts once every shard is done (workers share the namespace)
+        _, stats = cached_embed(texts, embedder.embed, model=embedder.cache_model, recipe=config['recipe'],
+                                out=vectors, compact=False)
+        stats['cache_model'] = embedder.cache_model
+    else:
+        vectors[:] = embedder.embed(texts, progress=False)
+        stats = {'failed': embedder.totals['failed_rows']}
+    vectors.flush()
+    np.save(f"{base}.ids.npy", _id_array(inputs['id'].iloc[rows].to_numpy()))
+    # Written last: marks the fragment complete
+    stats = dict(stats, shard=shard, rows=len(rows), batching=embedder.totals)
+    with open(f"{base}.json", 'w') as f:
+        json.dump(stats, f, indent=2)
+    return stats
+
+
+def merge_fragments(run_dir, ids, n_shards, out=None):
+    """
+    Vectors aligned with ids from the shard fragments, written into out when given
+    Raises ValueError unless the fragments cover every id exactly once.
+    """
+    ids = _id_array(ids)
+    frag_ids = [np.load(os.path.join(run_dir, f"shard-{k:03d}.ids.npy")) for k in range(n_shards)]
+    all_ids = np.concatenate(frag_ids) if frag_ids else ids[:0]
+    values, counts = np.unique(all_ids, return_counts=True)
+    duplicated = values[counts > 1]
+    missing = np.setdiff1d(ids, values)
+    extra = np.setdiff1d(values, ids)
+    if len(duplicated) or len(missing) or len(extra):
+        raise ValueError(f"Shard fragments in {run_dir} do not cover the input: {len(missing):,} missing, "
+                         f"{len(duplicated):,} duplicated, {len(extra):,} unexpected APPLICATION_IDs "
+                         f"(e.g. {missing[:3].tolist() + duplicated[:3].tolist() + extra[:3].tolist()})")
+    order = np.argsort(ids, kind='stable')
+    for k, shard_ids in enumerate(frag_ids):
+        vecs = np.load(os.path.join(run_dir, f"shard-{k:03d}.vecs.npy"), mmap_mode='r')
+        if out is None:
+            out = np.zeros((len(ids), vecs.shape[1]), dtype=np.float32)
+        out[order[np.searchsorted(ids[order], shard_ids)]] = vecs
+    return out if out is not None else np.zeros((len(ids), 0), dtype=np.float32)
+
+
+def embed_sharded(ids, texts, model_name, backend='torch', workers=2, threads=None, recipe=None,
+                  max_tokens=None, root=SHARD_DIR, keep=False, out=None, prefetch=PREFETCH_BATCHES):
+    """
+    Embed texts with `workers` CPU processes; returns (vectors in input order, stats)
+    ids (APPLICATION_IDs) must be unique; recipe enables the embedding cache;
+    out is an optional preallocated (len(ids), dim) array to merge into.
+    """
+    import subprocess
+    import pandas as pd
+
+    ids = _id_array(ids)
+    if len(np.unique(ids)) != len(ids):
+        raise ValueError(f"{len(ids) - len(np.unique(ids)):,} duplicate APPLICATION_IDs in the input")
+    threads = threads or max(1, (os.cpu_count() or 1) // workers)
+    config = {'model': model_name, 'backend': backend, 'recipe': recipe, 'workers': workers,
+              'threads': threads, 'max_tokens': max_tokens or CPU_MAX_TOKENS, 'prefetch': prefetch,
+              'rows': len(ids)}
+    digest = hashlib.sha1(json.dumps(config, sort_keys=True).encode('utf-8'))
+    digest.update(ids.tobytes())
+    for text in texts:
+        digest.update(str(text).encode('utf-8') + b'\x00')
+    run_dir = os.path.join(root, digest.hexdigest()[:16])
+
+    os.makedirs(run_dir, exist_ok=True)
+    if not os.path.exists(os.path.join(run_dir, 'run.json')):
+        pd.DataFrame({'id': ids, 'text': [str(t) for t in texts]}).to_parquet(
+            os.path.join(run_dir, 'inputs.parquet'), index=False)
+        with open(os.path.join(run_dir, 'run.json'), 'w') as f:
+            json.dump(config, f, indent=2)
+
+    # One thread pool per worker; the tokenizer must not start its own
+    env = dict(os.environ, OMP_NUM_THREADS=str(threads), MKL_NUM_THREADS=str(threads),
+               TOKENIZERS_PARALLELISM='false')
+    pending = [k for k in range(workers) if not os.path.exists(os.path.join(run_dir, f"shard-{k:03d}.json"))]
+    print(f"  Sharded run {run_dir}: {workers} workers x {threads} threads, "
+          f"{workers - len(pending)} shards already done")
+    start = time.time()
+    procs = {k: subprocess.Popen([sys.executable, os.path.abspath(__file__), 'shard', run_dir, str(k)], env=env)
+             for k in pending}
+    failed = [k for k, proc in procs.items() if proc.wait() != 0]
+    if failed:
+        raise RuntimeError(f"Shards {failed} failed; rerun to resume ({run_dir} keeps finished shards)")
+    elapsed = time.time() - start
+
+    vectors = merge_fragments(run_dir, ids, workers, out)
+    stats = {'workers': workers, 'threads_per_worker': threads, 'cache_hits': 0, 'computed': 0, 'failed': 0}
+    batching, cache_model = {}, None
+    for k in range(workers):
+        with open(os.path.join(run_dir, f"shard-{k:03d}.json")) as f:
+            shard = json.load(f)
+        stats['cache_hits'] += shard.get('cache_hits', 0)
+        stats['computed'] += shard.get('computed', 0)
+        stats['failed'] += shard.get('failed', 0)
+        stats['cache_dir'] = shard.get('cache_dir')
+        cache_model = shard.get('cache_model', cache_model)
+        add_totals(batching, shard['batching'])
+    if cache_model and stats['computed']:
+        from embedding_cache import EmbeddingCache
+        EmbeddingCache(cache_model, recipe).compact()
+    # Worker seconds overlap: report wall-clock throughput
+    batching['worker_seconds'], batching['seconds'] = batching.get('seconds', 0), elapsed
+    batching['tokens_per_sec'] = batching.get('real_tokens', 0) / elapsed if elapsed else 0.0
+    stats['batching'] = batching
+    if not keep:
+        shutil.rmtree(run_dir)
+    return vectors, stats
+
+
+def run_embedding(ids, texts, model_name, backend='torch', device=None, workers=1, recipe=None, out=None,
+                  prefetch=PREFETCH_BATCHES):
+    """
+    The embedding scripts' entry point: cached, token-budget embedding of texts,
+    in-process (workers=1) or sharded across CPU worker processes.
+    Vectors go into `out` when given (see embedding_store.create). prefetch=0
+    turns off the background input pipeline.
+    Returns (vectors aligned with texts, stats with cache and batching counters);
+    rows that could not be embedded are NaN and counted in stats['failed'].
+    """
+    if workers > 1:
+        return embed_sharded(ids, texts, model_name, backend, workers, recipe=recipe, out=out, prefetch=prefetch)
+    from embedding_cache import cached_embed
+
+    embedder = make_embedder(model_name, backend, device, prefetch=prefetch)
+    print(f"  {backend} on {embedder.device}: length-sorted batches of up to {embedder.max_tokens:,} padded tokens"
+          + (f", {prefetch} batches prepared ahead" if prefetch else ", serial input preparation"))
+    if recipe:
+        vectors, stats = cached_embed(texts, embedder.embed, model=embedder.cache_model, recipe=recipe, out=out)
+    else:
+        vectors = embedder.embed(texts)
+        stats = {'failed': embedder.totals['failed_rows']}
+        if out is not None:
+            out[:] = vectors
+            vectors = out
+    return vectors, dict(stats, workers=1, batching=embedder.totals)
+
+
+def benchmark(texts, model_name, device=None, batch_size=8, max_tokens=None, backends=('torch',)):
+    """
+    The old fixed-size loop (torch) vs the token-budget schedule on each backend,
+    with input preparation serial and pipelined
+    Cosines are against the fixed-size torch vectors; identical_to_serial
+    checks that the pipeline returns exactly the serial vectors.
+    """
+    results = {}
+    reference = None
+    for backend in sorted(backends, key=BACKENDS.index):
+        embedder = make_embedder(model_name, backend, device, max_tokens=max_tokens)
+        # Warm-up so the first timed schedule does not pay for lazy initialisation
+        embedder.embed(texts[:min(len(texts), batch_size)], progress=False)
+        if reference is None and backend == 'torch':
+            reference = embedder.embed(texts, batches=fixed_batches(len(texts), batch_size))
+            results['torch/fixed'] = dict(embedder.stats, min_cosine=1.0)
+        prefetch_depth, embedder.prefetch = embedder.prefetch, 0
+        serial = embedder.embed(texts)
+        results[f"{backend}/serial"] = dict(embedder.stats)
+        embedder.prefetch = prefetch_depth or PREFETCH_BATCHES
+        vectors = embedder.embed(texts)
+        results[f"{backend}/pipelined"] = dict(embedder.stats, identical_to_serial=bool(np.array_equal(serial, vectors)))
+        if reference is not None:
+            for name, v in [('serial', serial), ('pipelined', vectors)]:
+                results[f"{backend}/{name}"]['min_cosine'] = float(cosine_rows(reference, v).min()) \
+                    if len(texts) else 1.0
+    baseline = results.get('torch/fixed') or next(iter(results.values()))
+    for r in results.values():
+        r['speedup'] = baseline['seconds'] / max(r['seconds'], 1e-9)
+    return results
+
+
+def load_texts(path, column, truncate, limit):
+    """A reproducible random sample of texts from a Parquet column"""
+    import pandas as pd
+    values = pd.read_parquet(path, columns=[column])[column]
+    texts = values.fillna('').astype(str).str[:truncate].tolist()
+    return [texts[i] for i in np.random.default_rng(0).permutation(len(texts))[:limit]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--model', default=DEFAULT_MODEL)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_shard = sub.add_parser('shard', help='Worker for embed_sharded(): embed one shard of a run directory')
+    p_shard.add_argument('run_dir')
+    p_shard.add_argument('shard', type=int)
+
+    p_export = sub.add_parser('export', help='Export the ONNX graph (and int8 variant) for --model')
+    p_export.add_argument('--quantize', action='store_true')
+
+    p_check = sub.add_parser('check', help='Cosine agreement of the ONNX backends with torch')
+    p_bench = sub.add_parser('benchmark', help='Fixed-size vs token-budget batching, serial vs pipelined input')
+    for p in (p_check, p_bench):
+        p.add_argument('--parquet', required=True, help='Parquet file with the texts')
+        p.add_argument('--column', default='combined_text')
+        p.add_argument('--truncate', type=int, default=2000, help='Characters kept per text (05 uses 2000)')
+        p.add_argument('--json', help='Also write results to this JSON file')
+    p_check.add_argument('--limit', type=int, default=500)
+    p_check.add_argument('--backends', nargs='+', choices=BACKENDS[1:], default=BACKENDS[1:])
+    p_bench.add_argument('--limit', type=int, default=2000)
+    p_bench.add_argument('--backends', nargs='+', choices=BACKENDS, default=['torch'])
+    p_bench.add_argument('--device', default=None, help='torch backend device')
+    p_bench.add_argument('--batch-size', type=int, default=8, help='Row count of the fixed-size baseline')
+    p_bench.add_argument('--max-tokens', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.command == 'shard':
+        stats = run_shard(args.run_dir, args.shard)
+        print(f"✓ shard {args.shard}: {stats['rows']:,} rows")
+        return 0
+
+    if args.command == 'export':
+        for path in export_onnx(args.model, quantize=args.quantize)[:2 if args.quantize else 1]:
+            print(f"✓ {path} ({os.path.getsize(path) / 1e6:.0f} MB)")
+        return 0
+
+    texts = load_texts(args.parquet, args.column, args.truncate, args.limit)
+    print(f"{args.command.title()}: {len(texts):,} texts from {args.parquet}:{args.column}, model {args.model}")
+
+    if args.command == 'check':
+        results = check(texts, args.model, args.backends)
+        print(f"\n{'backend':<12}{'mean cos':>10}{'p01 cos':>10}{'min cos':>10}{'threshold':>11}")
+        for backend, r in results.items():
+            print(f"{backend:<12}{r['mean_cosine']:>10.5f}{r['p01_cosine']:>10.5f}{r['min_cosine']:>10.5f}"
+                  f"{r['threshold']:>11.4f}  {'✓' if r['passed'] else '❌'}")
+        status = 0 if all(r['passed'] for r in results.values()) else 1
+    else:
+        results = benchmark(texts, args.model, args.device, args.batch_size, args.max_tokens, args.backends)
+        print(f"\n{'backend/schedule':<24}{'batches':>9}{'padding eff':>13}{'seconds':>10}{'input wait':>12}"
+              f"{'tokens/s':>11}{'speedup':>9}{'min cos':>10}")
+        for name, r in results.items():
+            cos = f"{r['min_cosine']:.5f}" if 'min_cosine' in r else '-'
+            print(f"{name:<24}{r['batches']:>9,}{r['padding_efficiency']:>13.1%}{r['seconds']:>10.1f}"
+                  f"{r.get('input_wait_seconds', 0):>11.1f}s{r['tokens_per_sec']:>11,.0f}{r['speedup']:>8.2f}x{cos:>10}")
+            if 'identical_to_serial' in r:
+                print(f"{'':<24}vectors identical to serial: {'✓' if r['identical_to_serial'] else '❌'}")
+        status = 0
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
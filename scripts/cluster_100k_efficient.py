@@ -2,12 +2,21 @@
 """
 Memory-efficient semantic clustering for 100k grants
 Uses MiniBatchKMeans to prevent OOM
+
+Embeddings come from the embedding store; pass a quantized tier to cluster
+from it instead (e.g. embeddings_100k_pubmedbert.int8, from
+`embedding_store.py quantize embeddings_100k_pubmedbert --mode int8 --report`).
 """
 import pandas as pd
 import numpy as np
 from sklearn.cluster import MiniBatchKMeans
 from sklearn.metrics import silhouette_score, calinski_harabasz_score
 import gc
+import sys
+
+import embedding_store
+
+EMBEDDINGS = sys.argv[1] if len(sys.argv) > 1 else 'embeddings_100k_pubmedbert.parquet'
 
 print("=" * 70)
 print("CLUSTERING 100K GRANTS (MEMORY-EFFICIENT)")
@@ -16,7 +25,7 @@ print("=" * 70)
 # Load
 print("\n[1/4] Loading data...")
 df_sample = pd.read_parquet('grants_100k_stratified.parquet')
-df_embeddings = pd.read_parquet('embeddings_100k_pubmedbert.parquet')
+store = embedding_store.open_embeddings(EMBEDDINGS)
 
 # Keep essential columns
 essential_cols = ['APPLICATION_ID', 'PROJECT_TITLE', 'FY', 'IC_NAME']
@@ -24,24 +33,17 @@ available_cols = [c for c in essential_cols if c in df_sample.columns]
 df_sample = df_sample[available_cols]
 
 print(f"  Sample: {len(df_sample):,} grants")
-print(f"  Embeddings: {len(df_embeddings):,} embeddings")
+print(f"  Embeddings: {len(store):,} embeddings ({store.quantization or store.matrix.dtype})")
 
-# Merge
-df = df_sample.merge(df_embeddings, on='APPLICATION_ID', how='inner')
+# Select the sample's rows from the store (inner join, sample order; quantized tiers are dequantized)
+print("\n[2/4] Extracting embeddings...")
+found, embeddings = store.select(df_sample['APPLICATION_ID'])
+df = df_sample[found].reset_index(drop=True)
 print(f"  Merged: {len(df):,} grants")
 
-del df_sample, df_embeddings
+del df_sample
 gc.collect()
 
-# Extract embeddings
-print("\n[2/4] Extracting embeddings...")
-if isinstance(df['embedding'].iloc[0], str):
-    embeddings = np.vstack(df['embedding'].apply(eval).values)
-elif isinstance(df['embedding'].iloc[0], list):
-    embeddings = np.vstack(df['embedding'].values)
-else:
-    embeddings = np.vstack(df['embedding'].values)
-
 print(f"  Shape: {embeddings.shape}")
 print(f"  Memory: ~{embeddings.nbytes / 1024**2:.0f} MB")
 
@@ -77,7 +79,6 @@ print(f"    Calinski-Harabasz: {ch:.2f}")
 
 # Add to dataframe
 df['cluster'] = labels
-df = df.drop('embedding', axis=1)
 
 # Stats
 print("\n  Cluster statistics:")
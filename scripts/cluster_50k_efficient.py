@@ -9,14 +9,16 @@ from sklearn.cluster import MiniBatchKMeans
 from sklearn.metrics import silhouette_score, calinski_harabasz_score
 import gc
 
+import embedding_store
+
 print("=" * 70)
 print("MEMORY-EFFICIENT SEMANTIC CLUSTERING")
 print("=" * 70)
 
-# Load in chunks to save memory
+# Load the sample; embeddings are memory-mapped and selected by APPLICATION_ID
 print("\n[1/4] Loading data (memory-efficient)...")
 df_sample = pd.read_parquet('sample_50k_stratified.parquet')
-df_embeddings = pd.read_parquet('embeddings_50k_sample.parquet')
+store = embedding_store.open_embeddings('embeddings_50k_sample.parquet')
 
 # Keep only essential columns
 essential_cols = ['APPLICATION_ID', 'PROJECT_TITLE', 'FY', 'IC_NAME']
@@ -24,24 +26,17 @@ available_cols = [c for c in essential_cols if c in df_sample.columns]
 df_sample = df_sample[available_cols]  # FIXED: Don't add APPLICATION_ID twice
 
 print(f"  Sample: {len(df_sample):,} grants")
-print(f"  Embeddings: {len(df_embeddings):,} embeddings")
+print(f"  Embeddings: {len(store):,} embeddings")
 
-# Merge
-df = df_sample.merge(df_embeddings, on='APPLICATION_ID', how='inner')
+# Select the sample's rows from the store (inner join, sample order)
+print("\n[2/4] Extracting embeddings...")
+found, embeddings = store.select(df_sample['APPLICATION_ID'])
+df = df_sample[found].reset_index(drop=True)
 print(f"  Merged: {len(df):,} grants")
 
-del df_sample, df_embeddings
+del df_sample
 gc.collect()
 
-# Extract embeddings
-print("\n[2/4] Extracting embeddings...")
-if isinstance(df['embedding'].iloc[0], str):
-    embeddings = np.vstack(df['embedding'].apply(eval).values)
-elif isinstance(df['embedding'].iloc[0], list):
-    embeddings = np.vstack(df['embedding'].values)
-else:
-    embeddings = np.vstack(df['embedding'].values)
-
 print(f"  Shape: {embeddings.shape}")
 print(f"  Memory: ~{embeddings.nbytes / 1024**2:.0f} MB")
 
@@ -79,9 +74,6 @@ print(f"    Calinski-Harabasz: {ch:.2f}")
 # Add to dataframe
 df['cluster'] = labels
 
-# Drop embeddings to save memory before saving
-df = df.drop('embedding', axis=1)
-
 # Stats
 print("\n  Cluster statistics:")
 sizes = np.bincount(labels)
@@ -0,0 +1,468 @@
+#!/usr/bin/env python3
+"""
+Streaming, mergeable column profiles for ExPORTER Parquet files
+Project: od-cl-odss-conroyri-f75a
+Reads one row group at a time (memory is bounded by the largest row group,
+not the file) and keeps per-column sketches that merge across row groups,
+files and years:
+
+  - rows / nulls                      exact
+  - approximate distinct count        HyperLogLog (p=14, ~0.8% error)
+  - top-k values                      bounded counter (exact when a column has
+                                      fewer than TOPK_CAPACITY distinct values;
+                                      long strings keyed by prefix + hash)
+  - min / max / mean                  numeric columns
+  - length histogram, mean/max length string columns (ABSTRACT_TEXT, PROJECT_TERMS, ...)
+
+One profile per file is written to data/profiles/{table}/YEAR={year}.json;
+`profile` skips years whose source size/generation is unchanged, so adding a
+year profiles only that year, and `merge` combines them without rereading data.
+
+Usage:
+  python3 scripts/column_profiler.py profile --path gs://od-cl-odss-conroyri-nih-embeddings/exporter/
+  python3 scripts/column_profiler.py profile --path data/lake/exporter --workers 8
+  python3 scripts/column_profiler.py merge --table projects
+"""
+
+import argparse
+import base64
+import glob
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from parquet_meta import open_file
+
+PROFILE_DIR = 'data/profiles'
+HLL_P = 14
+TOPK = 20
+TOPK_CAPACITY = 2000
+TOPK_DISPLAY_CHARS = 120
+PROFILE_VERSION = 2  # bump when the sketches change; older per-year profiles are recomputed
+LENGTH_BINS = [0, 1, 10, 50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000, np.inf]
+
+
+class HyperLogLog:
+    """HyperLogLog over 64-bit value hashes; merge = element-wise max of registers"""
+
+    def __init__(self, p=HLL_P, registers=None):
+        self.p = p
+        self.m = 1 << p
+        self.registers = registers if registers is not None else np.zeros(self.m, dtype=np.uint8)
+
+    def add_hashes(self, hashes):
+        if len(hashes) == 0:
+            return
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        idx = (hashes >> np.uint64(64 - self.p)).astype(np.int64)
+        rest = (hashes << np.uint64(self.p)) | np.uint64(1 << (self.p - 1))
+        # Rank = leading zeros of the remaining bits + 1
+        rank = (64 - np.floor(np.log2(rest.astype(np.float64))).astype(np.int64)).astype(np.uint8)
+        np.maximum.at(self.registers, idx, rank)
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def estimate(self):
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        est = alpha * self.m ** 2 / np.sum(np.power(2.0, -self.registers.astype(np.float64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if est <= 2.5 * self.m and zeros:
+            est = self.m * np.log(self.m / zeros)  # Small-range correction
+        return int(round(est))
+
+    def to_json(self):
+        return {'p': self.p, 'registers': base64.b64encode(self.registers.tobytes()).decode()}
+
+    @classmethod
+    def from_json(cls, obj):
+        registers = np.frombuffer(base64.b64decode(obj['registers']), dtype=np.uint8).copy()
+        return cls(obj['p'], registers)
+
+
+class TopK:
+    """
+    Bounded value counter
+    Keeps at most `capacity` values; when it overflows, the smallest counts
+    are dropped and the largest dropped count is kept as the error bound.
+    """
+
+    def __init__(self, capacity=TOPK_CAPACITY, counts=None, error=0):
+        self.capacity = capacity
+        self.counts = counts or {}
+        self.error = error
+
+    def update(self, counts):
+        for value, n in counts.items():
+            self.counts[value] = self.counts.get(value, 0) + n
+        if len(self.counts) > self.capacity:
+            ordered = sorted(self.counts.items(), key=lambda kv: -kv[1])
+            self.error = max(self.error, ordered[self.capacity][1])
+            self.counts = dict(ordered[:self.capacity])
+
+    def merge(self, other):
+        self.error = max(self.error, other.error)
+        self.update(other.counts)
+        return self
+
+    def top(self, k=TOPK):
+        return sorted(self.counts.items(), key=lambda kv: -kv[1])[:k]
+
+    def to_json(self):
+        return {'capacity': self.capacity, 'error': self.error,
+                'counts': [[v, n] for v, n in self.top(self.capacity)]}
+
+    @classmethod
+    def from_json(cls, obj):
+        return cls(obj['capacity'], {v: n for v, n in obj['counts']}, obj['error'])
+
+
+def _topk_key(value):
+    """
+    Top-k key of a string: the value itself, or for long values its display
+    prefix plus a hash of the full value, so values sharing a prefix stay apart
+    """
+    if len(value) <= TOPK_DISPLAY_CHARS:
+        return value
+    digest = hashlib.blake2b(value.encode('utf-8'), digest_size=8).hexdigest()
+    return f"{value[:TOPK_DISPLAY_CHARS]}… #{digest}"
+
+
+def _hash_values(arr):
+    """Stable 64-bit hashes of a pyarrow array's non-null values"""
+    values = arr.drop_null().to_numpy(zero_copy_only=False)
+    if values.dtype == object:
+        values = values.astype(str)
+    return pd.util.hash_array(values, categorize=True)
+
+
+class ColumnProfile:
+    """Mergeable sketches for one column"""
+
+    def __init__(self, name, kind):
+        self.name = name
+        self.kind = kind  # 'numeric', 'string' or 'other'
+        self.rows = 0
+        self.nulls = 0
+        self.hll = HyperLogLog()
+        self.topk = TopK()
+        self.min = None
+        self.max = None
+        self.sum = 0.0
+        self.length_hist = np.zeros(len(LENGTH_BINS) - 1, dtype=np.int64)
+        self.length_sum = 0
+        self.length_max = 0
+
+    @staticmethod
+    def kind_of(arrow_type):
+        if pa.types.is_dictionary(arrow_type):
+            arrow_type = arrow_type.value_type
+        if pa.types.is_integer(arrow_type) or pa.types.is_floating(arrow_type):
+            return 'numeric'
+        if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+            return 'string'
+        return 'other'
+
+    def update(self, arr):
+        """Fold one row group's column (ChunkedArray) into the sketches"""
+        arr = arr.combine_chunks() if isinstance(arr, pa.ChunkedArray) else arr
+        if pa.types.is_dictionary(arr.type):
+            arr = arr.cast(arr.type.value_type)
+        self.rows += len(arr)
+        self.nulls += arr.null_count
+        valid = arr.drop_null()
+        if len(valid) == 0:
+            return
+
+        self.hll.add_hashes(_hash_values(valid))
+        vc = pc.value_counts(valid)
+        values, counts = vc.field('values').to_pylist(), vc.field('counts').to_pylist()
+        # Counted on the full value; only the stored key of long strings is shortened
+        if self.kind == 'string':
+            values = [_topk_key(v) for v in values]
+        elif self.kind == 'other':
+            values = [str(v) for v in values]
+        merged = {}
+        for v, n in zip(values, counts):
+            merged[v] = merged.get(v, 0) + n
+        self.topk.update(merged)
+
+        if self.kind == 'numeric':
+            mm = pc.min_max(valid)
+            lo, hi = mm['min'].as_py(), mm['max'].as_py()
+            self.min = lo if self.min is None else min(self.min, lo)
+            self.max = hi if self.max is None else max(self.max, hi)
+            self.sum += float(pc.sum(valid.cast(pa.float64())).as_py() or 0.0)
+        elif self.kind == 'string':
+            lengths = pc.utf8_length(valid).to_numpy()
+            self.length_hist += np.histogram(lengths, bins=LENGTH_BINS)[0]
+            self.length_sum += int(lengths.sum())
+            self.length_max = max(self.length_max, int(lengths.max()))
+
+    def merge(self, other):
+        self.rows += other.rows
+        self.nulls += other.nulls
+        self.hll.merge(other.hll)
+        self.topk.merge(other.topk)
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+        self.sum += other.sum
+        self.length_hist += other.length_hist
+        self.length_sum += other.length_sum
+        self.length_max = max(self.length_max, other.length_max)
+        return self
+
+    def summary(self, k=TOPK):
+        non_null = self.rows - self.nulls
+        out = {
+            'kind': self.kind,
+            'rows': self.rows,
+            'null_rate': self.nulls / self.rows if self.rows else 0.0,
+            'approx_distinct': self.hll.estimate(),
+            'top_values': self.topk.top(k),
+        }
+        if self.kind == 'numeric' and non_null:
+            out.update({'min': self.min, 'max': self.max, 'mean': self.sum / non_null})
+        if self.kind == 'string' and non_null:
+            out.update({'mean_length': self.length_sum / non_null, 'max_length': self.length_max,
+                        'length_histogram': dict(zip(_bin_labels(), self.length_hist.tolist()))})
+        return out
+
+    def to_json(self):
+        return {'name': self.name, 'kind': self.kind, 'rows': self.rows, 'nulls': self.nulls,
+                'hll': self.hll.to_json(), 'topk': self.topk.to_json(),
+                'min': self.min, 'max': self.max, 'sum': self.sum,
+                'length_hist': self.length_hist.tolist(), 'length_sum': self.length_sum,
+                'length_max': self.length_max}
+
+    @classmethod
+    def from_json(cls, obj):
+        col = cls(obj['name'], obj['kind'])
+        col.rows, col.nulls = obj['rows'], obj['nulls']
+        col.hll = HyperLogLog.from_json(obj['hll'])
+        col.topk = TopK.from_json(obj['topk'])
+        col.min, col.max, col.sum = obj['min'], obj['max'], obj['sum']
+        col.length_hist = np.array(obj['length_hist'], dtype=np.int64)
+        col.length_sum, col.length_max = obj['length_sum'], obj['length_max']
+        return col
+
+
+def _bin_labels():
+    labels = []
+    for lo, hi in zip(LENGTH_BINS[:-1], LENGTH_BINS[1:]):
+        labels.append(f"{int(lo)}+" if np.isinf(hi) else f"{int(lo)}-{int(hi) - 1}")
+    return labels
+
+
+class FileProfile:
+    """Column profiles for a file (or several merged files)"""
+
+    def __init__(self, columns=None, sources=None):
+        self.columns = columns or {}
+        self.sources = sources or []
+
+    @classmethod
+    def from_parquet(cls, uri, columns=None):
+        """Profile one file, reading one row group at a time"""
+        profile = cls(sources=[uri])
+        with open_file(uri) as f:
+            pf = pq.ParquetFile(f)
+            schema = pf.schema_arrow
+            names = columns or schema.names
+            for name in names:
+                profile.columns[name] = ColumnProfile(name, ColumnProfile.kind_of(schema.field(name).type))
+            for i in range(pf.num_row_groups):
+                rg = pf.read_row_group(i, columns=names)
+                for name in names:
+                    profile.columns[name].update(rg.column(name))
+        return profile
+
+    def merge(self, other):
+        for name, col in other.columns.items():
+            if name in self.columns:
+                self.columns[name].merge(col)
+            else:
+                self.columns[name] = col
+        self.sources += other.sources
+        return self
+
+    def summary(self, k=TOPK):
+        return {name: col.summary(k) for name, col in self.columns.items()}
+
+    def to_json(self):
+        return {'sources': self.sources, 'columns': [c.to_json() for c in self.columns.values()]}
+
+    @classmethod
+    def from_json(cls, obj):
+        return cls({c['name']: ColumnProfile.from_json(c) for c in obj['columns']}, obj['sources'])
+
+
+# Per-year profile files ---------------------------------------------------------
+
+def profile_path(table, year, profile_dir=PROFILE_DIR):
+    return os.path.join(profile_dir, table, f"YEAR={year}.json" if year is not None else "ALL.json")
+
+
+def source_signature(uri):
+    """(size, generation) of a gs:// object or local file, to detect changes"""
+    if uri.startswith('gs://'):
+        from google.cloud import storage
+        bucket_name, _, name = uri[len('gs://'):].partition('/')
+        blob = storage.Client().bucket(bucket_name).get_blob(name)
+        return {'size': blob.size, 'generation': blob.generation}
+    stat = os.stat(uri)
+    return {'size': stat.st_size, 'generation': stat.st_mtime_ns}
+
+
+def profile_file(uri, out_path):
+    """Worker: profile one file and write its JSON (runs in a subprocess)"""
+    start = time.time()
+    signature = source_signature(uri)
+    profile = FileProfile.from_parquet(uri)
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    tmp = f"{out_path}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump({'source': uri, 'signature': signature, 'version': PROFILE_VERSION,
+                   'profile': profile.to_json()}, f)
+    os.replace(tmp, out_path)
+    rows = next(iter(profile.columns.values())).rows if profile.columns else 0
+    return uri, rows, time.time() - start
+
+
+def is_current(uri, out_path):
+    """True if out_path holds a profile of uri at its current size/generation"""
+    if not os.path.exists(out_path):
+        return False
+    with open(out_path) as f:
+        existing = json.load(f)
+    return (existing['source'] == uri and existing.get('version') == PROFILE_VERSION
+            and existing['signature'] == source_signature(uri))
+
+
+def profile_many(jobs, workers=None, force=False):
+    """
+    Profile (uri, out_path) pairs in parallel processes
+    Pairs whose profile is current are skipped; returns {uri: error} for failures.
+    """
+    todo = [(uri, out) for uri, out in jobs if force or not is_current(uri, out)]
+    print(f"\n{'='*70}")
+    print(f"Profiling {len(todo)} of {len(jobs)} files ({workers or os.cpu_count()} workers)")
+    print(f"{'='*70}\n")
+
+    errors = {}
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {uri: pool.submit(profile_file, uri, out) for uri, out in todo}
+        for uri, future in futures.items():
+            try:
+                _, rows, elapsed = future.result()
+                print(f"  ✓ {uri}: {rows:,} rows ({elapsed:.1f}s)")
+            except Exception as e:
+                errors[uri] = e
+                print(f"  ✗ {uri}: {str(e)[:100]}")
+    print(f"\n✓ Profiled {len(todo) - len(errors)} files in {time.time() - start:.1f}s")
+    return errors
+
+
+def load_profile(path):
+    with open(path) as f:
+        return FileProfile.from_json(json.load(f)['profile'])
+
+
+def merge_profiles(paths):
+    merged = FileProfile()
+    for path in paths:
+        merged.merge(load_profile(path))
+    return merged
+
+
+def discover(path):
+    """(table, year, uri) for every {table}_parquet/YEAR=y file (or lake {table}/YEAR=y) under path"""
+    if path.startswith('gs://'):
+        from google.cloud import storage
+        bucket_name, _, prefix = path[len('gs://'):].partition('/')
+        uris = [f"gs://{bucket_name}/{b.name}"
+                for b in storage.Client().list_blobs(bucket_name, prefix=prefix) if b.name.endswith('.parquet')]
+    else:
+        uris = glob.glob(os.path.join(path, '**', '*.parquet'), recursive=True)
+
+    found = []
+    for uri in sorted(uris):
+        if '/_' in uri:  # staging areas (_raw, _fragments)
+            continue
+        parts = uri.rstrip('/').split('/')
+        match = re.search(r'YEAR=(\d{4})', uri)
+        folder = parts[-3] if match else parts[-2]
+        table = folder[:-len('_parquet')] if folder.endswith('_parquet') else folder
+        found.append((table, int(match.group(1)) if match else None, uri))
+    return found
+
+
+def print_summary(summary):
+    print(f"{'column':<28}{'kind':<9}{'null%':>7}{'~distinct':>11}  top value / numeric range / length")
+    print("-" * 100)
+    for name, s in summary.items():
+        if s['kind'] == 'numeric' and 'min' in s:
+            detail = f"{s['min']} .. {s['max']} (mean {s['mean']:.1f})"
+        elif s['kind'] == 'string' and 'mean_length' in s:
+            top = s['top_values'][0] if s['top_values'] else ('', 0)
+            detail = f"len mean {s['mean_length']:.0f}, max {s['max_length']}; top {str(top[0])[:30]!r} x{top[1]:,}"
+        else:
+            detail = ''
+        print(f"{name:<28}{s['kind']:<9}{s['null_rate'] * 100:>6.1f}%{s['approx_distinct']:>11,}  {detail}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_profile = sub.add_parser('profile', help='Profile every year file (changed files only)')
+    p_profile.add_argument('--path', default='gs://od-cl-odss-conroyri-nih-embeddings/exporter/')
+    p_profile.add_argument('--tables', nargs='+')
+    p_profile.add_argument('--workers', type=int, default=os.cpu_count())
+    p_profile.add_argument('--force', action='store_true')
+
+    p_merge = sub.add_parser('merge', help='Merge per-year profiles and print the table profile')
+    p_merge.add_argument('--table', required=True)
+    p_merge.add_argument('--years', nargs='+', type=int)
+    p_merge.add_argument('--json', help='Write the merged summary to this file')
+
+    parser.add_argument('--profile-dir', default=PROFILE_DIR)
+    args = parser.parse_args()
+
+    if args.command == 'merge':
+        paths = sorted(glob.glob(os.path.join(args.profile_dir, args.table, '*.json')))
+        if args.years:
+            paths = [p for p in paths if any(f"YEAR={y}." in p for y in args.years)]
+        if not paths:
+            print(f"No profiles under {args.profile_dir}/{args.table}; run the profile command first")
+            return 1
+        summary = merge_profiles(paths).summary()
+        print(f"\n{args.table}: {len(paths)} profiles merged\n")
+        print_summary(summary)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(summary, f, indent=2, default=str)
+            print(f"\n✓ Saved: {args.json}")
+        return 0
+
+    files = [f for f in discover(args.path) if not args.tables or f[0] in args.tables]
+    jobs = [(uri, profile_path(table, year, args.profile_dir)) for table, year, uri in files]
+    errors = profile_many(jobs, workers=args.workers, force=args.force)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
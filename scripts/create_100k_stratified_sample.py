@@ -2,119 +2,81 @@
 """
 Create Stratified 100k Sample for Hierarchical Clustering Optimization
 Balanced across fiscal years, ICs, and research domains
+
+One stats pass allocates per-(FY, IC_NAME) quotas, then a single scan keeps
+the lowest hash(APPLICATION_ID, seed) grants of every stratum (see
+stratified_sampler.py), so the same seed always yields the same sample.
+Reads the local ExPORTER lake by default (python3 scripts/nih_lake.py sync);
+--source bigquery runs the same draw as one SQL statement.
 """
+import argparse
 import pandas as pd
-import numpy as np
-from google.cloud import bigquery
 import time
 
+from nih_lake import ExporterLake, LAKE_DIR
+from stratified_sampler import (allocate_quotas, lake_stats, select_by_rank,
+                                sample_sql, stats_sql)
+
 # Configuration
 PROJECT_ID = 'od-cl-odss-conroyri-f75a'
+PROJECTS_TABLE = 'od-cl-odss-conroyri-f75a.nih_exporter.projects'
 SAMPLE_SIZE = 100_000
 RANDOM_SEED = 42
+SAMPLE_COLUMNS = ['APPLICATION_ID', 'CORE_PROJECT_NUM', 'PROJECT_TITLE', 'PROJECT_TERMS',
+                  'FY', 'IC_NAME', 'TOTAL_COST', 'NIH_SPENDING_CATS']
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--source', choices=['lake', 'bigquery'], default='lake')
+parser.add_argument('--lake-dir', default=LAKE_DIR)
+parser.add_argument('--seed', type=int, default=RANDOM_SEED)
+args = parser.parse_args()
 
 print("=" * 70)
 print("CREATING STRATIFIED 100K SAMPLE")
 print("=" * 70)
 
 # Step 1: Query full population statistics
-print("\n[1/5] Analyzing population distribution...")
-client = bigquery.Client(project=PROJECT_ID)
-
-query_stats = """
-SELECT 
-  FY,
-  IC_NAME,
-  COUNT(*) as n_grants,
-  SUM(TOTAL_COST) as total_funding
-FROM `od-cl-odss-conroyri-f75a.nih_exporter.projects`
-WHERE FY BETWEEN 1990 AND 2024
-  AND PROJECT_TITLE IS NOT NULL
-  AND IC_NAME IS NOT NULL
-GROUP BY FY, IC_NAME
-ORDER BY FY, IC_NAME
-"""
-stats_df = client.query(query_stats).to_dataframe()
+print(f"\n[1/5] Analyzing population distribution ({args.source})...")
+start = time.time()
+if args.source == 'lake':
+    # Narrow scan (ids + strata only) gives both the stats and the hash ranks
+    lake = ExporterLake(args.lake_dir)
+    stats_df, population = lake_stats(lake, seed=args.seed)
+else:
+    from google.cloud import bigquery
+    client = bigquery.Client(project=PROJECT_ID)
+    stats_df = client.query(stats_sql(PROJECTS_TABLE)).to_dataframe()
 
-# Calculate target samples per stratum
 total_grants = stats_df['n_grants'].sum()
-stats_df['target_sample'] = np.ceil(
-    stats_df['n_grants'] / total_grants * SAMPLE_SIZE
-).astype(int)
-
 print(f"  Total grants in population: {total_grants:,}")
 print(f"  Fiscal years: {stats_df['FY'].min()} - {stats_df['FY'].max()}")
 print(f"  Unique ICs: {stats_df['IC_NAME'].nunique()}")
 print(f"  Target sample size: {SAMPLE_SIZE:,}")
+print(f"  Time: {time.time() - start:.1f}s")
 
-# Step 2: Verify stratum sizes are feasible
+# Step 2: Allocate quotas (proportional, small strata capped at 90%)
 print("\n[2/5] Validating stratification feasibility...")
-stats_df['sample_rate'] = stats_df['target_sample'] / stats_df['n_grants']
-oversample = stats_df[stats_df['sample_rate'] > 0.95]
-
-if len(oversample) > 0:
-    print(f"  WARNING: {len(oversample)} strata require >95% sampling:")
-    print(oversample[['FY', 'IC_NAME', 'n_grants', 'target_sample']].head(10))
-    print("  Adjusting sample allocation...")
-    
-    # Cap at 90% for small strata and redistribute
-    stats_df.loc[stats_df['sample_rate'] > 0.9, 'target_sample'] = \
-        (stats_df.loc[stats_df['sample_rate'] > 0.9, 'n_grants'] * 0.9).astype(int)
-
-# Normalize to exactly 100k
-adjustment = SAMPLE_SIZE / stats_df['target_sample'].sum()
-stats_df['target_sample'] = (stats_df['target_sample'] * adjustment).round().astype(int)
-
-# Final adjustment to hit exact count
-diff = SAMPLE_SIZE - stats_df['target_sample'].sum()
-if diff != 0:
-    # Add/subtract from largest strata
-    largest_idx = stats_df.nlargest(abs(diff), 'n_grants').index
-    stats_df.loc[largest_idx, 'target_sample'] += np.sign(diff)
-
+stats_df = allocate_quotas(stats_df, SAMPLE_SIZE)
 print(f"  Adjusted sample sum: {stats_df['target_sample'].sum():,}")
 
-# Step 3: Sample from each stratum
-print("\n[3/5] Sampling from each stratum...")
-samples = []
+# Step 3: Draw every stratum in one pass
+print(f"\n[3/5] Sampling all {len(stats_df):,} strata in one pass (seed={args.seed})...")
 start = time.time()
 
-for idx, row in stats_df.iterrows():
-    fy = row['FY']
-    ic = row['IC_NAME']
-    n = row['target_sample']
-    
-    if n == 0:
-        continue
-    
-    # Query this stratum with random sampling
-    query_stratum = f"""
-    SELECT 
-      APPLICATION_ID,
-      CORE_PROJECT_NUM,
-      PROJECT_TITLE,
-      PROJECT_TERMS,
-      ABSTRACT_TEXT,
-      FY,
-      IC_NAME,
-      TOTAL_COST,
-      NIH_SPENDING_CATS
-    FROM `od-cl-odss-conroyri-f75a.nih_exporter.projects`
-    WHERE FY = {fy}
-      AND IC_NAME = '{ic}'
-      AND PROJECT_TITLE IS NOT NULL
-    ORDER BY RAND()
-    LIMIT {n}
-    """
-    
-    stratum_df = client.query(query_stratum).to_dataframe()
-    samples.append(stratum_df)
-    
-    if (idx + 1) % 50 == 0:
-        print(f"  Processed {idx + 1}/{len(stats_df)} strata...")
-
-# Combine samples
-df_sample = pd.concat(samples, ignore_index=True)
+if args.source == 'lake':
+    chosen = select_by_rank(population, stats_df)
+    df_sample = lake.lookup('projects', chosen['APPLICATION_ID'], columns=SAMPLE_COLUMNS)
+    # Abstracts live in their own table in the lake; join them for the sampled ids
+    abstracts = lake.lookup('abstracts', df_sample['APPLICATION_ID'], columns=['ABSTRACT_TEXT'])
+    df_sample = df_sample.merge(abstracts, on='APPLICATION_ID', how='left')
+else:
+    columns = SAMPLE_COLUMNS[:4] + ['ABSTRACT_TEXT'] + SAMPLE_COLUMNS[4:]
+    sql, params = sample_sql(PROJECTS_TABLE, stats_df, args.seed, columns)
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ArrayQueryParameter(name, kind, values) for name, kind, values in params]
+    )
+    df_sample = client.query(sql, job_config=job_config).to_dataframe()
+
 print(f"  Sampling completed in {time.time() - start:.1f}s")
 print(f"  Final sample size: {len(df_sample):,}")
 
@@ -159,7 +121,8 @@ metadata = {
     'abstract_coverage': float(abstract_coverage),
     'terms_coverage': float(terms_coverage),
     'total_funding': float(df_sample['TOTAL_COST'].sum()),
-    'random_seed': RANDOM_SEED,
+    'random_seed': args.seed,
+    'sampling': 'hash(APPLICATION_ID, seed) rank within FY x IC_NAME',
     'creation_date': pd.Timestamp.now().isoformat(),
     'fy_distribution': fy_dist.to_dict(),
     'ic_distribution': ic_dist.head(20).to_dict()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Create nested stratified samples: 25k ⊂ 50k ⊂ 100k ⊂ 250k
+Project: od-cl-odss-conroyri-f75a
+Every sample is a prefix of one hash-ordered stratified permutation
+(stratified_sampler.nested_order), so each smaller sample is an exact subset
+of the larger ones and per-grant artifacts (embeddings, features) computed
+for one size can be reused for the next:
+
+    data/samples/nested_seed{seed}_order.parquet     APPLICATION_ID, FY, IC_NAME, sample_position
+    data/samples/grants_{size}_nested.parquet        sample columns + sample_position
+    data/samples/nested_seed{seed}_manifest.json
+
+Usage:
+  python3 scripts/create_nested_samples.py
+  python3 scripts/create_nested_samples.py --sizes 25000 50000 100000 --seed 7
+  python3 scripts/create_nested_samples.py --source bigquery
+
+Then, e.g.:
+  python3 scripts/generate_embeddings_100k.py --sample data/samples/grants_100000_nested.parquet \\
+      --output embeddings_100k_pubmedbert.parquet --reuse embeddings_50k_pubmedbert.parquet
+"""
+
+import argparse
+import json
+import os
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from nih_lake import ExporterLake, LAKE_DIR
+from stratified_sampler import NESTED_SIZES, nested_lake, nested_sql
+
+PROJECT_ID = 'od-cl-odss-conroyri-f75a'
+PROJECTS_TABLE = 'od-cl-odss-conroyri-f75a.nih_exporter.projects'
+OUTPUT_DIR = 'data/samples'
+RANDOM_SEED = 42
+SAMPLE_COLUMNS = ['APPLICATION_ID', 'CORE_PROJECT_NUM', 'PROJECT_TITLE', 'PROJECT_TERMS',
+                  'FY', 'IC_NAME', 'TOTAL_COST', 'NIH_SPENDING_CATS']
+
+
+def load_order_lake(lake_dir, max_size, seed):
+    lake = ExporterLake(lake_dir)
+    order = nested_lake(lake, max_size, seed)
+    rows = lake.lookup('projects', order['APPLICATION_ID'], columns=SAMPLE_COLUMNS)
+    abstracts = lake.lookup('abstracts', order['APPLICATION_ID'], columns=['ABSTRACT_TEXT'])
+    rows = rows.merge(abstracts, on='APPLICATION_ID', how='left')
+    return order[['APPLICATION_ID', 'sample_position']].merge(rows, on='APPLICATION_ID')
+
+
+def load_order_bigquery(max_size, seed):
+    from google.cloud import bigquery
+    client = bigquery.Client(project=PROJECT_ID)
+    columns = SAMPLE_COLUMNS[:4] + ['ABSTRACT_TEXT'] + SAMPLE_COLUMNS[4:]
+    return client.query(nested_sql(PROJECTS_TABLE, max_size, seed, columns)).to_dataframe()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', nargs='+', type=int, default=NESTED_SIZES)
+    parser.add_argument('--seed', type=int, default=RANDOM_SEED)
+    parser.add_argument('--source', choices=['lake', 'bigquery'], default='lake')
+    parser.add_argument('--lake-dir', default=LAKE_DIR)
+    parser.add_argument('--output-dir', default=OUTPUT_DIR)
+    args = parser.parse_args()
+
+    sizes = sorted(args.sizes)
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    print("=" * 70)
+    print(f"CREATING NESTED STRATIFIED SAMPLES: {' ⊂ '.join(f'{s:,}' for s in sizes)}")
+    print("=" * 70)
+
+    print(f"\n[1/3] Building stratified order ({args.source}, seed={args.seed})...")
+    start = time.time()
+    if args.source == 'lake':
+        df = load_order_lake(args.lake_dir, sizes[-1], args.seed)
+    else:
+        df = load_order_bigquery(sizes[-1], args.seed)
+    df = df.sort_values('sample_position').reset_index(drop=True)
+    print(f"  {len(df):,} grants ordered in {time.time() - start:.1f}s")
+    if len(df) < sizes[-1]:
+        print(f"  WARNING: population has only {len(df):,} grants; larger samples are truncated")
+
+    order_file = os.path.join(args.output_dir, f"nested_seed{args.seed}_order.parquet")
+    df[['APPLICATION_ID', 'FY', 'IC_NAME', 'sample_position']].to_parquet(order_file, index=False)
+    print(f"  ✓ {order_file}")
+
+    print("\n[2/3] Writing samples (prefixes of the order)...")
+    manifest = {
+        'seed': args.seed,
+        'source': args.source,
+        'order_file': order_file,
+        'sampling': 'prefix of nested stratified order over FY x IC_NAME, hash(APPLICATION_ID, seed)',
+        'creation_date': datetime.now().isoformat(),
+        'samples': {}
+    }
+    population_share = df['IC_NAME'].value_counts(normalize=True)
+    for size in sizes:
+        sample = df.head(size)
+        path = os.path.join(args.output_dir, f"grants_{size}_nested.parquet")
+        sample.to_parquet(path, index=False)
+
+        # Largest IC share gap between this prefix and the full order
+        drift = (sample['IC_NAME'].value_counts(normalize=True) - population_share).abs().max()
+        manifest['samples'][str(size)] = {
+            'file': path,
+            'rows': len(sample),
+            'fiscal_years': f"{sample['FY'].min()}-{sample['FY'].max()}",
+            'n_ics': int(sample['IC_NAME'].nunique()),
+            'max_ic_share_drift': float(drift)
+        }
+        print(f"  ✓ {path}: {len(sample):,} grants, {sample['IC_NAME'].nunique()} ICs, "
+              f"max IC share drift {drift:.2%}")
+
+    print("\n[3/3] Verifying nesting (re-reading the written files)...")
+    columns = ['APPLICATION_ID', 'sample_position']
+    written = {size: pd.read_parquet(manifest['samples'][str(size)]['file'], columns=columns)
+               for size in sizes}
+    for small, large in zip(sizes, sizes[1:]):
+        a, b = written[small], written[large]
+        assert set(a['APPLICATION_ID']) <= set(b['APPLICATION_ID']), f"{small} sample is not a subset of {large}"
+        assert a.equals(b.head(len(a))), f"{small} sample is not the first {len(a):,} rows of {large}"
+        print(f"  ✓ {small:,} ⊂ {large:,}")
+
+    manifest_file = os.path.join(args.output_dir, f"nested_seed{args.seed}_manifest.json")
+    with open(manifest_file, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    print(f"  ✓ {manifest_file}")
+
+    print("\n" + "=" * 70)
+    print("NESTED SAMPLES COMPLETE!")
+    print("=" * 70)
+
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,8 @@ import matplotlib.pyplot as plt
 import glob
 import sys
 
+import embedding_store
+
 print("=" * 70)
 print("OPTION B: CLUSTERING QUALITY DIAGNOSTIC")
 print("=" * 70)
@@ -43,7 +45,7 @@ print(f"UMAP coords: {'✓' if has_umap else '✗'}")
 
 if has_embeddings:
     try:
-        embeddings = np.vstack(df['embedding'].apply(eval).values)
+        embeddings = embedding_store.parse_embedding_strings(df['embedding'])
         print(f"Embedding dimension: {embeddings.shape[1]}")
         X_high = embeddings
     except:
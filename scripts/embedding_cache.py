@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Content-hash embedding cache shared by the embedding scripts
+Project: od-cl-odss-conroyri-f75a
+Entries are keyed by (model id, text recipe, hash of the normalised text),
+so a grant is embedded once per model/recipe no matter which sample or
+script asked for it:
+
+    data/embedding_cache/{model}/{recipe}/meta.json
+    data/embedding_cache/{model}/{recipe}/{shard:x}/{part}.keys.npy   sorted 16-byte text hashes
+    data/embedding_cache/{model}/{recipe}/{shard:x}/{part}.vecs.npy   float32 vectors, same order
+
+The recipe names how the text was built from the grant (e.g.
+'combined_text[:2000]', 'PROJECT_TERMS'); change it whenever the text
+construction changes. Lookups load only the key arrays and gather hits from
+the memory-mapped vector files. Misses are embedded in chunks and written
+back after each chunk, so an interrupted run keeps its progress. Rows that
+embed_fn could not compute (NaN, or the older all-zero placeholder) are never
+cached and are counted in stats['failed'], so the next run retries them.
+
+Usage:
+  from embedding_cache import cached_embed
+  vectors, stats = cached_embed(texts, embed_texts, model='text-embedding-005', recipe='PROJECT_TITLE')
+
+  python3 scripts/embedding_cache.py info
+  python3 scripts/embedding_cache.py compact
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+import unicodedata
+
+import numpy as np
+
+CACHE_DIR = 'data/embedding_cache'
+SHARDS = 16
+FLUSH_EVERY = 10_000
+MAX_PARTS = 8
+
+
+def normalize_text(text):
+    """NFC, collapsed whitespace; None/NaN become ''"""
+    if text is None or (isinstance(text, float) and np.isnan(text)):
+        return ''
+    return ' '.join(unicodedata.normalize('NFC', str(text)).split())
+
+
+def text_keys(texts):
+    """16-byte blake2b hashes of the normalised texts, as an 'S16' array"""
+    return np.array([hashlib.blake2b(normalize_text(t).encode('utf-8'), digest_size=16).digest()
+                     for t in texts], dtype='S16')
+
+
+def slug(value):
+    """Filesystem-safe directory name for value: readable prefix + sha1 suffix"""
+    readable = re.sub(r'[^A-Za-z0-9._-]+', '_', value).strip('_')[:60]
+    return f"{readable}-{hashlib.sha1(value.encode('utf-8')).hexdigest()[:8]}"
+
+
+class EmbeddingCache:
+    """One (model, recipe) namespace of the cache"""
+
+    def __init__(self, model, recipe, root=CACHE_DIR):
+        self.model = model
+        self.recipe = recipe
+        self.path = os.path.join(root, slug(model), slug(recipe))
+        self.meta_path = os.path.join(self.path, 'meta.json')
+        self.meta = None
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path) as f:
+                self.meta = json.load(f)
+
+    @property
+    def dim(self):
+        return self.meta['dim'] if self.meta else None
+
+    def _shard_dir(self, shard):
+        return os.path.join(self.path, f"{shard:x}")
+
+    def _parts(self, shard):
+        return sorted(p[:-len('.keys.npy')] for p in glob.glob(os.path.join(self._shard_dir(shard), '*.keys.npy')))
+
+    @staticmethod
+    def _shard_of(keys):
+        return np.frombuffer(keys.tobytes(), dtype=np.uint8)[::16] >> 4 if len(keys) else np.empty(0, np.uint8)
+
+    def get(self, keys, out=None):
+        """(found mask, vectors) for keys; hits are written into out when given, other rows untouched"""
+        found = np.zeros(len(keys), dtype=bool)
+        if self.meta is None:
+            return found, out
+        vectors = np.zeros((len(keys), self.dim), dtype=np.float32) if out is None else out
+        shards = self._shard_of(keys)
+        for shard in np.unique(shards):
+            idx = np.flatnonzero(shards == shard)
+            for part in self._parts(int(shard)):
+                part_keys = np.load(f"{part}.keys.npy")
+                pos = np.minimum(np.searchsorted(part_keys, keys[idx]), len(part_keys) - 1)
+                hit = (part_keys[pos] == keys[idx]) & ~found[idx]
+                if hit.any():
+                    vecs = np.load(f"{part}.vecs.npy", mmap_mode='r')
+                    vectors[idx[hit]] = vecs[pos[hit]]
+                    found[idx[hit]] = True
+        return found, vectors
+
+    def put(self, keys, vectors):
+        """Write (key, vector) pairs as one new part per shard; returns rows written"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        keep = np.any(vectors != 0, axis=1) & np.isfinite(vectors).all(axis=1)
+        keys, vectors = keys[keep], vectors[keep]
+        if not len(keys):
+            return 0
+        if self.meta is None:
+            os.makedirs(self.path, exist_ok=True)
+            self.meta = {'model': self.model, 'recipe': self.recipe, 'dim': int(vectors.shape[1]),
+                         'created_at': time.strftime('%Y-%m-%d %H:%M:%S')}
+            tmp = f"{self.meta_path}.tmp"
+            with open(tmp, 'w') as f:
+                json.dump(self.meta, f, indent=2)
+            os.replace(tmp, self.meta_path)
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"{self.model}/{self.recipe}: cached dim {self.dim}, got {vectors.shape[1]}")
+
+        keys, first = np.unique(keys, return_index=True)
+        vectors = vectors[first]
+        shards = self._shard_of(keys)
+        name = f"{time.strftime('%Y%m%d%H%M%S')}-{os.getpid()}-{time.monotonic_ns() % 10**9:09d}"
+        for shard in np.unique(shards):
+            sel = shards == shard
+            self._write_part(int(shard), name, keys[sel], vectors[sel])
+        return len(keys)
+
+    def _write_part(self, shard, name, keys, vectors):
+        os.makedirs(self._shard_dir(shard), exist_ok=True)
+        base = os.path.join(self._shard_dir(shard), name)
+        # Vectors first, keys last: a part is visible only once both are complete
+        for suffix, array in [('vecs', vectors), ('keys', keys)]:
+            tmp = f"{base}.{suffix}.tmp.npy"
+            np.save(tmp, array)
+            os.replace(tmp, f"{base}.{suffix}.npy")
+
+    def compact(self, max_parts=MAX_PARTS):
+        """Merge the parts of shards that have more than max_parts; returns shards merged"""
+        merged = 0
+        for shard in range(SHARDS):
+            parts = self._parts(shard)
+            if len(parts) <= max_parts:
+                continue
+            keys = np.concatenate([np.load(f"{p}.keys.npy") for p in parts])
+            vectors = np.concatenate([np.load(f"{p}.vecs.npy") for p in parts])
+            keys, first = np.unique(keys, return_index=True)
+            self._write_part(shard, f"compact-{time.strftime('%Y%m%d%H%M%S')}-{os.getpid()}", keys, vectors[first])
+            for p in parts:
+                os.remove(f"{p}.keys.npy")
+                os.remove(f"{p}.vecs.npy")
+            merged += 1
+        return merged
+
+    def size(self):
+        return sum(len(np.load(f"{p}.keys.npy", mmap_mode='r')) for s in range(SHARDS) for p in self._parts(s))
+
+
+def cached_embed(texts, embed_fn, model, recipe, root=CACHE_DIR, flush_every=FLUSH_EVERY, out=None,
+                 compact=True):
+    """
+    Embeddings for `texts`, running embed_fn only on texts not in the cache
+    embed_fn(list_of_texts) -> (n, dim) array, NaN rows for texts it could
+    not embed (left NaN in the result, not cached). Identical texts are embedded
+    once. Vectors are written into `out` (e.g. an embedding_store memmap) when
+    given, so only one chunk of new vectors is held in memory at a time.
+    compact=False leaves compaction to the caller: processes writing the same
+    namespace concurrently must not compact it while the others read it.
+    Returns (float32 array aligned with texts, stats dict).
+    """
+    texts = list(texts)
+    cache = EmbeddingCache(model, recipe, root)
+    keys = text_keys(texts)
+    found, vectors = cache.get(keys, out)
+
+    miss_rows = np.flatnonzero(~found)
+    missing_keys, first, inverse = np.unique(keys[miss_rows], return_index=True, return_inverse=True)
+    missing_texts = [texts[i] for i in miss_rows[first]]
+    # Rows of each missing key, grouped by key so a chunk's rows are one slice
+    by_key = np.argsort(inverse, kind='stable')
+    print(f"  Embedding cache ({model} / {recipe}): {found.sum():,} hits, "
+          f"{len(missing_texts):,} unique texts to embed")
+
+    for start in range(0, len(missing_texts), flush_every):
+        chunk = np.asarray(embed_fn(missing_texts[start:start + flush_every]), dtype=np.float32)
+        cache.put(missing_keys[start:start + len(chunk)], chunk)
+        if vectors is None:
+            vectors = np.zeros((len(texts), chunk.shape[1]), dtype=np.float32)
+        lo, hi = np.searchsorted(inverse[by_key], [start, start + len(chunk)])
+        rows = by_key[lo:hi]
+        vectors[miss_rows[rows]] = chunk[inverse[rows] - start]
+    if compact and len(missing_texts):
+        cache.compact()
+    if vectors is None:
+        vectors = np.zeros((len(texts), 0), dtype=np.float32)
+
+    computed = vectors[miss_rows] if len(miss_rows) else vectors[:0]
+    failed = int((~np.isfinite(computed).all(axis=1) | ~np.any(computed != 0, axis=1)).sum())
+    stats = {'cache_hits': int(found.sum()), 'computed': len(missing_texts), 'failed': failed,
+             'cache_dir': cache.path}
+    return vectors, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('command', choices=['info', 'compact'])
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    args = parser.parse_args()
+
+    metas = sorted(glob.glob(os.path.join(args.cache_dir, '*', '*', 'meta.json')))
+    if not metas:
+        print(f"No cache entries under {args.cache_dir}")
+        return 0
+    for meta_path in metas:
+        with open(meta_path) as f:
+            meta = json.load(f)
+        cache = EmbeddingCache(meta['model'], meta['recipe'], args.cache_dir)
+        if args.command == 'compact':
+            print(f"  {meta['model']} / {meta['recipe']}: {cache.compact(max_parts=1)} shards compacted")
+        print(f"  {meta['model']} / {meta['recipe']}: {cache.size():,} vectors x {meta['dim']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,551 @@
+#!/usr/bin/env python3
+"""
+Binary embedding store: float32 matrix + APPLICATION_ID index + manifest
+Project: od-cl-odss-conroyri-f75a
+The standard embedding artifact. Replaces Parquet `embedding` list columns
+(and the str/eval() round trips) for everything downstream of the embedding
+scripts:
+
+    {prefix}.npy             float32 (rows, dim), opened with np.load(mmap_mode='r')
+    {prefix}.ids.npy         APPLICATION_ID of each row (int64 where numeric)
+    {prefix}.meta.parquet    optional row-aligned metadata (FISCAL_YEAR, IC_NAME, ...)
+    {prefix}.manifest.json   model, dim, dtype, rows, text recipe, source
+    {prefix}.scale.npy       per-dimension float32 scales (int8 stores only)
+
+Opening a store maps the files; nothing is copied until rows are selected.
+select() looks rows up by APPLICATION_ID (searchsorted on the ID index) and
+materialises only those rows. Embedding runs write directly into the
+preallocated memmap from create() and publish it with finish(); the matrix
+is created as {prefix}.npy.tmp so a crashed run never leaves a
+half-written matrix behind the final name.
+
+Legacy Parquet files are converted once, row group by row group, on first
+open (open_embeddings('embeddings_100k_pubmedbert.parquet') reads
+embeddings_100k_pubmedbert.npy etc. afterwards), and export_parquet() still
+writes the list-column format, streamed from the matrix, for older readers.
+
+quantize() writes a smaller tier of a store: float16 (2x smaller than
+float32) or int8 with a symmetric per-dimension scale (4x). Quantized stores
+open like any other; select(), vectors(), blocks() and export_parquet()
+dequantize to float32 one block at a time, so only the compact codes are
+mapped. quantization_report() measures what the tier costs against full
+precision (row cosine, k-NN overlap, silhouette of a reclustering) and
+`quantize --report` records it in the tier's manifest.
+
+Usage:
+  store = embedding_store.open_embeddings('embeddings_50k_sample.parquet')
+  found, vectors = store.select(df['APPLICATION_ID'])   # vectors for df[found], in df order
+
+  matrix = embedding_store.create(prefix, len(df), 768)
+  ...fill matrix[rows] = vectors...
+  keep = embedding_store.embedded_rows(matrix)          # rows that could not be embedded are NaN
+  matrix = embedding_store.drop_rows(prefix, matrix, keep)
+  embedding_store.finish(prefix, matrix, metadata_df[keep], model=model_name, text_recipe='PROJECT_TERMS')
+
+  python3 scripts/embedding_store.py convert embeddings_100k_pubmedbert.parquet
+  python3 scripts/embedding_store.py info embeddings_100k_pubmedbert
+  python3 scripts/embedding_store.py quantize embeddings_250k --mode int8 --report
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+EXPORT_CHUNK_ROWS = 50_000
+ID_COLUMN = 'APPLICATION_ID'
+QUANTIZATIONS = ['float16', 'int8']
+
+
+def store_prefix(path):
+    """Prefix of the store for a prefix, a store file or a legacy .parquet path"""
+    for suffix in ['.manifest.json', '.meta.parquet', '.ids.npy', '.scale.npy', '.npy', '.parquet']:
+        if path.endswith(suffix):
+            return path[:-len(suffix)]
+    return path
+
+
+def matrix_path(prefix):
+    return f"{prefix}.npy"
+
+
+def ids_path(prefix):
+    return f"{prefix}.ids.npy"
+
+
+def metadata_path(prefix):
+    return f"{prefix}.meta.parquet"
+
+
+def manifest_path(prefix):
+    return f"{prefix}.manifest.json"
+
+
+def scale_path(prefix):
+    return f"{prefix}.scale.npy"
+
+
+def normalize_ids(values):
+    """APPLICATION_IDs as int64 when they are all numeric, otherwise as strings"""
+    ids = np.asarray(values)
+    if ids.dtype.kind in 'iu':
+        return ids.astype(np.int64)
+    if ids.dtype.kind == 'f' and np.all(np.isfinite(ids)) and np.all(ids == np.floor(ids)):
+        return ids.astype(np.int64)
+    strings = ids.astype(str)
+    if len(strings) and np.char.isdigit(strings).all():
+        return strings.astype(np.int64)
+    return strings
+
+
+# Writing ----------------------------------------------------------------------
+
+def create(prefix, rows, dim, dtype=np.float32):
+    """Zero-filled (rows, dim) memmap at {prefix}.npy.tmp, published by finish()"""
+    os.makedirs(os.path.dirname(prefix) or '.', exist_ok=True)
+    return np.lib.format.open_memmap(f"{matrix_path(prefix)}.tmp", mode='w+', dtype=dtype, shape=(rows, dim))
+
+
+def _write_json(path, data):
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(data, f, indent=2, default=str)
+    os.replace(tmp, path)
+
+
+def finish(prefix, matrix, metadata, ids=None, **manifest):
+    """
+    Flush and publish a matrix from create() with its ID index and manifest
+    ids default to metadata[APPLICATION_ID]; metadata may be None. Extra
+    keyword arguments (model, text_recipe, ...) go into the manifest.
+    """
+    ids = normalize_ids(metadata[ID_COLUMN].to_numpy() if ids is None else ids)
+    if len(ids) != len(matrix) or (metadata is not None and len(metadata) != len(matrix)):
+        raise ValueError(f"{prefix}: {len(ids):,} ids / {len(metadata) if metadata is not None else '-'} "
+                         f"metadata rows for {len(matrix):,} vectors")
+    matrix.flush()
+    np.save(f"{ids_path(prefix)}.tmp.npy", ids)
+    os.replace(f"{ids_path(prefix)}.tmp.npy", ids_path(prefix))
+    if metadata is not None:
+        tmp = f"{metadata_path(prefix)}.tmp"
+        metadata.reset_index(drop=True).to_parquet(tmp, index=False)
+        os.replace(tmp, metadata_path(prefix))
+    elif os.path.exists(metadata_path(prefix)):
+        os.remove(metadata_path(prefix))
+    os.replace(f"{matrix_path(prefix)}.tmp", matrix_path(prefix))
+    # Manifest last: a store is complete once its manifest exists
+    _write_json(manifest_path(prefix), dict(
+        manifest, rows=int(matrix.shape[0]), dim=int(matrix.shape[1]), dtype=str(matrix.dtype),
+        id_dtype=str(ids.dtype), unique_ids=bool(len(np.unique(ids)) == len(ids)),
+        metadata_columns=list(metadata.columns) if metadata is not None else [],
+        created_at=datetime.now().isoformat()))
+    return EmbeddingStore(prefix)
+
+
+def embedded_rows(matrix, block_rows=EXPORT_CHUNK_ROWS):
+    """Mask of rows holding a real vector (finite and not all zero), block by block"""
+    mask = np.ones(len(matrix), dtype=bool)
+    for start in range(0, len(matrix), block_rows):
+        block = np.asarray(matrix[start:start + block_rows])
+        mask[start:start + len(block)] = np.isfinite(block).all(axis=1) & np.any(block != 0, axis=1)
+    return mask
+
+
+def drop_rows(prefix, matrix, keep, block_rows=EXPORT_CHUNK_ROWS):
+    """Matrix from create() without the rows where keep is False, copied block by block"""
+    keep = np.asarray(keep, dtype=bool)
+    if keep.all():
+        return matrix
+    matrix.flush()
+    full = f"{matrix_path(prefix)}.full.tmp"
+    os.replace(f"{matrix_path(prefix)}.tmp", full)
+    source = np.load(full, mmap_mode='r')
+    out = create(prefix, int(keep.sum()), matrix.shape[1], matrix.dtype)
+    pos = 0
+    for start in range(0, len(source), block_rows):
+        block = source[start:start + block_rows][keep[start:start + block_rows]]
+        out[pos:pos + len(block)] = block
+        pos += len(block)
+    del source
+    os.remove(full)
+    return out
+
+
+def write(prefix, ids, vectors, metadata=None, **manifest):
+    """Store an in-memory (n, dim) array"""
+    vectors = np.asarray(vectors)
+    matrix = create(prefix, len(vectors), vectors.shape[1] if vectors.ndim == 2 else 0)
+    matrix[:] = vectors
+    return finish(prefix, matrix, metadata, ids=ids, **manifest)
+
+
+# Reading ----------------------------------------------------------------------
+
+class EmbeddingStore:
+    """Read-only, memory-mapped view of a store"""
+
+    def __init__(self, prefix):
+        self.prefix = store_prefix(prefix)
+        with open(manifest_path(self.prefix)) as f:
+            self.manifest = json.load(f)
+        self.matrix = np.load(matrix_path(self.prefix), mmap_mode='r')
+        self.ids = np.load(ids_path(self.prefix), mmap_mode='r')
+        self.quantization = self.manifest.get('quantization')
+        self.scale = np.load(scale_path(self.prefix)) if self.quantization == 'int8' else None
+        self._order = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def dim(self):
+        return self.matrix.shape[1]
+
+    def positions(self, app_ids):
+        """(row positions, found mask) for APPLICATION_IDs, in request order"""
+        if self._order is None:
+            self._order = np.argsort(self.ids, kind='stable')
+            self._sorted = np.asarray(self.ids)[self._order]
+        ids = normalize_ids(app_ids)
+        if ids.dtype.kind != self._sorted.dtype.kind and self._sorted.dtype.kind == 'U':
+            ids = ids.astype(str)
+        if len(self._sorted) == 0 or ids.dtype.kind != self._sorted.dtype.kind:
+            return np.zeros(len(ids), dtype=np.int64), np.zeros(len(ids), dtype=bool)
+        idx = np.minimum(np.searchsorted(self._sorted, ids), len(self._sorted) - 1)
+        found = self._sorted[idx] == ids
+        return self._order[idx], found
+
+    def dequantize(self, codes, dtype=np.float32):
+        """Stored rows as dtype (int8 codes are multiplied by the per-dimension scale)"""
+        block = np.asarray(codes, dtype=dtype)
+        if self.scale is not None:
+            block *= self.scale.astype(dtype, copy=False)
+        return block
+
+    def select(self, app_ids, dtype=np.float32):
+        """(found mask, vectors of the found ids in request order); only those rows are read"""
+        pos, found = self.positions(app_ids)
+        return found, self.dequantize(self.matrix[pos[found]], dtype)
+
+    def blocks(self, block_rows=EXPORT_CHUNK_ROWS, dtype=np.float32):
+        """(start row, dequantized block) over the matrix, block_rows at a time"""
+        for start in range(0, len(self.matrix), block_rows):
+            yield start, self.dequantize(self.matrix[start:start + block_rows], dtype)
+
+    def vectors(self, dtype=np.float32):
+        """The whole matrix (memory-mapped; copied only if dtype differs or the store is quantized)"""
+        if self.matrix.dtype == dtype and self.quantization is None:
+            return self.matrix
+        out = np.empty(self.matrix.shape, dtype=dtype)
+        for start, block in self.blocks(dtype=dtype):
+            out[start:start + len(block)] = block
+        return out
+
+    def metadata(self, columns=None):
+        """Row-aligned metadata (APPLICATION_ID from the ID index if there is no table)"""
+        if os.path.exists(metadata_path(self.prefix)):
+            return pd.read_parquet(metadata_path(self.prefix), columns=columns)
+        return pd.DataFrame({ID_COLUMN: np.asarray(self.ids)})
+
+
+def load(prefix, columns=None, mmap=True):
+    """(matrix, metadata DataFrame); the matrix is memory-mapped read-only by default (quantized stores are dequantized)"""
+    store = EmbeddingStore(prefix)
+    matrix = store.vectors()
+    return (matrix if mmap or matrix is not store.matrix else np.array(matrix)), store.metadata(columns)
+
+
+# Quantized tiers --------------------------------------------------------------
+
+def quantize(prefix, output=None, mode='int8', block_rows=EXPORT_CHUNK_ROWS, report=False):
+    """
+    Write a float16 or int8 copy of a store at output (default {prefix}.{mode})
+    int8 uses a symmetric per-dimension scale (max |x| / 127), found in a first
+    pass over the blocks; both passes hold one block in memory at a time.
+    With report=True the quantization_report() is stored in the manifest as 'accuracy'.
+    """
+    if mode not in QUANTIZATIONS:
+        raise ValueError(f"Unknown quantization {mode!r}; choose from {QUANTIZATIONS}")
+    source = EmbeddingStore(prefix)
+    if source.quantization is not None:
+        raise ValueError(f"{source.prefix} is already quantized ({source.quantization})")
+    output = output or f"{source.prefix}.{mode}"
+
+    scale = None
+    if mode == 'int8':
+        max_abs = np.zeros(source.dim, dtype=np.float32)
+        for _, block in source.blocks(block_rows):
+            np.maximum(max_abs, np.abs(block).max(axis=0), out=max_abs)
+        scale = np.where(max_abs > 0, max_abs / 127, 1).astype(np.float32)
+
+    matrix = create(output, len(source), source.dim, dtype=np.int8 if mode == 'int8' else np.float16)
+    for start, block in source.blocks(block_rows):
+        if scale is None:
+            matrix[start:start + len(block)] = block
+        else:
+            matrix[start:start + len(block)] = np.clip(np.rint(block / scale), -127, 127)
+    if scale is None and os.path.exists(scale_path(output)):
+        os.remove(scale_path(output))
+    elif scale is not None:
+        np.save(scale_path(output), scale)
+
+    metadata = source.metadata() if os.path.exists(metadata_path(source.prefix)) else None
+    manifest = {k: v for k, v in source.manifest.items()
+                if k not in ('rows', 'dim', 'dtype', 'id_dtype', 'unique_ids', 'metadata_columns', 'created_at', 'source')}
+    store = finish(output, matrix, metadata, ids=np.asarray(source.ids), quantization=mode,
+                   quantized_from=source.prefix, **manifest)
+    if report:
+        store.manifest['accuracy'] = quantization_report(source.prefix, store.prefix)
+        _write_json(manifest_path(store.prefix), store.manifest)
+    return store
+
+
+def _unit_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms > 0, norms, 1)
+
+
+def _top_k(unit, queries, k):
+    """Indices of the k nearest rows (cosine) for each query row, self excluded"""
+    neighbors = np.empty((len(queries), k), dtype=np.int64)
+    for start in range(0, len(queries), 1024):
+        q = queries[start:start + 1024]
+        sims = unit[q] @ unit.T
+        sims[np.arange(len(q)), q] = -np.inf
+        neighbors[start:start + len(q)] = np.argpartition(-sims, k, axis=1)[:, :k]
+    return neighbors
+
+
+def quantization_report(reference, quantized, sample=20_000, k=10, clusters=50, queries=2_000, seed=42):
+    """
+    Accuracy of a quantized tier against its full-precision store, on a row sample
+    cosine: per-row cosine(full, dequantized) for non-zero rows.
+    knn_overlap: mean |top-k(full) ∩ top-k(quantized)| / k among the sample.
+    silhouette: cosine silhouette of a MiniBatchKMeans(clusters) fit on the full
+    vectors, and of the quantized vectors assigned to the same centroids, plus
+    the adjusted Rand index between the two assignments.
+    """
+    from sklearn.cluster import MiniBatchKMeans
+    from sklearn.metrics import adjusted_rand_score, silhouette_score
+
+    reference, quantized = EmbeddingStore(reference), EmbeddingStore(quantized)
+    if not np.array_equal(reference.ids, quantized.ids):
+        raise ValueError(f"{quantized.prefix} rows do not match {reference.prefix}")
+    rng = np.random.default_rng(seed)
+    rows = np.sort(rng.choice(len(reference), size=min(sample, len(reference)), replace=False))
+    full = np.asarray(reference.matrix[rows], dtype=np.float32)
+    approx = quantized.dequantize(quantized.matrix[rows])
+    nonzero = np.linalg.norm(full, axis=1) > 0
+    full, approx = full[nonzero], approx[nonzero]
+
+    unit_full, unit_approx = _unit_rows(full), _unit_rows(approx)
+    cosine = np.einsum('ij,ij->i', unit_full, unit_approx)
+    k = min(k, len(full) - 1)
+    query = rng.choice(len(full), size=min(queries, len(full)), replace=False)
+    overlap = np.mean([len(np.intersect1d(a, b)) / k for a, b in
+                       zip(_top_k(unit_full, query, k), _top_k(unit_approx, query, k))])
+
+    clusters = min(clusters, len(full) - 1)
+    kmeans = MiniBatchKMeans(n_clusters=clusters, random_state=seed, n_init=3).fit(full)
+    labels_full = kmeans.labels_
+    # Nearest full-precision centroid: differences come from quantization, not k-means seeding
+    labels_approx = kmeans.predict(approx)
+    # Same silhouette subsample for both precisions
+    sil_rows = min(10_000, len(full))
+    sil_full = silhouette_score(full, labels_full, metric='cosine', sample_size=sil_rows, random_state=seed)
+    sil_approx = silhouette_score(approx, labels_approx, metric='cosine', sample_size=sil_rows, random_state=seed)
+
+    ref_bytes = os.path.getsize(matrix_path(reference.prefix))
+    q_bytes = os.path.getsize(matrix_path(quantized.prefix)) + (
+        os.path.getsize(scale_path(quantized.prefix)) if quantized.scale is not None else 0)
+    return {
+        'quantization': quantized.quantization, 'rows_sampled': int(len(full)),
+        'size_ratio': round(ref_bytes / q_bytes, 2),
+        'cosine_mean': float(cosine.mean()), 'cosine_p01': float(np.percentile(cosine, 1)),
+        'cosine_min': float(cosine.min()),
+        'knn_k': int(k), 'knn_overlap': float(overlap),
+        'clusters': int(clusters), 'silhouette_full': float(sil_full),
+        'silhouette_quantized': float(sil_approx), 'silhouette_delta': float(sil_approx - sil_full),
+        'cluster_ari': float(adjusted_rand_score(labels_full, labels_approx)),
+    }
+
+
+def print_report(report):
+    print(f"  {report['quantization']} vs float32 ({report['rows_sampled']:,} sampled rows, "
+          f"{report['size_ratio']:.1f}x smaller)")
+    print(f"    Cosine to full precision: mean {report['cosine_mean']:.6f}, "
+          f"p01 {report['cosine_p01']:.6f}, min {report['cosine_min']:.6f}")
+    print(f"    {report['knn_k']}-NN overlap: {report['knn_overlap']:.1%}")
+    print(f"    Silhouette (K={report['clusters']}): {report['silhouette_full']:.4f} -> "
+          f"{report['silhouette_quantized']:.4f} ({report['silhouette_delta']:+.4f}), "
+          f"ARI {report['cluster_ari']:.3f}")
+
+
+# Legacy Parquet ---------------------------------------------------------------
+
+def parse_embedding_strings(values):
+    """Vectors from stringified lists ('[0.1, 0.2, ...]'), without eval()"""
+    rows = [np.fromstring(str(v).strip().strip('[]').replace(',', ' '), sep=' ', dtype=np.float32)
+            if isinstance(v, str) else np.asarray(v, dtype=np.float32) for v in values]
+    return np.vstack(rows) if rows else np.empty((0, 0), dtype=np.float32)
+
+
+def _source_signature(path):
+    stat = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime': int(stat.st_mtime)}
+
+
+def _block_vectors(column, dim):
+    """(rows, dim) float32 for one record batch's embedding column; null rows are zero"""
+    if pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+        block = parse_embedding_strings([v if v is not None else [0.0] * dim for v in column.to_pylist()])
+        return block.reshape(len(column), dim)
+    lengths = pc.fill_null(pc.list_value_length(column), 0).to_numpy(zero_copy_only=False)
+    if np.any((lengths != dim) & (lengths != 0)):
+        raise ValueError(f"Embedding lengths {sorted(set(lengths.tolist()))[:5]} != {dim}")
+    block = np.zeros((len(column), dim), dtype=np.float32)
+    full = lengths == dim
+    if full.any():
+        values = pc.list_flatten(column.filter(pa.array(full))).to_numpy(zero_copy_only=False)
+        block[full] = values.astype(np.float32, copy=False).reshape(-1, dim)
+    return block
+
+
+def convert_parquet(path, prefix=None, column='embedding', **manifest):
+    """Write the store for a legacy Parquet with an `embedding` list (or string) column"""
+    prefix = prefix or store_prefix(path)
+    parquet = pq.ParquetFile(path)
+    meta_columns = [c for c in parquet.schema_arrow.names if c != column]
+
+    # Vector length from the first non-null value
+    dim = None
+    for batch in parquet.iter_batches(batch_size=1024, columns=[column]):
+        values = batch.column(0).drop_null()
+        if len(values):
+            first = values[0].as_py()
+            dim = len(parse_embedding_strings([first])[0]) if isinstance(first, str) else len(first)
+            break
+    if dim is None:
+        raise ValueError(f"{path}: no non-null values in column {column!r}")
+
+    matrix = create(prefix, parquet.metadata.num_rows, dim)
+    start = 0
+    for batch in parquet.iter_batches(batch_size=EXPORT_CHUNK_ROWS, columns=[column]):
+        matrix[start:start + batch.num_rows] = _block_vectors(batch.column(0), dim)
+        start += batch.num_rows
+    metadata = parquet.read(columns=meta_columns).to_pandas() if meta_columns else None
+    ids = metadata[ID_COLUMN].to_numpy() if metadata is not None and ID_COLUMN in metadata else None
+    if ids is None:
+        raise ValueError(f"{path}: no {ID_COLUMN} column")
+    return finish(prefix, matrix, metadata, ids=ids, source=_source_signature(path), **manifest)
+
+
+def open_embeddings(path, convert=True):
+    """
+    EmbeddingStore for a store prefix or a legacy Parquet path
+    A Parquet file is converted on first use, and again whenever it changes.
+    """
+    prefix = store_prefix(path)
+    parquet = f"{prefix}.parquet"
+    if os.path.exists(manifest_path(prefix)):
+        store = EmbeddingStore(prefix)
+        source = store.manifest.get('source')
+        if not (source and os.path.exists(parquet) and source != _source_signature(parquet)):
+            return store
+    if not (convert and os.path.exists(parquet)):
+        raise FileNotFoundError(f"No embedding store at {prefix} and no {parquet} to convert")
+    print(f"  Converting {parquet} -> {matrix_path(prefix)} (one time)...")
+    start = time.time()
+    store = convert_parquet(parquet, prefix)
+    print(f"  ✓ {len(store):,} x {store.dim} in {time.time() - start:.1f}s")
+    return store
+
+
+def export_parquet(prefix, path, chunk_rows=EXPORT_CHUNK_ROWS, compression='snappy'):
+    """
+    Legacy Parquet: metadata columns + `embedding` list<float> column
+    Written chunk by chunk straight from the matrix buffer (no per-row lists).
+    """
+    store = EmbeddingStore(prefix)
+    dim = store.dim
+    table = pa.Table.from_pandas(store.metadata(), preserve_index=False)
+    schema = table.schema.append(pa.field('embedding', pa.list_(pa.float32())))
+    with pq.ParquetWriter(path, schema, compression=compression) as writer:
+        for start, block in store.blocks(chunk_rows):
+            block = np.ascontiguousarray(block)
+            offsets = pa.array(np.arange(0, len(block) * dim + 1, dim, dtype=np.int32))
+            embedding = pa.ListArray.from_arrays(offsets, pa.array(block.reshape(-1)))
+            chunk = table.slice(start, len(block))
+            writer.write_table(pa.Table.from_arrays(chunk.columns + [embedding], schema=schema))
+    if store_prefix(path) == store.prefix:
+        # The export is the store's own Parquet twin: record it so open_embeddings() does not reconvert
+        store.manifest['source'] = _source_signature(path)
+        _write_json(manifest_path(store.prefix), store.manifest)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_info = sub.add_parser('info', help='Summarise a store')
+    p_info.add_argument('prefix')
+    p_convert = sub.add_parser('convert', help='Build the store for a legacy embedding Parquet')
+    p_convert.add_argument('parquet')
+    p_export = sub.add_parser('export', help='Write the legacy list-column Parquet')
+    p_export.add_argument('prefix')
+    p_export.add_argument('output')
+    p_quantize = sub.add_parser('quantize', help='Write a float16 / int8 tier of a store')
+    p_quantize.add_argument('prefix')
+    p_quantize.add_argument('--mode', choices=QUANTIZATIONS, default='int8')
+    p_quantize.add_argument('--output', help='Prefix of the tier (default {prefix}.{mode})')
+    p_quantize.add_argument('--report', action='store_true',
+                            help='Measure cosine / k-NN / silhouette change and record it in the manifest')
+    args = parser.parse_args()
+
+    if args.command == 'quantize':
+        start = time.time()
+        store = quantize(store_prefix(args.prefix), args.output, args.mode, report=args.report)
+        print(f"✓ {store.prefix}: {len(store):,} x {store.dim} {store.matrix.dtype} "
+              f"({store.matrix.nbytes / 1e6:.0f} MB, {time.time() - start:.1f}s)")
+        if args.report:
+            print_report(store.manifest['accuracy'])
+        return 0
+
+    if args.command == 'export':
+        print(f"✓ {export_parquet(store_prefix(args.prefix), args.output)}")
+        return 0
+    if args.command == 'convert':
+        start = time.time()
+        store = convert_parquet(args.parquet)
+        print(f"✓ {store.prefix}: {len(store):,} x {store.dim} ({time.time() - start:.1f}s)")
+        return 0
+
+    store = EmbeddingStore(args.prefix)
+    norms = np.linalg.norm(store.dequantize(store.matrix[:min(len(store), 10_000)]), axis=1)
+    print(f"{matrix_path(store.prefix)}: {len(store):,} x {store.dim} {store.matrix.dtype} "
+          f"({store.matrix.nbytes / 1e6:.0f} MB)")
+    for key in ['model', 'text_recipe', 'quantization', 'quantized_from', 'id_dtype', 'unique_ids',
+                'metadata_columns', 'created_at']:
+        if key in store.manifest:
+            print(f"  {key}: {store.manifest[key]}")
+    print(f"  Zero vectors (first {len(norms):,} rows): {(norms == 0).sum():,}, mean norm {norms.mean():.2f}")
+    if len(store):
+        sample = np.random.default_rng(0).choice(np.asarray(store.ids), size=min(20_000, len(store)))
+        start = time.time()
+        store.select(sample)
+        print(f"  Select of {len(sample):,} ids: {(time.time() - start) * 1000:.0f} ms")
+    if 'accuracy' in store.manifest:
+        print_report(store.manifest['accuracy'])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -9,6 +9,8 @@ from sentence_transformers import SentenceTransformer
 import torch
 from tqdm import tqdm
 
+from embedding_cache import cached_embed
+
 print("="*70)
 print("GENERATING EMBEDDINGS FOR AWARD-LEVEL CLUSTERING")
 print("="*70)
@@ -40,16 +42,20 @@ print(f"   Model loaded on {device}")
 # Generate embeddings in batches
 print("\n[3/6] Generating embeddings...")
 batch_size = 256 if device == 'cuda' else 64
-all_embeddings = []
-
 titles = df['project_title'].tolist()
 
-for i in tqdm(range(0, len(titles), batch_size), desc="Embedding batches"):
-    batch = titles[i:i+batch_size]
-    embeddings = model.encode(batch, show_progress_bar=False, convert_to_numpy=True)
-    all_embeddings.append(embeddings)
 
-embeddings_array = np.vstack(all_embeddings)
+def embed_titles(titles):
+    all_embeddings = []
+    for i in tqdm(range(0, len(titles), batch_size), desc="Embedding batches"):
+        batch = titles[i:i+batch_size]
+        embeddings = model.encode(batch, show_progress_bar=False, convert_to_numpy=True)
+        all_embeddings.append(embeddings)
+    return np.vstack(all_embeddings) if all_embeddings else np.empty((0, 384), dtype=np.float32)
+
+
+embeddings_array, cache_stats = cached_embed(titles, embed_titles, model='all-MiniLM-L6-v2', recipe='project_title')
+print(f"   {cache_stats['cache_hits']:,} from cache, {cache_stats['computed']:,} computed")
 print(f"   Shape: {embeddings_array.shape}")
 print(f"   Memory: {embeddings_array.nbytes / 1e6:.1f} MB")
 
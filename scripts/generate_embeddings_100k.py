@@ -2,26 +2,44 @@
 """
 Generate PubMedBERT embeddings for 100k stratified sample
 Uses PROJECT_TERMS (auto-detected from schema)
+
+With nested samples (create_nested_samples.py), pass the smaller sample's
+embeddings via --reuse: only grants not already embedded are run through
+the model.
 """
+import argparse
+import json
 import pandas as pd
-import numpy as np
-from transformers import AutoTokenizer, AutoModel
-import torch
-from tqdm import tqdm
+
+import embedding_store
+from bert_embedder import BACKENDS, EMBEDDING_DIM, make_embedder
+from embedding_cache import cached_embed
+from stratified_sampler import split_cached
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--sample', default='grants_100k_stratified.parquet')
+parser.add_argument('--output', default='embeddings_100k_pubmedbert.parquet')
+parser.add_argument('--reuse', nargs='*', default=[],
+                    help='Existing embedding Parquet files (APPLICATION_ID, embedding) to reuse')
+parser.add_argument('--backend', choices=BACKENDS, default='torch',
+                    help='torch (GPU if available), or ONNX Runtime on CPU: onnx / onnx-int8')
+parser.add_argument('--quantize', choices=embedding_store.QUANTIZATIONS,
+                    help='Also write a float16 / int8 tier of the store, with its accuracy report')
+args = parser.parse_args()
 
 print("=" * 70)
 print("GENERATING 100K PUBMEDBERT EMBEDDINGS")
 print("=" * 70)
 
 # Load 100k sample
-sample_file = 'grants_100k_stratified.parquet'
+sample_file = args.sample
 print(f"\n[1/4] Loading {sample_file}...")
-df = pd.read_parquet(sample_file)
-print(f"  Loaded {len(df):,} grants")
+sample_df = pd.read_parquet(sample_file)
+print(f"  Loaded {len(sample_df):,} grants")
 
 # Identify text column
 text_cols = ['PROJECT_TERMS', 'PROJECT_TITLE', 'ABSTRACT_TEXT']
-text_col = next((c for c in text_cols if c in df.columns), None)
+text_col = next((c for c in text_cols if c in sample_df.columns), None)
 
 if not text_col:
     print("✗ No text column found!")
@@ -31,67 +49,61 @@ if not text_col:
 print(f"  Using column: {text_col}")
 
 # Load model
-print("\n[2/4] Loading PubMedBERT model...")
 model_name = "microsoft/BiomedNLP-PubMedBERT-base-uncased-abstract"
-tokenizer = AutoTokenizer.from_pretrained(model_name)
-model = AutoModel.from_pretrained(model_name)
+print("\n[2/4] Loading PubMedBERT model...")
+embedder = make_embedder(model_name, args.backend)
+print(f"  Backend: {args.backend}, device: {embedder.device}")
 
-device = 'cuda' if torch.cuda.is_available() else 'cpu'
-print(f"  Device: {device}")
-model = model.to(device)
-model.eval()
+# int8 vectors are recorded under their own model key so they never mix with fp32 ones
+cache_model = embedder.cache_model
+cache_key = {'model': cache_model, 'text_column': text_col}
+cached, df = split_cached(sample_df, args.reuse, columns=['APPLICATION_ID', 'embedding'], expect=cache_key)
+print(f"  Reused: {len(cached):,}, to embed: {len(df):,}")
 
-# Generate embeddings in batches
+# Generate embeddings in length-sorted, token-budget batches
 print(f"\n[3/4] Generating embeddings from {text_col}...")
 print("  This will take 30-60 minutes...")
 
-embeddings = []
-batch_size = 32
-total_batches = (len(df) + batch_size - 1) // batch_size
-
-with tqdm(total=len(df), desc="Embedding") as pbar:
-    for i in range(0, len(df), batch_size):
-        batch = df[text_col].iloc[i:i+batch_size].fillna('').tolist()
-        
-        # Tokenize
-        inputs = tokenizer(
-            batch,
-            padding=True,
-            truncation=True,
-            max_length=512,
-            return_tensors='pt'
-        )
-        inputs = {k: v.to(device) for k, v in inputs.items()}
-        
-        # Generate embeddings
-        with torch.no_grad():
-            outputs = model(**inputs)
-            batch_embeddings = outputs.last_hidden_state[:, 0, :].cpu().numpy()
-        
-        embeddings.append(batch_embeddings)
-        pbar.update(len(batch))
-        
-        # Progress update
-        if (i // batch_size + 1) % 100 == 0:
-            print(f"    Processed {i + len(batch):,}/{len(df):,} ({(i + len(batch))/len(df)*100:.1f}%)")
+# Grants embedded by any earlier run (same model and text column) come from the cache
+embeddings, cache_stats = cached_embed(df[text_col].fillna('').tolist(), embedder.embed,
+                                       model=cache_model, recipe=text_col)
+if len(df):
+    print(f"\n  Generated {embeddings.shape[0]:,} embeddings of {embeddings.shape[1]}D")
 
-embeddings = np.vstack(embeddings)
-print(f"\n  Generated {embeddings.shape[0]:,} embeddings of {embeddings.shape[1]}D")
+# Grants whose batch failed are NaN rows and were not cached: leave them out
+# of the store rather than publishing placeholders (the next run retries them)
+if cache_stats['failed']:
+    embedded = embedding_store.embedded_rows(embeddings)
+    print(f"  ⚠️  {(~embedded).sum():,} grants could not be embedded; left out of the store")
+    sample_df = sample_df[~sample_df['APPLICATION_ID'].isin(df['APPLICATION_ID'][~embedded])]
+    df, embeddings = df[embedded], embeddings[embedded]
 
-# Save
+# Save (reused + new rows, in sample order) as an embedding store, plus the
+# list-column Parquet that split_cached() and older readers use
 print("\n[4/4] Saving...")
-df_embeddings = pd.DataFrame({
-    'APPLICATION_ID': df['APPLICATION_ID'],
-    'embedding': [emb.tolist() for emb in embeddings]
-})
-
-output_file = 'embeddings_100k_pubmedbert.parquet'
-df_embeddings.to_parquet(output_file, index=False)
-print(f"  ✓ {output_file}")
-
-# Verify
-file_size = pd.read_parquet(output_file).memory_usage(deep=True).sum() / 1024**2
-print(f"  Size: {file_size:.1f} MB")
+output_file = args.output
+output_prefix = embedding_store.store_prefix(output_file)
+matrix = embedding_store.create(output_prefix, len(sample_df), EMBEDDING_DIM)
+# Everything reused from a new cache namespace leaves a (0, 0) array
+if len(df):
+    rows = pd.Index(sample_df['APPLICATION_ID']).get_indexer(df['APPLICATION_ID'])
+    matrix[rows] = embeddings
+if len(cached):
+    rows = pd.Index(sample_df['APPLICATION_ID']).get_indexer(cached['APPLICATION_ID'])
+    matrix[rows] = embedding_store.parse_embedding_strings(cached['embedding'].values)
+store = embedding_store.finish(output_prefix, matrix, sample_df[['APPLICATION_ID']], model=cache_model,
+                               text_recipe=text_col, sample=sample_file)
+embedding_store.export_parquet(output_prefix, output_file)
+with open(f"{output_file}.json", 'w') as f:
+    json.dump(dict(cache_key, sample=sample_file, rows=len(store),
+                   reused=len(cached), computed=cache_stats['computed'],
+                   cache_hits=cache_stats['cache_hits'], failed=cache_stats['failed']), f, indent=2)
+print(f"  ✓ {output_file} ({len(cached):,} reused, {len(df):,} computed)")
+print(f"  ✓ {embedding_store.matrix_path(output_prefix)}: {store.matrix.nbytes / 1024**2:.1f} MB")
+if args.quantize:
+    tier = embedding_store.quantize(output_prefix, mode=args.quantize, report=True)
+    print(f"  ✓ {embedding_store.matrix_path(tier.prefix)}: {tier.matrix.nbytes / 1024**2:.1f} MB")
+    embedding_store.print_report(tier.manifest['accuracy'])
 
 print("\n" + "=" * 70)
 print("EMBEDDINGS COMPLETE!")
@@ -5,11 +5,12 @@ Much faster than local PubMedBERT and no torch conflicts
 """
 import pandas as pd
 import numpy as np
-from vertexai.language_models import TextEmbeddingModel
-import vertexai
-from tqdm import tqdm
 import time
 
+import embedding_store
+from embedding_cache import cached_embed
+from vertex_embedder import VertexEmbeddingClient, VertexTransport
+
 PROJECT_ID = 'od-cl-odss-conroyri-f75a'
 REGION = 'us-central1'
 
@@ -19,8 +20,7 @@ print("=" * 80)
 
 # Initialize Vertex AI
 print("\n[1/5] Initializing Vertex AI...")
-vertexai.init(project=PROJECT_ID, location=REGION)
-model = TextEmbeddingModel.from_pretrained("text-embedding-005")
+client = VertexEmbeddingClient(VertexTransport("text-embedding-005", PROJECT_ID, REGION), concurrency=8)
 print("  Model: text-embedding-005 (768-dim, same as PubMedBERT)")
 
 # Load sample
@@ -36,58 +36,42 @@ print(f"  Text prepared for {len(texts):,} grants")
 
 # Generate embeddings in batches
 print("\n[4/5] Generating embeddings...")
-print("  Using Vertex AI API (batch processing)")
-print("  This will take 5-8 minutes...")
+print("  Using Vertex AI API (concurrent, adaptive batches)")
+
+
+def embed_texts(texts):
+    vectors = client.embed(texts)
+    client.report(f"{len(texts):,} titles")
+    return vectors
 
-batch_size = 250  # Vertex AI supports large batches
-embeddings = []
 
 start_time = time.time()
 
-for i in tqdm(range(0, len(texts), batch_size), desc="API batches"):
-    batch_texts = texts[i:i+batch_size]
-    
-    try:
-        # Get embeddings from Vertex AI
-        batch_embeddings = model.get_embeddings(batch_texts)
-        batch_vectors = [emb.values for emb in batch_embeddings]
-        embeddings.extend(batch_vectors)
-    except Exception as e:
-        print(f"\n  Warning: Batch {i//batch_size} failed: {e}")
-        print(f"  Retrying with smaller batch...")
-        # Retry with smaller batches
-        for text in batch_texts:
-            try:
-                emb = model.get_embeddings([text])[0]
-                embeddings.append(emb.values)
-            except:
-                # Fallback: zero vector
-                embeddings.append([0.0] * 768)
-        
-    # Rate limiting
-    if i % 5000 == 0 and i > 0:
-        time.sleep(1)
-
-embeddings_array = np.array(embeddings)
+# Titles already embedded by this or the 250k pipeline come from the cache
+embeddings_array, cache_stats = cached_embed(texts, embed_texts, model="text-embedding-005",
+                                             recipe="PROJECT_TITLE")
+print(f"  {cache_stats['cache_hits']:,} from cache, {cache_stats['computed']:,} sent to the API")
 
 elapsed = time.time() - start_time
 print(f"\n  Embeddings generated in {elapsed/60:.1f} minutes")
 print(f"  Shape: {embeddings_array.shape}")
 print(f"  Size: {embeddings_array.nbytes / 1e9:.2f} GB")
 
-# Verify dimensions
-if embeddings_array.shape[0] != len(df):
-    print(f"\n  ⚠️  Warning: Generated {len(embeddings_array)} embeddings for {len(df)} grants")
-    # Pad if needed
-    if embeddings_array.shape[0] < len(df):
-        missing = len(df) - embeddings_array.shape[0]
-        padding = np.zeros((missing, 768))
-        embeddings_array = np.vstack([embeddings_array, padding])
+# Titles that failed every retry are not cached; store only the embedded
+# grants (the next run retries the rest) instead of zero vectors
+if cache_stats['failed']:
+    embedded = np.isfinite(embeddings_array).all(axis=1)
+    print(f"\n  ⚠️  {cache_stats['failed']:,} titles could not be embedded; left out of the store")
+    df = df[embedded].reset_index(drop=True)
+    embeddings_array = embeddings_array[embedded]
 
-# Save
+# Save: embedding store (matrix + APPLICATION_ID index + manifest), then the
+# list-column Parquet streamed from it for older readers
 print("\n[5/5] Saving embeddings...")
-df['embedding'] = list(embeddings_array)
-df.to_parquet('embeddings_50k_sample.parquet', index=False)
+embedding_store.write('embeddings_50k_sample', df['APPLICATION_ID'], embeddings_array,
+                      metadata=df, model="text-embedding-005", text_recipe="PROJECT_TITLE")
+embedding_store.export_parquet('embeddings_50k_sample', 'embeddings_50k_sample.parquet')
+print(f"  Saved: embeddings_50k_sample.npy (+ .ids.npy, .meta.parquet, .manifest.json)")
 print(f"  Saved: embeddings_50k_sample.parquet")
 
 # Quick quality check
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Memory-mapped per-grant metadata store keyed by APPLICATION_ID
+Project: od-cl-odss-conroyri-f75a
+Built once from the local ExPORTER lake (nih_lake.py); replaces the
+`APPLICATION_ID IN UNNEST(@app_ids)` round trips and the int64-cast merges in
+the hybrid clustering scripts:
+
+    data/grant_store/app_ids.npy      sorted int64 APPLICATION_IDs (np.load mmap)
+    data/grant_store/columns.arrow    metadata columns in the same order (Arrow IPC, mmap)
+    data/grant_store/manifest.json    columns, rows, lake files it was built from
+
+A lookup is a searchsorted on the mapped ID array plus an Arrow take, so the
+result is already aligned with the requested IDs (missing IDs give nulls).
+
+Usage:
+  python3 scripts/grant_store.py build
+  python3 scripts/grant_store.py info
+
+  from grant_store import attach
+  df = attach(df, ['NIH_SPENDING_CATS', 'PROJECT_TERMS', 'IC_NAME'])   # aligned on df['APPLICATION_ID']
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from nih_lake import ExporterLake, LAKE_DIR
+
+STORE_DIR = 'data/grant_store'
+STORE_COLUMNS = ['IC_NAME', 'NIH_SPENDING_CATS', 'PROJECT_TERMS', 'CORE_PROJECT_NUM',
+                 'PROJECT_TITLE', 'ACTIVITY', 'FY', 'TOTAL_COST']
+
+
+def lake_signature(lake):
+    """Projects files and sync times the store depends on"""
+    return {path: entry['synced_at'] for path, entry in sorted(lake.manifest['files'].items())
+            if entry['table'] == 'projects'}
+
+
+def build(root=STORE_DIR, lake_dir=LAKE_DIR, columns=STORE_COLUMNS):
+    """Write the store from the lake's projects table"""
+    lake = ExporterLake(lake_dir)
+    available = set(lake.dataset('projects').schema.names)
+    columns = [c for c in columns if c in available]
+    table = lake.scan('projects', columns=['APPLICATION_ID'] + columns)
+    table = table.filter(pc.is_valid(table['APPLICATION_ID']))
+
+    # Sort by id and keep the first row of any duplicated id
+    table = table.take(pc.sort_indices(table['APPLICATION_ID']))
+    ids = table['APPLICATION_ID'].to_numpy().astype(np.int64)
+    keep = np.ones(len(ids), dtype=bool)
+    keep[1:] = ids[1:] != ids[:-1]
+    if not keep.all():
+        table, ids = table.filter(pa.array(keep)), ids[keep]
+
+    os.makedirs(root, exist_ok=True)
+    np.save(os.path.join(root, 'app_ids.npy'), ids)
+    data = table.drop(['APPLICATION_ID']).combine_chunks()
+    with pa.OSFile(os.path.join(root, 'columns.arrow'), 'wb') as sink:
+        with pa.ipc.new_file(sink, data.schema) as writer:
+            writer.write_table(data, max_chunksize=len(ids) or None)
+
+    manifest = {'rows': len(ids), 'columns': columns, 'lake_dir': lake_dir,
+                'lake_files': lake_signature(lake), 'built_at': datetime.now().isoformat()}
+    with open(os.path.join(root, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+class GrantStore:
+    """Read-only view of a built store; IDs and columns stay memory-mapped"""
+
+    def __init__(self, root=STORE_DIR):
+        self.root = root
+        with open(os.path.join(root, 'manifest.json')) as f:
+            self.manifest = json.load(f)
+        self.ids = np.load(os.path.join(root, 'app_ids.npy'), mmap_mode='r')
+        self.table = pa.ipc.open_file(pa.memory_map(os.path.join(root, 'columns.arrow'))).read_all()
+
+    def is_current(self, lake_dir=LAKE_DIR):
+        return self.manifest['lake_files'] == lake_signature(ExporterLake(lake_dir))
+
+    def positions(self, app_ids):
+        """(row positions, found mask) for APPLICATION_IDs in request order"""
+        ids = np.asarray(app_ids, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self.ids, ids), max(len(self.ids) - 1, 0))
+        found = self.ids[pos] == ids if len(self.ids) else np.zeros(len(ids), dtype=bool)
+        return pos, found
+
+    def take(self, app_ids, columns=None):
+        """Arrow table of `columns`, one row per requested id (nulls where missing)"""
+        pos, found = self.positions(app_ids)
+        indices = pa.array(pos, mask=~found)
+        return self.table.select(columns or self.table.column_names).take(indices)
+
+    def lookup(self, app_ids, columns=None):
+        """DataFrame with APPLICATION_ID + columns, aligned with app_ids"""
+        df = self.take(app_ids, columns).to_pandas()
+        df.insert(0, 'APPLICATION_ID', np.asarray(app_ids, dtype=np.int64))
+        return df
+
+    def attach(self, df, columns=None):
+        """Set `columns` on df from its APPLICATION_ID column (replaces existing ones, no merge)"""
+        taken = self.take(df['APPLICATION_ID'].to_numpy(), columns)
+        for name in taken.column_names:
+            df[name] = taken.column(name).to_pandas().values
+        return df
+
+
+def open_store(root=STORE_DIR, lake_dir=LAKE_DIR):
+    """The store at root, (re)built first if it is missing or older than the lake"""
+    if not os.path.exists(os.path.join(root, 'manifest.json')) or not GrantStore(root).is_current(lake_dir):
+        print(f"  Building grant store {root} from {lake_dir}...")
+        build(root, lake_dir)
+    return GrantStore(root)
+
+
+def attach(df, columns, root=STORE_DIR, lake_dir=LAKE_DIR):
+    return open_store(root, lake_dir).attach(df, columns)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_build = sub.add_parser('build', help='Build the store from the local lake')
+    p_build.add_argument('--columns', nargs='+', default=STORE_COLUMNS)
+    sub.add_parser('info', help='Summarise the store and time a lookup')
+    parser.add_argument('--store-dir', default=STORE_DIR)
+    parser.add_argument('--lake-dir', default=LAKE_DIR)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        start = time.time()
+        manifest = build(args.store_dir, args.lake_dir, args.columns)
+        print(f"✓ {args.store_dir}: {manifest['rows']:,} grants, {len(manifest['columns'])} columns "
+              f"({time.time() - start:.1f}s)")
+        return 0
+
+    store = GrantStore(args.store_dir)
+    print(f"Store: {args.store_dir}")
+    print(f"  Grants:  {store.manifest['rows']:,}")
+    print(f"  Columns: {', '.join(store.manifest['columns'])}")
+    print(f"  Built:   {store.manifest['built_at']} ({'current' if store.is_current(args.lake_dir) else 'stale'})")
+    if len(store.ids):
+        sample = np.random.default_rng(0).choice(np.asarray(store.ids), size=min(250_000, len(store.ids)))
+        start = time.time()
+        store.take(sample)
+        print(f"  Lookup of {len(sample):,} ids: {(time.time() - start) * 1000:.0f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,7 +5,6 @@ Clusters by TYPE OF SCIENCE, not by IC
 """
 import pandas as pd
 import numpy as np
-from google.cloud import bigquery
 from scipy.cluster.hierarchy import linkage, fcluster
 from sklearn.preprocessing import StandardScaler, MultiLabelBinarizer
 from sklearn.feature_extraction.text import TfidfVectorizer
@@ -14,6 +13,8 @@ import json
 import nltk
 from nltk.stem import WordNetLemmatizer
 
+from grant_store import attach
+
 try:
     nltk.data.find('corpora/wordnet')
 except:
@@ -61,30 +62,7 @@ print(f"  {len(df):,} grants")
 
 # Fetch metadata
 print("\n[2/7] Fetching metadata...")
-client = bigquery.Client(project=PROJECT_ID)
-query = """
-SELECT 
-  CAST(APPLICATION_ID AS INT64) as APPLICATION_ID,
-  NIH_SPENDING_CATS,
-  PROJECT_TERMS,
-  IC_NAME,
-  PROJECT_TITLE,
-  FY,
-  TOTAL_COST
-FROM `od-cl-odss-conroyri-f75a.nih_exporter.projects`
-WHERE CAST(APPLICATION_ID AS INT64) IN UNNEST(@app_ids)
-"""
-job_config = bigquery.QueryJobConfig(
-    query_parameters=[bigquery.ArrayQueryParameter("app_ids", "INT64", 
-                                                   df['APPLICATION_ID'].tolist())]
-)
-metadata_df = client.query(query, job_config=job_config).to_dataframe()
-metadata_df['APPLICATION_ID'] = metadata_df['APPLICATION_ID'].astype('int64')
-
-cols_to_drop = [c for c in metadata_df.columns if c in df.columns and c != 'APPLICATION_ID']
-if cols_to_drop:
-    df = df.drop(columns=cols_to_drop)
-df = df.merge(metadata_df, on='APPLICATION_ID', how='left')
+df = attach(df, ['NIH_SPENDING_CATS', 'PROJECT_TERMS', 'IC_NAME', 'PROJECT_TITLE', 'FY', 'TOTAL_COST'])
 
 # Create features (WITHOUT IC)
 print("\n[3/7] Creating science-based features...")
@@ -5,7 +5,6 @@ Combines semantic embeddings with NIH category data
 """
 import pandas as pd
 import numpy as np
-from google.cloud import bigquery
 from sklearn.cluster import KMeans
 from sklearn.preprocessing import MultiLabelBinarizer, StandardScaler, OneHotEncoder
 from sklearn.metrics import silhouette_score
@@ -13,6 +12,8 @@ import json
 from collections import Counter
 import time
 
+from grant_store import attach
+
 # Configuration
 PROJECT_ID = 'od-cl-odss-conroyri-f75a'
 N_CLUSTERS = 100
@@ -32,37 +33,14 @@ embeddings = np.stack(df['embedding'].values)
 print(f"  Loaded {len(df):,} grants with {embeddings.shape[1]}-dim embeddings in {time.time()-start:.1f}s")
 print(f"  Columns: {df.columns.tolist()}")
 
-# Step 2: Get RCDC categories from BigQuery using APPLICATION_ID
-print("\n[2/6] Fetching RCDC categories from BigQuery...")
+# Step 2: Get RCDC categories from the local grant store using APPLICATION_ID
+print("\n[2/6] Fetching RCDC categories from the local grant store...")
 start = time.time()
-client = bigquery.Client(project=PROJECT_ID)
-
-# Get APPLICATION_IDs from embedding sample
-app_ids = df['APPLICATION_ID'].astype(int).tolist()
-
-# Query for categories - use APPLICATION_ID to match
-query = """
-SELECT 
-  CAST(APPLICATION_ID AS INT64) as APPLICATION_ID,
-  NIH_SPENDING_CATS,
-  PROJECT_TERMS,
-  CORE_PROJECT_NUM
-FROM `od-cl-odss-conroyri-f75a.nih_processed.projects`
-WHERE CAST(APPLICATION_ID AS INT64) IN UNNEST(@app_ids)
-"""
-job_config = bigquery.QueryJobConfig(
-    query_parameters=[
-        bigquery.ArrayQueryParameter("app_ids", "INT64", app_ids)
-    ]
-)
-category_df = client.query(query, job_config=job_config).to_dataframe()
-print(f"  Fetched {len(category_df):,} rows in {time.time()-start:.1f}s")
-
-# Merge with embedding df
+
+# Columns aligned on the embedding sample's APPLICATION_IDs (grant_store.py)
 df['APPLICATION_ID'] = df['APPLICATION_ID'].astype(int)
-category_df['APPLICATION_ID'] = category_df['APPLICATION_ID'].astype(int)
-df = df.merge(category_df, on='APPLICATION_ID', how='left')
-print(f"  Merged: {df['NIH_SPENDING_CATS'].notna().sum():,} grants have RCDC categories")
+df = attach(df, ['NIH_SPENDING_CATS', 'PROJECT_TERMS', 'CORE_PROJECT_NUM'])
+print(f"  Fetched in {time.time()-start:.1f}s: {df['NIH_SPENDING_CATS'].notna().sum():,} grants have RCDC categories")
 
 # Step 3: Process RCDC categories
 print("\n[3/6] Processing RCDC categories...")
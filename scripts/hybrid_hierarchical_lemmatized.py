@@ -5,7 +5,6 @@ Groups related terms: cell/cells, protein/proteins, etc.
 """
 import pandas as pd
 import numpy as np
-from google.cloud import bigquery
 from scipy.cluster.hierarchy import linkage, fcluster
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.preprocessing import MultiLabelBinarizer, StandardScaler, OneHotEncoder
@@ -19,6 +18,8 @@ import time
 import nltk
 from nltk.stem import WordNetLemmatizer
 
+from grant_store import attach
+
 # Download NLTK data (only needed once)
 try:
     nltk.data.find('corpora/wordnet')
@@ -67,32 +68,9 @@ df['APPLICATION_ID'] = df['APPLICATION_ID'].astype('int64')
 print(f"  Loaded {len(df):,} grants")
 
 # Fetch metadata
-print("\n[2/7] Fetching metadata from BigQuery...")
-client = bigquery.Client(project=PROJECT_ID)
-app_ids = df['APPLICATION_ID'].tolist()
-
-query = """
-SELECT 
-  CAST(APPLICATION_ID AS INT64) as APPLICATION_ID,
-  NIH_SPENDING_CATS,
-  PROJECT_TERMS,
-  IC_NAME
-FROM `od-cl-odss-conroyri-f75a.nih_exporter.projects`
-WHERE CAST(APPLICATION_ID AS INT64) IN UNNEST(@app_ids)
-"""
-job_config = bigquery.QueryJobConfig(
-    query_parameters=[bigquery.ArrayQueryParameter("app_ids", "INT64", app_ids)]
-)
-metadata_df = client.query(query, job_config=job_config).to_dataframe()
-metadata_df['APPLICATION_ID'] = metadata_df['APPLICATION_ID'].astype('int64')
-
-# Drop conflicting columns
-cols_to_drop = [c for c in ['NIH_SPENDING_CATS', 'PROJECT_TERMS', 'IC_NAME'] if c in df.columns]
-if cols_to_drop:
-    df = df.drop(columns=cols_to_drop)
-
-df = df.merge(metadata_df, on='APPLICATION_ID', how='left')
-print(f"  Merged. RCDC: {df['NIH_SPENDING_CATS'].notna().mean()*100:.1f}%")
+print("\n[2/7] Fetching metadata from the local grant store...")
+df = attach(df, ['NIH_SPENDING_CATS', 'PROJECT_TERMS', 'IC_NAME'])
+print(f"  Attached. RCDC: {df['NIH_SPENDING_CATS'].notna().mean()*100:.1f}%")
 
 # Process RCDC
 print("\n[3/7] Processing RCDC categories...")
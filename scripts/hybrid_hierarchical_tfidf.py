@@ -6,7 +6,6 @@ Filters: Non-biomedical administrative terms
 """
 import pandas as pd
 import numpy as np
-from google.cloud import bigquery
 from scipy.cluster.hierarchy import linkage, fcluster
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.preprocessing import MultiLabelBinarizer, StandardScaler, OneHotEncoder
@@ -19,6 +18,8 @@ import json
 import time
 from collections import Counter
 
+from grant_store import attach
+
 # Configuration
 PROJECT_ID = 'od-cl-odss-conroyri-f75a'
 
@@ -63,26 +64,10 @@ embeddings = np.stack(df['embedding'].values)
 print(f"  Loaded {len(df):,} grants with {embeddings.shape[1]}-dim embeddings")
 print(f"  Time: {time.time() - start:.1f}s")
 
-# Step 2: Fetch RCDC, IC, and PROJECT_TERMS from BigQuery
-print("\n[2/7] Fetching metadata from BigQuery...")
+# Step 2: Fetch RCDC, IC, and PROJECT_TERMS from the local grant store
+print("\n[2/7] Fetching metadata from the local grant store...")
 start = time.time()
-client = bigquery.Client(project=PROJECT_ID)
-app_ids = df['APPLICATION_ID'].astype(int).tolist()
-
-query = """
-SELECT 
-  CAST(APPLICATION_ID AS INT64) as APPLICATION_ID,
-  NIH_SPENDING_CATS,
-  PROJECT_TERMS,
-  IC_NAME
-FROM `od-cl-odss-conroyri-f75a.nih_exporter.projects`
-WHERE CAST(APPLICATION_ID AS INT64) IN UNNEST(@app_ids)
-"""
-job_config = bigquery.QueryJobConfig(
-    query_parameters=[bigquery.ArrayQueryParameter("app_ids", "INT64", app_ids)]
-)
-metadata_df = client.query(query, job_config=job_config).to_dataframe()
-df = df.merge(metadata_df, on='APPLICATION_ID', how='left')
+df = attach(df, ['NIH_SPENDING_CATS', 'PROJECT_TERMS', 'IC_NAME'])
 print(f"  Fetched metadata for {len(df):,} grants")
 print(f"  Time: {time.time() - start:.1f}s")
 
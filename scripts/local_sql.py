@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Local SQL backend for the card builders and sampling SQL
+Project: od-cl-odss-conroyri-f75a
+Runs the BigQuery Standard SQL used by rebuild_comprehensive_*.sh and
+extract_250k_awards.sql on DuckDB, against the local Parquet lake
+(nih_lake.py) instead of `bq query`:
+
+    nih_exporter.{projects,abstracts,linktables,patents}   views over data/lake/exporter
+    nih_analytics.*                                         tables in data/local_sql/nih.duckdb
+
+`project.dataset.table` references drop the project, and a small dialect shim
+(translate()) rewrites the BigQuery-only constructs these scripts use:
+COUNTIF, RAND(), SAFE_DIVIDE, SPLIT(...)[SAFE_OFFSET(n)], STRING_AGG(... LIMIT n),
+UNNEST(GENERATE_ARRAY(a, b)) AS x, SELECT * EXCEPT(...), CAST(... AS INT64/STRING).
+
+Usage:
+  # One-time: copy the inputs that are not in the lake
+  python3 scripts/local_sql.py import nih_analytics.grant_scorecard_v2 --from-bigquery
+  python3 scripts/local_sql.py import nih_analytics.grant_scorecard_v2 --parquet scorecard.parquet
+
+  python3 scripts/local_sql.py run scripts/rebuild_comprehensive_ic_cards_v2.sh   # heredoc SQL
+  python3 scripts/local_sql.py run scripts/extract_250k_awards.sql
+  LOCAL=1 ./scripts/rebuild_comprehensive_pi_cards.sh
+  python3 scripts/local_sql.py export nih_analytics.ic_cards_comprehensive ic_cards.parquet
+"""
+
+import argparse
+import glob
+import os
+import re
+import sys
+import time
+
+import duckdb
+
+from nih_lake import LAKE_DIR, TABLES, UNPARTITIONED
+
+PROJECT_ID = 'od-cl-odss-conroyri-f75a'
+DB_PATH = 'data/local_sql/nih.duckdb'
+SCHEMAS = ['nih_exporter', 'nih_analytics']
+TYPE_MAP = {'INT64': 'BIGINT', 'FLOAT64': 'DOUBLE', 'STRING': 'VARCHAR', 'BOOL': 'BOOLEAN',
+            'NUMERIC': 'DECIMAL(38, 9)', 'BYTES': 'BLOB'}
+
+
+# Dialect shim -----------------------------------------------------------------
+
+def _split_args(inner):
+    """Split a function's argument text on top-level commas"""
+    args, depth, quote, current = [], 0, None, ''
+    for ch in inner:
+        if quote:
+            quote = None if ch == quote else quote
+        elif ch in "'\"":
+            quote = ch
+        elif ch == '(':
+            depth += 1
+        elif ch == ')':
+            depth -= 1
+        elif ch == ',' and depth == 0:
+            args.append(current.strip())
+            current = ''
+            continue
+        current += ch
+    args.append(current.strip())
+    return args
+
+
+def _rewrite_calls(sql, name, rewrite):
+    """Replace every NAME(...) call (balanced parentheses) with rewrite(inner_text)"""
+    pattern = re.compile(rf'\b{name}\s*\(', re.IGNORECASE)
+    out, pos = '', 0
+    while True:
+        match = pattern.search(sql, pos)
+        if not match:
+            return out + sql[pos:]
+        depth, i, quote = 1, match.end(), None
+        while depth:
+            ch = sql[i]
+            if quote:
+                quote = None if ch == quote else quote
+            elif ch in "'\"":
+                quote = ch
+            elif ch == '(':
+                depth += 1
+            elif ch == ')':
+                depth -= 1
+            i += 1
+        inner = _rewrite_calls(sql[match.end():i - 1], name, rewrite)
+        out += sql[pos:match.start()] + rewrite(inner)
+        pos = i
+
+
+def _string_agg(inner):
+    # DuckDB has no LIMIT inside aggregates: aggregate to a list, slice, join
+    match = re.match(r'(?is)(DISTINCT\s+)?(.*?)\s*,\s*(\'[^\']*\')\s*(ORDER\s+BY\s+.*?)?\s*LIMIT\s+(\d+)\s*$', inner)
+    if not match:
+        return f"STRING_AGG({inner})"
+    distinct, expr, sep, order, limit = match.groups()
+    return (f"ARRAY_TO_STRING(LIST_SLICE(LIST({distinct or ''}{expr} {order or ''}), 1, {limit}), {sep})")
+
+
+def translate(sql):
+    """BigQuery Standard SQL -> DuckDB for the constructs used in this repo"""
+    # `project.dataset.table` / `dataset.table` -> dataset.table
+    sql = re.sub(r'`(?:[\w-]+\.)?(\w+)\.(\w+)`', r'\1.\2', sql)
+    sql = re.sub(r'\bCOUNTIF\s*\(', 'COUNT_IF(', sql, flags=re.IGNORECASE)
+    sql = re.sub(r'\bRAND\s*\(\s*\)', 'RANDOM()', sql, flags=re.IGNORECASE)
+    sql = re.sub(r'\*\s*EXCEPT\s*\(', '* EXCLUDE (', sql, flags=re.IGNORECASE)
+    sql = re.sub(r'\bGENERATE_ARRAY\s*\(', 'GENERATE_SERIES(', sql, flags=re.IGNORECASE)
+    # FROM t, UNNEST(...) AS x  ->  name the unnested column x as well
+    sql = re.sub(r'(\bUNNEST\s*\((?:[^()]|\([^()]*\))*\))\s+AS\s+(\w+)\b(?!\s*\()', r'\1 AS \2(\2)',
+                 sql, flags=re.IGNORECASE)
+    # Arrays are 1-based in DuckDB; out-of-range subscripts already return NULL
+    sql = re.sub(r'\[\s*(?:SAFE_)?OFFSET\s*\(\s*(\d+)\s*\)\s*\]', lambda m: f'[{int(m.group(1)) + 1}]',
+                 sql, flags=re.IGNORECASE)
+    sql = re.sub(r'\[\s*(?:SAFE_)?ORDINAL\s*\(\s*(\d+)\s*\)\s*\]', r'[\1]', sql, flags=re.IGNORECASE)
+    sql = _rewrite_calls(sql, 'SPLIT', lambda inner: f"STRING_SPLIT({inner})")
+    sql = _rewrite_calls(sql, 'SAFE_DIVIDE',
+                         lambda inner: '(({}) / NULLIF(({}), 0))'.format(*_split_args(inner)))
+    sql = _rewrite_calls(sql, 'STRING_AGG', _string_agg)
+    sql = re.sub(r'\bAS\s+(INT64|FLOAT64|STRING|BOOL|NUMERIC|BYTES)\b',
+                 lambda m: f"AS {TYPE_MAP[m.group(1).upper()]}", sql, flags=re.IGNORECASE)
+    return sql
+
+
+def split_statements(sql):
+    """Split a script on top-level semicolons, ignoring quotes and -- comments"""
+    statements, current, quote, i = [], '', None, 0
+    while i < len(sql):
+        ch = sql[i]
+        if quote:
+            quote = None if ch == quote else quote
+        elif ch in "'\"`":
+            quote = ch
+        elif sql.startswith('--', i):
+            end = sql.find('\n', i)
+            end = len(sql) if end == -1 else end
+            current += sql[i:end]
+            i = end
+            continue
+        elif ch == ';':
+            statements.append(current)
+            current = ''
+            i += 1
+            continue
+        current += ch
+        i += 1
+    statements.append(current)
+    # Drop statements that are only comments/whitespace
+    return [s.strip() for s in statements if re.sub(r'--[^\n]*', '', s).strip()]
+
+
+def extract_sql(path):
+    """SQL from a .sql file, or the heredoc bodies (<< 'EOSQL' ... EOSQL) of a shell script"""
+    with open(path) as f:
+        text = f.read()
+    if not path.endswith('.sh'):
+        return text
+    blocks = re.findall(r"<<\s*'?(\w+)'?\s*\n(.*?)\n\1\s*$", text, flags=re.DOTALL | re.MULTILINE)
+    return ';\n'.join(body for _, body in blocks)
+
+
+# Engine -----------------------------------------------------------------------
+
+def connect(db_path=DB_PATH, lake_dir=LAKE_DIR):
+    """DuckDB connection with the lake mounted as nih_exporter.* views"""
+    os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+    con = duckdb.connect(db_path)
+    for schema in SCHEMAS:
+        con.execute(f"CREATE SCHEMA IF NOT EXISTS {schema}")
+    for table in TABLES:
+        if table in UNPARTITIONED:
+            pattern, hive = os.path.join(lake_dir, table, '*.parquet'), 'false'
+        else:
+            pattern, hive = os.path.join(lake_dir, table, 'YEAR=*', '*.parquet'), 'true'
+        if not glob.glob(pattern):
+            continue
+        con.execute(f"CREATE OR REPLACE VIEW nih_exporter.{table} AS SELECT * FROM read_parquet("
+                    f"'{pattern}', hive_partitioning = {hive}, union_by_name = true)")
+    return con
+
+
+def run(con, sql, show_rows=25):
+    """Translate and execute each statement; print the result of queries"""
+    for statement in split_statements(sql):
+        first_line = next(l for l in statement.splitlines() if l.strip() and not l.strip().startswith('--'))
+        print(f"\n▶ {first_line.strip()[:90]}")
+        start = time.time()
+        result = con.sql(translate(statement))
+        if result is None:
+            print(f"  ✓ {time.time() - start:.2f}s")
+            continue
+        df = result.limit(show_rows).df()
+        print(df.to_string(index=False))
+        print(f"  ({time.time() - start:.2f}s)")
+
+
+def import_table(con, name, parquet=None, from_bigquery=False):
+    """Copy an input table (e.g. nih_analytics.grant_scorecard_v2) into the local database"""
+    if from_bigquery:
+        from google.cloud import bigquery
+        client = bigquery.Client(project=PROJECT_ID)
+        arrow_table = client.query(f"SELECT * FROM `{PROJECT_ID}.{name}`").to_arrow()  # noqa: F841
+        con.execute(f"CREATE OR REPLACE TABLE {name} AS SELECT * FROM arrow_table")
+    else:
+        con.execute(f"CREATE OR REPLACE TABLE {name} AS SELECT * FROM read_parquet('{parquet}')")
+    return con.execute(f"SELECT COUNT(*) FROM {name}").fetchone()[0]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--lake-dir', default=LAKE_DIR)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_run = sub.add_parser('run', help='Run a .sql file, the heredoc SQL of a .sh script, or stdin (-)')
+    p_run.add_argument('path')
+    p_run.add_argument('--rows', type=int, default=25, help='Rows to print per query')
+    p_run.add_argument('--print-sql', action='store_true', help='Print the translated SQL and exit')
+
+    p_import = sub.add_parser('import', help='Copy a table into the local database')
+    p_import.add_argument('table', help='dataset.table, e.g. nih_analytics.grant_scorecard_v2')
+    source = p_import.add_mutually_exclusive_group(required=True)
+    source.add_argument('--parquet')
+    source.add_argument('--from-bigquery', action='store_true')
+
+    p_export = sub.add_parser('export', help='Write a local table to Parquet')
+    p_export.add_argument('table')
+    p_export.add_argument('output')
+
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        sql = sys.stdin.read() if args.path == '-' else extract_sql(args.path)
+        if args.print_sql:
+            print(';\n\n'.join(translate(s) for s in split_statements(sql)))
+            return 0
+        start = time.time()
+        run(connect(args.db, args.lake_dir), sql, args.rows)
+        print(f"\n✓ Done in {time.time() - start:.1f}s ({args.db})")
+    elif args.command == 'import':
+        rows = import_table(connect(args.db, args.lake_dir), args.table, args.parquet, args.from_bigquery)
+        print(f"✓ {args.table}: {rows:,} rows -> {args.db}")
+    else:
+        con = connect(args.db, args.lake_dir)
+        con.execute(f"COPY {args.table} TO '{args.output}' (FORMAT PARQUET)")
+        print(f"✓ {args.table} -> {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
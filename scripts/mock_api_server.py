@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""
+Local RePORTER / NSF Awards API stand-in for offline ingestion benchmarks
+Project: od-cl-odss-conroyri-f75a
+
+Replays recorded fixtures with the real APIs' paging behaviour:
+  - RePORTER: POST search, criteria filtering, meta.total, sort on appl_id,
+    limit <= 500 and offset <= 14,999 (larger offsets return HTTP 400)
+  - NSF: GET awards.json, 1-based offset, rpp <= 25, metadata.totalCount
+Fault injection: latency (+ jitter), random 5xx error rate, and a server-side
+rate limit answered with 429 + Retry-After. GET /_stats returns counters.
+
+Usage:
+  # Record fixtures from the live APIs (once, online)
+  python3 scripts/mock_api_server.py record --years 2021 --out data/fixtures/reporter_fy2021.ndjson.gz
+  python3 scripts/mock_api_server.py record-nsf --keyword '"Smart and Connected Health"' \\
+      --out data/fixtures/nsf_sch.ndjson.gz
+
+  # Serve them (offline)
+  python3 scripts/mock_api_server.py serve --reporter-fixture data/fixtures/reporter_fy2021.ndjson.gz \\
+      --nsf-fixture data/fixtures/nsf_sch.ndjson.gz --latency 0.2 --error-rate 0.02 --rate-limit 10
+
+Without fixtures, --synthetic N generates N RePORTER-shaped records per year.
+"""
+
+import argparse
+import gzip
+import json
+import os
+import random
+import threading
+import time
+from datetime import date, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from reporter_client import TokenBucket, MAX_OFFSET
+
+REPORTER_MAX_LIMIT = 500
+NSF_MAX_RPP = 25
+
+
+# Fixtures -------------------------------------------------------------------
+
+def load_fixture(path):
+    """Load records from .ndjson(.gz), .json (list) or a Parquet file/directory"""
+    if os.path.isdir(path) or path.endswith('.parquet'):
+        import pyarrow.dataset as ds
+        return ds.dataset(path, format='parquet', partitioning='hive').to_table().to_pylist()
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        if '.ndjson' in path or '.jsonl' in path:
+            return [json.loads(line) for line in f if line.strip()]
+        return json.load(f)
+
+
+def save_fixture(records, path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, default=str) + '\n')
+    print(f"✓ Saved {len(records):,} records to {path}")
+
+
+def synthetic_reporter(n_per_year, years, seed=42):
+    """RePORTER-shaped records, roughly matching the real IC/date mix"""
+    rng = random.Random(seed)
+    ics = ['NCI'] * 6 + ['NIAID'] * 4 + ['NHLBI'] * 3 + ['NIGMS'] * 3 + ['NIMH', 'NIA', 'NINDS', 'NIDDK']
+    activities = ['R01'] * 6 + ['R21', 'U01', 'P30', 'K99', 'F31', 'T32', 'R43']
+    records = []
+    for fy in years:
+        for i in range(n_per_year):
+            notice = date(fy - 1, 10, 1) + timedelta(days=rng.randint(0, 364))
+            added = notice + timedelta(days=rng.randint(0, 30))
+            records.append({
+                'appl_id': fy * 1_000_000 + i,
+                'fiscal_year': fy,
+                'agency_code': rng.choice(ics),
+                'activity_code': rng.choice(activities),
+                'award_amount': rng.randint(50_000, 3_000_000),
+                'award_notice_date': f"{notice.isoformat()}T00:00:00",
+                'date_added': f"{added.isoformat()}T00:00:00",
+                'project_title': f"Synthetic project {fy}-{i}",
+                'abstract_text': "Synthetic abstract text. " * rng.randint(5, 60),
+            })
+    return records
+
+
+# Request matching -----------------------------------------------------------
+
+def _in_range(value, rng):
+    if not value:
+        return False
+    day = str(value)[:10]
+    return rng.get('from_date', '0000') <= day <= rng.get('to_date', '9999')
+
+
+def reporter_match(record, criteria):
+    """Subset of RePORTER criteria semantics used by the ingestion scripts"""
+    if 'fiscal_years' in criteria and record.get('fiscal_year') not in criteria['fiscal_years']:
+        return False
+    if 'appl_ids' in criteria and record.get('appl_id') not in criteria['appl_ids']:
+        return False
+    if 'agencies' in criteria:
+        agency = record.get('agency_code') or (record.get('agency_ic_admin') or {}).get('abbreviation')
+        if agency not in criteria['agencies']:
+            return False
+    if 'activity_codes' in criteria and record.get('activity_code') not in criteria['activity_codes']:
+        return False
+    for field in ('award_notice_date', 'date_added'):
+        if field in criteria and not _in_range(record.get(field), criteria[field]):
+            return False
+    return True
+
+
+# Server ---------------------------------------------------------------------
+
+class MockState:
+    """Fixtures, fault settings and counters shared by handler threads"""
+
+    def __init__(self, reporter_records, nsf_records, latency=0.0, jitter=0.0,
+                 error_rate=0.0, rate_limit=None, seed=0):
+        self.reporter = sorted(reporter_records, key=lambda r: r.get('appl_id') or 0)
+        self.reporter_by_id = {r.get('appl_id'): r for r in self.reporter}
+        self.nsf = nsf_records
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.limiter = TokenBucket(rate_limit, burst=rate_limit) if rate_limit else None
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'ok': 0, 'throttled': 0, 'errors': 0, 'bad_request': 0}
+        self.cache = {}
+
+    def search(self, criteria):
+        """Matching records, cached per criteria so paging does not rescan"""
+        key = json.dumps(criteria, sort_keys=True)
+        with self.lock:
+            hits = self.cache.get(key)
+        if hits is None:
+            hits = [r for r in self.reporter if reporter_match(r, criteria)]
+            with self.lock:
+                self.cache[key] = hits
+        return hits
+
+    def count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def throttled(self):
+        """Server-side rate limit: True when this request should get a 429"""
+        return bool(self.limiter) and not self.limiter.try_acquire()
+
+    def inject_fault(self):
+        with self.lock:
+            return self.rng.random() < self.error_rate
+
+    def delay(self):
+        with self.lock:
+            extra = self.rng.uniform(0, self.jitter) if self.jitter else 0.0
+        time.sleep(self.latency + extra)
+
+
+def make_handler(state):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def send_json(self, status, obj, headers=None):
+            body = json.dumps(obj, default=str).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def preflight(self):
+            """Common rate-limit / latency / fault handling; True if answered"""
+            state.count('requests')
+            if state.throttled():
+                state.count('throttled')
+                self.send_json(429, {'error': 'Too Many Requests'}, {'Retry-After': '1'})
+                return True
+            state.delay()
+            if state.inject_fault():
+                state.count('errors')
+                self.send_json(503, {'error': 'Service Unavailable (injected)'})
+                return True
+            return False
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == '/_stats':
+                with state.lock:
+                    self.send_json(200, dict(state.stats))
+                return
+            if self.preflight():
+                return
+
+            # NSF awards.json
+            query = parse_qs(url.query)
+            offset = int(query.get('offset', ['1'])[0]) - 1
+            rpp = min(int(query.get('rpp', [str(NSF_MAX_RPP)])[0]), NSF_MAX_RPP)
+            state.count('ok')
+            self.send_json(200, {'response': {
+                'metadata': {'totalCount': len(state.nsf)},
+                'award': state.nsf[max(offset, 0):max(offset, 0) + rpp]
+            }})
+
+        def do_POST(self):
+            payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            if self.preflight():
+                return
+
+            # RePORTER projects/search
+            offset = payload.get('offset', 0)
+            limit = payload.get('limit', 50)
+            if offset > MAX_OFFSET or limit > REPORTER_MAX_LIMIT:
+                state.count('bad_request')
+                self.send_json(400, {'error': f'offset must be <= {MAX_OFFSET} and '
+                                              f'limit <= {REPORTER_MAX_LIMIT}'})
+                return
+
+            criteria = payload.get('criteria', {})
+            if 'appl_ids' in criteria:
+                hits = [state.reporter_by_id[i] for i in criteria['appl_ids'] if i in state.reporter_by_id]
+            else:
+                hits = state.search(criteria)
+            if payload.get('sort_order') == 'desc':
+                hits = hits[::-1]
+
+            state.count('ok')
+            self.send_json(200, {
+                'meta': {'total': len(hits), 'offset': offset, 'limit': limit},
+                'results': hits[offset:offset + limit]
+            })
+
+    return Handler
+
+
+def start_server(state, host='127.0.0.1', port=0):
+    """Start the stand-in on a background thread; returns (server, base_url)"""
+    server = ThreadingHTTPServer((host, port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+# Recording ------------------------------------------------------------------
+
+def record_reporter(years, out, rate):
+    """Record fiscal years from the live RePORTER API through the partitioning crawler"""
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    from reporter_client import ReporterClient, count_records, plan_slices
+
+    client = ReporterClient(rate=rate)
+    records = {}
+    with ThreadPoolExecutor(max_workers=client.concurrency) as pool:
+        for fy in years:
+            criteria = {'fiscal_years': [fy]}
+            slices = plan_slices(client, pool, criteria, total=count_records(client, criteria))
+            futures = [
+                pool.submit(client.search, {'criteria': s['criteria'], 'offset': offset, 'limit': 500,
+                                            'sort_field': 'ApplId', 'sort_order': 'asc'})
+                for s in slices for offset in range(0, min(s['total'], MAX_OFFSET + 1), 500)
+            ]
+            for future in as_completed(futures):
+                for r in future.result().get('results', []):
+                    records[r['appl_id']] = r
+    client.stats.report("Recording")
+    save_fixture(list(records.values()), out)
+
+
+def record_nsf(keyword, out):
+    """Record an NSF keyword search from the live awards API"""
+    import requests
+    awards = []
+    offset = 1
+    while True:
+        response = requests.get("https://api.nsf.gov/services/v1/awards.json",
+                                params={'keyword': keyword, 'rpp': NSF_MAX_RPP, 'offset': offset},
+                                timeout=60)
+        response.raise_for_status()
+        page = response.json().get('response', {}).get('award', [])
+        if not page:
+            break
+        awards.extend(page)
+        offset += NSF_MAX_RPP
+        time.sleep(0.3)
+    save_fixture(awards, out)
+
+
+def build_state(args):
+    """MockState from CLI arguments (fixtures or synthetic data)"""
+    if args.reporter_fixture:
+        reporter = load_fixture(args.reporter_fixture)
+    else:
+        reporter = synthetic_reporter(args.synthetic, args.synthetic_years)
+    nsf = load_fixture(args.nsf_fixture) if args.nsf_fixture else [
+        {'id': str(2000000 + i), 'title': f"Synthetic award {i}"} for i in range(args.synthetic_nsf)
+    ]
+    return MockState(reporter, nsf, latency=args.latency, jitter=args.jitter,
+                     error_rate=args.error_rate, rate_limit=args.rate_limit, seed=args.seed)
+
+
+def add_server_args(parser):
+    parser.add_argument('--reporter-fixture', help='Recorded RePORTER records (.ndjson.gz/.json/Parquet)')
+    parser.add_argument('--nsf-fixture', help='Recorded NSF awards (.ndjson.gz/.json)')
+    parser.add_argument('--synthetic', type=int, default=20000,
+                        help='Synthetic RePORTER records per year when no fixture is given')
+    parser.add_argument('--synthetic-years', type=int, nargs='+', default=[2021, 2022])
+    parser.add_argument('--synthetic-nsf', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.1, help='Base latency per request (s)')
+    parser.add_argument('--jitter', type=float, default=0.05, help='Extra uniform latency (s)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered 503')
+    parser.add_argument('--rate-limit', type=float, default=None, help='Requests/sec before 429s')
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    serve = sub.add_parser('serve', help='Run the stand-in server')
+    add_server_args(serve)
+    serve.add_argument('--port', type=int, default=8765)
+
+    rec = sub.add_parser('record', help='Record RePORTER fiscal years to a fixture')
+    rec.add_argument('--years', type=int, nargs='+', required=True)
+    rec.add_argument('--out', required=True)
+    rec.add_argument('--rate', type=float, default=1.0)
+
+    rec_nsf = sub.add_parser('record-nsf', help='Record an NSF keyword search to a fixture')
+    rec_nsf.add_argument('--keyword', required=True)
+    rec_nsf.add_argument('--out', required=True)
+
+    args = parser.parse_args()
+    if args.command == 'record':
+        record_reporter(args.years, args.out, args.rate)
+        return
+    if args.command == 'record-nsf':
+        record_nsf(args.keyword, args.out)
+        return
+
+    state = build_state(args)
+    server, base_url = start_server(state, port=args.port)
+    print(f"✓ Serving {len(state.reporter):,} RePORTER and {len(state.nsf):,} NSF records at {base_url}")
+    print(f"  RePORTER: {base_url}/v2/projects/search   NSF: {base_url}/services/v1/awards.json")
+    print(f"  latency={args.latency}s+{args.jitter}s error_rate={args.error_rate} "
+          f"rate_limit={args.rate_limit or 'none'}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Local Vertex AI text-embedding stand-in for offline load tests
+Project: od-cl-odss-conroyri-f75a
+
+Answers the Vertex `:predict` call that vertex_embedder.HttpTransport makes:
+  POST /v1/projects/{project}/locations/{location}/publishers/google/models/{model}:predict
+  {"instances": [{"content": "..."}, ...]}  ->  {"predictions": [{"embeddings": {"values": [...]}}]}
+with the real service's request limits (<= 250 instances and <= 20,000 tokens
+per request, otherwise HTTP 400 INVALID_ARGUMENT).
+Fault injection: latency that grows with batch size (+ jitter), random 5xx
+error rate, "poison" texts that make any batch containing them fail, and a
+server-side rate limit answered with 429 + Retry-After. GET /_stats returns
+counters.
+
+Vectors come from a deterministic hashed bag-of-words model (768-dim, unit
+norm, similar titles get similar vectors), or from a local PubMedBERT
+through bert_embedder with --bert-backend.
+
+Usage:
+  python3 scripts/mock_embedding_server.py serve --latency 0.2 --per-text 0.002 \\
+      --error-rate 0.02 --rate-limit 20
+  python3 scripts/mock_embedding_server.py serve --bert-backend onnx-int8
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+
+from reporter_client import TokenBucket
+
+MAX_INSTANCES = 250
+MAX_REQUEST_TOKENS = 20_000
+EMBEDDING_DIM = 768
+PUBMEDBERT = "microsoft/BiomedNLP-PubMedBERT-base-uncased-abstract"
+
+
+def count_tokens(text):
+    """Rough token count (word pieces), used for the per-request limit"""
+    return len(re.findall(r"\w+|[^\w\s]", text)) * 4 // 3
+
+
+class HashEmbedder:
+    """Hashed unigram + bigram features with random signs; unit-norm float32 vectors"""
+
+    def __init__(self, dim=EMBEDDING_DIM):
+        self.dim = dim
+
+    def _features(self, text):
+        words = re.findall(r"\w+", text.lower())
+        return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text) or ['<empty>']:
+                h = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'little')
+                vectors[row, h % self.dim] += 1.0 if (h >> 32) & 1 else -1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms > 0, norms, 1)
+
+
+class BertModel:
+    """bert_embedder backend behind a lock (handler threads share one model)"""
+
+    def __init__(self, backend, model_name=PUBMEDBERT):
+        from bert_embedder import make_embedder
+        self.embedder = make_embedder(model_name, backend)
+        self.dim = self.embedder.dim
+        self.lock = threading.Lock()
+
+    def embed(self, texts):
+        with self.lock:
+            return self.embedder.embed(list(texts), progress=False)
+
+
+# Server ---------------------------------------------------------------------
+
+class EmbeddingState:
+    """Model, fault settings and counters shared by handler threads"""
+
+    def __init__(self, model, latency=0.0, per_text=0.0, jitter=0.0, error_rate=0.0,
+                 poison_rate=0.0, rate_limit=None, seed=0):
+        self.model = model
+        self.latency = latency
+        self.per_text = per_text
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.poison_rate = poison_rate
+        self.limiter = TokenBucket(rate_limit, burst=rate_limit) if rate_limit else None
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'ok': 0, 'instances': 0, 'throttled': 0, 'errors': 0,
+                      'poisoned': 0, 'bad_request': 0}
+
+    def count(self, key, n=1):
+        with self.lock:
+            self.stats[key] += n
+
+    def throttled(self):
+        """Server-side rate limit: True when this request should get a 429"""
+        return bool(self.limiter) and not self.limiter.try_acquire()
+
+    def inject_fault(self):
+        with self.lock:
+            return self.rng.random() < self.error_rate
+
+    def poisoned(self, text):
+        """Deterministic per text: the same titles fail on every attempt"""
+        if not self.poison_rate:
+            return False
+        h = int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little')
+        return h / 2 ** 64 < self.poison_rate
+
+    def delay(self, n_instances):
+        with self.lock:
+            extra = self.rng.uniform(0, self.jitter) if self.jitter else 0.0
+        time.sleep(self.latency + self.per_text * n_instances + extra)
+
+
+def make_handler(state):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def send_json(self, status, obj, headers=None):
+            body = json.dumps(obj).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def send_error_json(self, status, message, state_name, headers=None):
+            self.send_json(status, {'error': {'code': status, 'message': message, 'status': state_name}}, headers)
+
+        def do_GET(self):
+            if self.path == '/_stats':
+                with state.lock:
+                    self.send_json(200, dict(state.stats))
+                return
+            self.send_error_json(404, f"Unknown path {self.path}", 'NOT_FOUND')
+
+        def do_POST(self):
+            payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            state.count('requests')
+            if not self.path.endswith(':predict'):
+                self.send_error_json(404, f"Unknown path {self.path}", 'NOT_FOUND')
+                return
+            if state.throttled():
+                state.count('throttled')
+                self.send_error_json(429, 'Quota exceeded (stand-in rate limit)', 'RESOURCE_EXHAUSTED',
+                                     {'Retry-After': '1'})
+                return
+
+            texts = [str(instance.get('content', '')) for instance in payload.get('instances', [])]
+            tokens = sum(count_tokens(t) for t in texts)
+            if not texts or len(texts) > MAX_INSTANCES or tokens > MAX_REQUEST_TOKENS:
+                state.count('bad_request')
+                self.send_error_json(400, f"{len(texts)} instances / {tokens} tokens; limits are "
+                                          f"{MAX_INSTANCES} / {MAX_REQUEST_TOKENS}", 'INVALID_ARGUMENT')
+                return
+
+            state.delay(len(texts))
+            if state.inject_fault():
+                state.count('errors')
+                self.send_error_json(503, 'Service unavailable (injected)', 'UNAVAILABLE')
+                return
+            if any(state.poisoned(t) for t in texts):
+                state.count('poisoned')
+                self.send_error_json(500, 'Internal error (poisoned text)', 'INTERNAL')
+                return
+
+            vectors = state.model.embed(texts)
+            state.count('ok')
+            state.count('instances', len(texts))
+            self.send_json(200, {
+                'predictions': [{'embeddings': {'values': v.tolist(),
+                                                'statistics': {'token_count': count_tokens(t), 'truncated': False}}}
+                                for t, v in zip(texts, vectors)],
+                'metadata': {'billableCharacterCount': sum(len(t) for t in texts)},
+            })
+
+    return Handler
+
+
+def start_server(state, host='127.0.0.1', port=0):
+    """Start the stand-in on a background thread; returns (server, base_url)"""
+    server = ThreadingHTTPServer((host, port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def build_state(args):
+    """EmbeddingState from CLI arguments"""
+    model = BertModel(args.bert_backend) if args.bert_backend else HashEmbedder()
+    return EmbeddingState(model, latency=args.latency, per_text=args.per_text, jitter=args.jitter,
+                          error_rate=args.error_rate, poison_rate=args.poison_rate,
+                          rate_limit=args.rate_limit, seed=args.seed)
+
+
+def add_server_args(parser):
+    parser.add_argument('--bert-backend', choices=['torch', 'onnx', 'onnx-int8'],
+                        help='Serve PubMedBERT vectors through bert_embedder (default: hashed bag of words)')
+    parser.add_argument('--latency', type=float, default=0.1, help='Base latency per request (s)')
+    parser.add_argument('--per-text', type=float, default=0.001, help='Extra latency per instance (s)')
+    parser.add_argument('--jitter', type=float, default=0.05, help='Extra uniform latency (s)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered 503')
+    parser.add_argument('--poison-rate', type=float, default=0.0,
+                        help='Fraction of texts that make every batch containing them fail (500)')
+    parser.add_argument('--rate-limit', type=float, default=None, help='Requests/sec before 429s')
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest='command', required=True)
+    serve = sub.add_parser('serve', help='Run the stand-in server')
+    add_server_args(serve)
+    serve.add_argument('--port', type=int, default=8766)
+    args = parser.parse_args()
+
+    state = build_state(args)
+    server, base_url = start_server(state, port=args.port)
+    print(f"✓ Serving {type(state.model).__name__} embeddings at {base_url}")
+    print(f"  POST {base_url}/v1/projects/-/locations/-/publishers/google/models/text-embedding-005:predict")
+    print(f"  latency={args.latency}s+{args.per_text}s/text+{args.jitter}s error_rate={args.error_rate} "
+          f"poison_rate={args.poison_rate} rate_limit={args.rate_limit or 'none'}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
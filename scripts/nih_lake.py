@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+Local YEAR=-partitioned ExPORTER lake
+Project: od-cl-odss-conroyri-f75a
+Mirrors gs://od-cl-odss-conroyri-nih-embeddings/exporter/{table}_parquet/ to
+local disk and rewrites each file once with consistent types, so experiments
+can scan it with pyarrow.dataset instead of round-tripping through
+nih_exporter.* in BigQuery:
+
+    data/lake/exporter/{table}/YEAR={year}/{table}_{year}.parquet
+    data/lake/exporter/patents/patents_ALL.parquet
+
+Normalisation per file:
+  - the in-file YEAR column (double) is dropped; YEAR comes from the partition
+    (the double-vs-dictionary clash is what breaks whole-bucket reads)
+  - APPLICATION_ID / PMID / PATENT_ID -> int64, FY / SUPPORT_YEAR -> int32
+  - projects rows are sorted by IC_NAME, ACTIVITY and written in small row
+    groups, so IC/activity filters skip row groups from their min/max stats
+
+Usage:
+  python3 scripts/nih_lake.py sync                          # all tables, all years
+  python3 scripts/nih_lake.py sync --tables projects abstracts --years 2020 2021
+  python3 scripts/nih_lake.py sync --source /mnt/exporter   # already-downloaded copy
+  python3 scripts/nih_lake.py info
+
+Query layer (predicate pushdown + column projection):
+  from nih_lake import query, lookup
+  df = query('projects', columns=['APPLICATION_ID', 'PROJECT_TITLE'],
+             years=range(2015, 2025), ics=['NATIONAL CANCER INSTITUTE'], activities=['R01'])
+  meta = lookup('projects', app_ids, columns=['NIH_SPENDING_CATS', 'PROJECT_TERMS', 'IC_NAME'])
+"""
+
+import argparse
+import glob
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+SOURCE = "gs://od-cl-odss-conroyri-nih-embeddings/exporter"
+LAKE_DIR = "data/lake/exporter"
+TABLES = ['projects', 'abstracts', 'linktables', 'patents']
+UNPARTITIONED = {'patents'}
+ROW_GROUP_SIZE = 20_000
+
+# Type fixes applied while normalising; everything else keeps its source type
+INT64_COLUMNS = {'APPLICATION_ID', 'PMID', 'PATENT_ID', 'SUBPROJECT_ID', 'SERIAL_NUMBER'}
+INT32_COLUMNS = {'FY', 'SUPPORT_YEAR', 'APPLICATION_TYPE'}
+SORT_KEYS = {'projects': ['IC_NAME', 'ACTIVITY', 'APPLICATION_ID'],
+             'abstracts': ['APPLICATION_ID']}
+
+
+def _write_json_atomic(path, obj):
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(obj, f, indent=2)
+    os.replace(tmp, path)
+
+
+def normalize_table(table, name):
+    """Drop the in-file YEAR column, fix key types and sort for stats pruning"""
+    if 'YEAR' in table.column_names:
+        table = table.drop(['YEAR'])
+
+    for i, field in enumerate(table.schema):
+        target = (pa.int64() if field.name in INT64_COLUMNS
+                  else pa.int32() if field.name in INT32_COLUMNS else None)
+        if target is None or field.type == target:
+            continue
+        col = table.column(i)
+        if pa.types.is_floating(field.type):
+            # ExPORTER ids come through pandas as float64; NaN means missing
+            col = pc.if_else(pc.is_nan(col), pa.scalar(None, field.type), col)
+        table = table.set_column(i, pa.field(field.name, target), pc.cast(col, target, safe=False))
+
+    keys = [k for k in SORT_KEYS.get(name, []) if k in table.column_names]
+    if keys:
+        table = table.sort_by([(k, 'ascending') for k in keys])
+    return table
+
+
+class ExporterLake:
+    """Local lake root plus the manifest of normalised source files"""
+
+    def __init__(self, root=LAKE_DIR):
+        self.root = root
+        self.raw_dir = os.path.join(root, '_raw')
+        self.manifest_path = os.path.join(root, '_manifest.json')
+        os.makedirs(root, exist_ok=True)
+
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+        else:
+            self.manifest = {'source': None, 'files': {}}
+
+    def table_path(self, table):
+        return os.path.join(self.root, table)
+
+    def output_path(self, table, year=None):
+        if year is None:
+            return os.path.join(self.root, table, f"{table}_ALL.parquet")
+        return os.path.join(self.root, table, f"YEAR={year}", f"{table}_{year}.parquet")
+
+    # Sync ------------------------------------------------------------------
+
+    def mirror(self, source, table):
+        """Copy {source}/{table}_parquet into the raw staging area (gsutil rsync for gs://)"""
+        src = f"{source.rstrip('/')}/{table}_parquet"
+        if not source.startswith('gs://'):
+            return src
+        dst = os.path.join(self.raw_dir, f"{table}_parquet")
+        os.makedirs(dst, exist_ok=True)
+        subprocess.run(['gsutil', '-m', 'rsync', '-r', src, dst], check=True)
+        return dst
+
+    def sync(self, source=SOURCE, tables=TABLES, years=None, force=False):
+        """
+        Mirror and normalise the given tables
+        Files whose size and mtime match the manifest are skipped.
+        Returns {table: rows written this run}.
+        """
+        written = {}
+        for table in tables:
+            src_dir = self.mirror(source, table)
+            files = sorted(glob.glob(os.path.join(src_dir, '**', '*.parquet'), recursive=True))
+            written[table] = 0
+            print(f"\n{table}: {len(files)} source files in {src_dir}")
+
+            for src in files:
+                match = re.search(r'YEAR=(\d{4})', src)
+                year = int(match.group(1)) if match and table not in UNPARTITIONED else None
+                if years and year is not None and year not in years:
+                    continue
+
+                stat = os.stat(src)
+                signature = {'size': stat.st_size, 'mtime': int(stat.st_mtime)}
+                out = self.output_path(table, year)
+                entry = self.manifest['files'].get(out)
+                if not force and entry and entry['source_signature'] == signature and os.path.exists(out):
+                    continue
+
+                start = time.time()
+                normalized = normalize_table(pq.read_table(src), table)
+                os.makedirs(os.path.dirname(out), exist_ok=True)
+                tmp = f"{out}.tmp"
+                pq.write_table(normalized, tmp, compression='snappy', row_group_size=ROW_GROUP_SIZE)
+                os.replace(tmp, out)
+
+                self.manifest['files'][out] = {
+                    'table': table,
+                    'year': year,
+                    'source': src,
+                    'source_signature': signature,
+                    'rows': normalized.num_rows,
+                    'synced_at': datetime.now().isoformat()
+                }
+                self.manifest['source'] = source
+                _write_json_atomic(self.manifest_path, self.manifest)
+                written[table] += normalized.num_rows
+                label = f"YEAR={year}" if year is not None else os.path.basename(out)
+                print(f"  ✓ {label}: {normalized.num_rows:,} rows ({time.time() - start:.1f}s)")
+        return written
+
+    # Queries ---------------------------------------------------------------
+
+    def dataset(self, table):
+        path = self.table_path(table)
+        if not os.path.isdir(path):
+            raise FileNotFoundError(f"{path} not found; run: python3 scripts/nih_lake.py sync --tables {table}")
+        if table in UNPARTITIONED:
+            return ds.dataset(path, format='parquet')
+        # Columns drift across ExPORTER years; unify from the footers instead of
+        # trusting whichever file pyarrow happens to open first
+        files = sorted(glob.glob(os.path.join(path, 'YEAR=*', '*.parquet')))
+        schema = pa.unify_schemas([pq.read_schema(f) for f in files], promote_options='permissive')
+        schema = schema.append(pa.field('YEAR', pa.int32()))
+        return ds.dataset(path, format='parquet', schema=schema, partitioning='hive')
+
+    def scan(self, table, columns=None, years=None, ics=None, activities=None,
+             app_ids=None, where=None):
+        """
+        Filtered, projected Arrow table
+        years prunes YEAR= partitions; ics / activities / app_ids are pushed
+        down to row-group statistics; `where` is any extra ds expression.
+        """
+        dataset = self.dataset(table)
+        names = set(dataset.schema.names)
+        predicates = []
+        if years is not None and 'YEAR' in names:
+            predicates.append(ds.field('YEAR').isin([int(y) for y in years]))
+        if ics is not None:
+            predicates.append(ds.field('IC_NAME').isin(list(ics)))
+        if activities is not None:
+            predicates.append(ds.field('ACTIVITY').isin(list(activities)))
+        if app_ids is not None:
+            predicates.append(ds.field('APPLICATION_ID').isin(pa.array(app_ids, type=pa.int64())))
+        if where is not None:
+            predicates.append(where)
+
+        expr = None
+        for p in predicates:
+            expr = p if expr is None else expr & p
+        return dataset.to_table(columns=columns, filter=expr)
+
+    def query(self, table, columns=None, **kwargs):
+        """scan() as a pandas DataFrame"""
+        return self.scan(table, columns=columns, **kwargs).to_pandas()
+
+    def lookup(self, table, app_ids, columns):
+        """
+        Rows for a list of APPLICATION_IDs (one per id), replacing
+        `WHERE CAST(APPLICATION_ID AS INT64) IN UNNEST(@app_ids)` queries
+        """
+        cols = ['APPLICATION_ID'] + [c for c in columns if c != 'APPLICATION_ID']
+        # Null ids (None / NaN) match no row: drop them before the int64 cast
+        ids = pc.drop_null(pa.array(list(app_ids), from_pandas=True)).cast(pa.int64())
+        df = self.query(table, columns=cols, app_ids=ids.to_pylist())
+        return df.drop_duplicates(subset=['APPLICATION_ID']).reset_index(drop=True)
+
+    def info(self):
+        rows = {}
+        for entry in self.manifest['files'].values():
+            rows.setdefault(entry['table'], []).append(entry)
+        return rows
+
+
+# Module-level helpers for scripts that just need the default lake --------------
+
+def query(table, columns=None, root=LAKE_DIR, **kwargs):
+    return ExporterLake(root).query(table, columns=columns, **kwargs)
+
+
+def lookup(table, app_ids, columns, root=LAKE_DIR):
+    return ExporterLake(root).lookup(table, app_ids, columns)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_sync = sub.add_parser('sync', help='Mirror and normalise ExPORTER tables')
+    p_sync.add_argument('--source', default=SOURCE, help='gs:// prefix or local directory with {table}_parquet/')
+    p_sync.add_argument('--tables', nargs='+', choices=TABLES, default=TABLES)
+    p_sync.add_argument('--years', nargs='+', type=int)
+    p_sync.add_argument('--force', action='store_true', help='Re-normalise unchanged files')
+
+    sub.add_parser('info', help='Summarise the local lake')
+    parser.add_argument('--lake-dir', default=LAKE_DIR)
+    args = parser.parse_args()
+
+    lake = ExporterLake(args.lake_dir)
+
+    if args.command == 'sync':
+        print(f"\n{'='*70}")
+        print(f"Syncing ExPORTER lake: {args.source} -> {args.lake_dir}")
+        print(f"{'='*70}")
+        start = time.time()
+        written = lake.sync(args.source, args.tables, set(args.years) if args.years else None, args.force)
+        print(f"\n✓ Sync complete in {time.time() - start:.1f}s")
+        for table, rows in written.items():
+            print(f"  {table}: {rows:,} rows written")
+        return 0
+
+    info = lake.info()
+    if not info:
+        print(f"Lake at {args.lake_dir} is empty; run: python3 scripts/nih_lake.py sync")
+        return 1
+    print(f"Lake: {args.lake_dir} (source: {lake.manifest['source']})")
+    for table, entries in sorted(info.items()):
+        years = sorted(e['year'] for e in entries if e['year'] is not None)
+        span = f"FY{years[0]}-{years[-1]}" if years else "unpartitioned"
+        print(f"  {table:<12} {sum(e['rows'] for e in entries):>12,} rows  {len(entries):>3} files  {span}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -14,6 +14,8 @@ import sys
 import os
 import gc
 
+import embedding_store
+
 print("=" * 70)
 print("OPTION D: HYBRID WEIGHT OPTIMIZATION (SAFE MODE)")
 print("=" * 70)
@@ -35,7 +37,7 @@ print(f"Embeddings: {embedding_file}")
 # Load with memory optimization
 print("\n[1/6] Loading data (memory-optimized)...")
 df_sample = pd.read_parquet(sample_file)
-df_embeddings = pd.read_parquet(embedding_file)
+store = embedding_store.open_embeddings(embedding_file)
 
 # Use smaller sample to prevent crashes
 MAX_SAMPLE = 20000  # Safe limit for clustering
@@ -44,20 +46,17 @@ if len(df_sample) > MAX_SAMPLE:
     print(f"  Sampling {MAX_SAMPLE:,} for optimization (prevents crashes)")
     df_sample = df_sample.sample(n=MAX_SAMPLE, random_state=42)
 
-df = df_sample.merge(df_embeddings, on='APPLICATION_ID', how='inner')
+# Only the sampled rows are read from the memory-mapped store
+found, embeddings = store.select(df_sample['APPLICATION_ID'])
+df = df_sample[found].reset_index(drop=True)
 print(f"  Working with: {len(df):,} grants")
 
 # Free memory
-del df_sample, df_embeddings
+del df_sample
 gc.collect()
 
 # Extract features
 print("\n[2/6] Extracting features...")
-if isinstance(df['embedding'].iloc[0], str):
-    embeddings = np.vstack(df['embedding'].apply(eval).values)
-else:
-    embeddings = np.vstack(df['embedding'].values)
-
 embeddings = StandardScaler().fit_transform(embeddings)
 print(f"  Embeddings: {embeddings.shape}")
 
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Parquet footer helpers shared by the loaders and catalog scripts
+Project: od-cl-odss-conroyri-f75a
+Everything here reads only the Parquet footer (a few KB at the end of each
+file, fetched with a range request on GCS), never the row data.
+
+  schema = read_schema('gs://.../projects_parquet/YEAR=1990/projects_1990.parquet')
+  target, conflicts = reconcile_schemas({1990: schema_1990, 1991: schema_1991, ...})
+  summary = summarize_footer(*read_footer(uri))   # rows, row groups, per-column min/max
+"""
+
+import datetime
+import decimal
+from concurrent.futures import ThreadPoolExecutor
+
+import pyarrow as pa
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
+
+
+def open_file(uri):
+    """Open a gs:// URI or local path for random access"""
+    fs, path = pafs.FileSystem.from_uri(uri) if '://' in uri else (pafs.LocalFileSystem(), uri)
+    return fs.open_input_file(path)
+
+
+def read_footer(uri):
+    """(FileMetaData, arrow schema) from the footer alone"""
+    with open_file(uri) as f:
+        pf = pq.ParquetFile(f)
+        return pf.metadata, pf.schema_arrow
+
+
+def read_schema(uri):
+    return read_footer(uri)[1]
+
+
+def read_footers(uris, workers=16):
+    """read_footer() for many files in parallel; failures come back as the exception"""
+    def one(uri):
+        try:
+            return read_footer(uri)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return dict(zip(uris, pool.map(one, uris)))
+
+
+def _json_value(value, max_len=100):
+    """Statistics value as something json.dump accepts"""
+    if isinstance(value, bytes):
+        value = value.decode('utf-8', errors='replace')
+    if isinstance(value, str):
+        return value[:max_len]
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    return value
+
+
+def column_stats(metadata):
+    """
+    Per-column min/max and null counts merged over all row groups
+    Columns without statistics in some row group get no min/max.
+    """
+    stats = {}
+    for rg in range(metadata.num_row_groups):
+        row_group = metadata.row_group(rg)
+        for j in range(row_group.num_columns):
+            chunk = row_group.column(j)
+            name = chunk.path_in_schema
+            entry = stats.setdefault(name, {'null_count': 0, 'min': None, 'max': None, 'complete': True})
+            st = chunk.statistics
+            if st is None:
+                entry['complete'] = False
+                continue
+            if st.has_null_count:
+                entry['null_count'] += st.null_count
+            if not st.has_min_max:
+                entry['complete'] = entry['complete'] and st.null_count == row_group.num_rows
+                continue
+            entry['min'] = st.min if entry['min'] is None else min(entry['min'], st.min)
+            entry['max'] = st.max if entry['max'] is None else max(entry['max'], st.max)
+
+    out = {}
+    for name, entry in stats.items():
+        out[name] = {'null_count': entry['null_count']}
+        if entry['complete'] and entry['min'] is not None:
+            out[name]['min'] = _json_value(entry['min'])
+            out[name]['max'] = _json_value(entry['max'])
+    return out
+
+
+def summarize_footer(metadata, schema):
+    """JSON-able file summary from the footer: rows, schema, row groups, column stats"""
+    return {
+        'rows': metadata.num_rows,
+        'row_groups': metadata.num_row_groups,
+        'columns': schema.names,
+        'column_count': len(schema.names),
+        'column_types': {f.name: str(f.type) for f in schema},
+        'created_by': metadata.created_by,
+        'column_stats': column_stats(metadata)
+    }
+
+
+def bq_type(arrow_type):
+    """BigQuery column type for an Arrow type (None for all-null columns)"""
+    if pa.types.is_dictionary(arrow_type):
+        arrow_type = arrow_type.value_type
+    if pa.types.is_null(arrow_type):
+        return None
+    if pa.types.is_boolean(arrow_type):
+        return 'BOOL'
+    if pa.types.is_integer(arrow_type):
+        return 'INT64'
+    if pa.types.is_floating(arrow_type):
+        return 'FLOAT64'
+    if pa.types.is_decimal(arrow_type):
+        return 'NUMERIC'
+    if pa.types.is_date(arrow_type):
+        return 'DATE'
+    if pa.types.is_timestamp(arrow_type):
+        return 'TIMESTAMP'
+    if pa.types.is_binary(arrow_type) or pa.types.is_large_binary(arrow_type):
+        return 'BYTES'
+    return 'STRING'
+
+
+def arrow_type_for(bq):
+    return {'BOOL': pa.bool_(), 'INT64': pa.int64(), 'FLOAT64': pa.float64(),
+            'NUMERIC': pa.decimal128(38, 9), 'DATE': pa.date32(),
+            'TIMESTAMP': pa.timestamp('us'), 'BYTES': pa.binary()}.get(bq, pa.string())
+
+
+def reconcile_schemas(schemas):
+    """
+    Reconciled target schema across files
+    `schemas` maps a key (e.g. year) to an arrow schema. Returns
+    (target, conflicts): target is an ordered {column: BigQuery type} using
+    the widest type seen (numeric types widen to FLOAT64, anything mixed
+    with text becomes STRING); conflicts maps each key to the columns whose
+    type in that file differs from the target, including all-null columns,
+    which pandas writes with a type BigQuery cannot load.
+    """
+    seen = {}
+    for schema in schemas.values():
+        for field in schema:
+            t = bq_type(field.type)
+            seen.setdefault(field.name, set())
+            if t:
+                seen[field.name].add(t)
+
+    target = {}
+    for name, types in seen.items():
+        if not types:
+            target[name] = 'STRING'
+        elif len(types) == 1:
+            target[name] = next(iter(types))
+        elif types <= {'BOOL', 'INT64', 'FLOAT64'}:
+            target[name] = 'FLOAT64' if 'FLOAT64' in types else 'INT64'
+        elif types <= {'DATE', 'TIMESTAMP'}:
+            target[name] = 'TIMESTAMP'
+        else:
+            target[name] = 'STRING'
+
+    conflicts = {}
+    for key, schema in schemas.items():
+        cols = [f.name for f in schema if bq_type(f.type) != target[f.name]]
+        if cols:
+            conflicts[key] = cols
+    return target, conflicts
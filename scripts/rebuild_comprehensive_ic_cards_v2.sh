@@ -1,13 +1,22 @@
 #!/bin/bash
 set -e
 
+# LOCAL=1 runs the same SQL on DuckDB over the local Parquet lake (local_sql.py)
+run_sql() {
+  if [ "${LOCAL:-0}" = "1" ]; then
+    python3 "$(dirname "$0")/local_sql.py" run -
+  else
+    bq query --use_legacy_sql=false
+  fi
+}
+
 echo "=========================================="
 echo "REBUILDING IC CARDS - COMPLETE PORTFOLIO"
 echo "Using grant_scorecard_v2 (correct schema)"
 echo "=========================================="
 echo ""
 
-bq query --use_legacy_sql=false << 'EOSQL'
+run_sql << 'EOSQL'
 CREATE OR REPLACE TABLE `od-cl-odss-conroyri-f75a.nih_analytics.ic_cards_comprehensive` AS
 WITH base_metrics AS (
   SELECT
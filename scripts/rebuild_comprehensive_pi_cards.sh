@@ -1,13 +1,22 @@
 #!/bin/bash
 set -e
 
+# LOCAL=1 runs the same SQL on DuckDB over the local Parquet lake (local_sql.py)
+run_sql() {
+  if [ "${LOCAL:-0}" = "1" ]; then
+    python3 "$(dirname "$0")/local_sql.py" run -
+  else
+    bq query --use_legacy_sql=false
+  fi
+}
+
 echo "=========================================="
 echo "REBUILDING PI CARDS - COMPREHENSIVE"
 echo "Using grant_scorecard_v2 (ALL award types)"
 echo "=========================================="
 echo ""
 
-bq query --use_legacy_sql=false << 'EOSQL'
+run_sql << 'EOSQL'
 CREATE OR REPLACE TABLE `od-cl-odss-conroyri-f75a.nih_analytics.pi_cards_comprehensive` AS
 WITH pi_base AS (
   SELECT
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+Shared RePORTER API client for the ingestion scripts
+Project: od-cl-odss-conroyri-f75a
+Pooled HTTP session, shared token-bucket rate limiter, retries and
+throughput stats (requests/sec, records/sec, tail latency), plus a
+partitioning planner that splits criteria below the 15K offset limit
+"""
+
+import threading
+import time
+from datetime import date, timedelta
+
+import requests
+from requests.adapters import HTTPAdapter
+
+API_BASE_URL = "https://api.reporter.nih.gov/v2/projects/search"
+
+# RePORTER refuses offsets above 14,999, so one criteria set can return at
+# most 15,000 records (offset 14,500 + limit 500)
+MAX_OFFSET = 14999
+MAX_SLICE_RECORDS = MAX_OFFSET + 1
+
+# Split dimensions for oversized slices, tried in this order
+SPLIT_AGENCIES = [
+    "NCI", "NHLBI", "NIAID", "NIGMS", "NIDDK", "NINDS", "NIMH", "NIA",
+    "NICHD", "NIDA", "NIEHS", "NEI", "NIAMS", "NIAAA", "NIBIB", "NIDCR",
+    "NIDCD", "NINR", "NHGRI", "NLM", "NIMHD", "NCCIH", "NCATS", "FIC",
+    "OD", "CIT", "CLC", "NCRR", "AHRQ", "CDC", "FDA", "HRSA", "SAMHSA",
+    "VA", "ACF", "ACL", "IHS"
+]
+
+SPLIT_ACTIVITY_CODES = [
+    "R01", "R03", "R15", "R21", "R33", "R34", "R35", "R37", "R41", "R42",
+    "R43", "R44", "R56", "R61", "RF1", "RM1", "R00", "R13", "R24", "R25",
+    "R18", "R38", "R50", "DP1", "DP2", "DP5", "UG1", "UG3", "UH2", "UH3",
+    "U01", "U10", "U19", "U24", "U2C", "U54", "UM1", "U42", "U45", "U18",
+    "P01", "P20", "P30", "P41", "P50", "P51", "P60", "F30", "F31", "F32",
+    "F33", "F99", "K01", "K02", "K07", "K08", "K12", "K22", "K23", "K24",
+    "K25", "K26", "K43", "K76", "K99", "KL2", "T15", "T32", "T34", "T35",
+    "T90", "TL1", "TL4", "D43", "D71", "G20", "S06", "S10", "S21", "SC1",
+    "UL1", "ZIA", "ZIB", "ZIC", "ZIE", "ZIH", "ZID", "N01", "N02", "N43",
+    "N44", "OT2", "OT3", "C06", "G12", "U13", "R36", "UC7", "X01", "Z01"
+]
+
+# Status codes worth retrying (throttling and transient server errors)
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket shared by every worker
+    Allows short bursts up to `burst` requests, then `rate` requests/sec
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst if burst is not None else max(1.0, self.rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, tokens=1):
+        """Block until `tokens` are available, then take them"""
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def try_acquire(self, tokens=1):
+        """Take `tokens` if available right now; never blocks"""
+        with self.lock:
+            self._refill()
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return True
+            return False
+
+
+class FetchStats:
+    """Thread-safe request/record counters for throughput reporting"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.requests = 0
+        self.records = 0
+        self.retries = 0
+        self.errors = 0
+        self.latencies = []
+
+    def record(self, latency, n_records):
+        with self.lock:
+            self.requests += 1
+            self.records += n_records
+            self.latencies.append(latency)
+
+    def add_retry(self):
+        with self.lock:
+            self.retries += 1
+
+    def add_error(self):
+        with self.lock:
+            self.errors += 1
+
+    def add_records(self, n_records):
+        with self.lock:
+            self.records += n_records
+
+    def summary(self):
+        """Return a dict of throughput and latency figures"""
+        def pct(latencies, p):
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+
+        # One consistent snapshot: worker threads keep updating the counters
+        with self.lock:
+            elapsed = max(time.time() - self.start, 1e-9)
+            latencies = sorted(self.latencies)
+            return {
+                'elapsed_sec': elapsed,
+                'requests': self.requests,
+                'records': self.records,
+                'retries': self.retries,
+                'errors': self.errors,
+                'requests_per_sec': self.requests / elapsed,
+                'records_per_sec': self.records / elapsed,
+                'latency_p50': pct(latencies, 0.50),
+                'latency_p95': pct(latencies, 0.95),
+                'latency_p99': pct(latencies, 0.99),
+            }
+
+    def report(self, label="Throughput"):
+        s = self.summary()
+        print(f"  {label}: {s['requests']:,} requests, {s['records']:,} records "
+              f"in {s['elapsed_sec']:.1f}s")
+        print(f"    {s['requests_per_sec']:.2f} requests/sec, "
+              f"{s['records_per_sec']:.1f} records/sec")
+        print(f"    latency p50={s['latency_p50']:.2f}s p95={s['latency_p95']:.2f}s "
+              f"p99={s['latency_p99']:.2f}s, retries={s['retries']}, errors={s['errors']}")
+
+
+class ReporterClient:
+    """
+    RePORTER search client safe to share across worker threads
+    One pooled session sized to the concurrency, one rate limiter for all
+    """
+
+    def __init__(self, api_url=API_BASE_URL, concurrency=8, rate=3.0,
+                 max_retries=5, timeout=60):
+        self.api_url = api_url
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.limiter = TokenBucket(rate, burst=concurrency)
+        self.stats = FetchStats()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def search(self, payload):
+        """
+        POST one search payload and return the decoded JSON
+        Retries throttling, 5xx and connection errors with exponential backoff
+        """
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire()
+            t0 = time.time()
+            try:
+                response = self.session.post(self.api_url, json=payload, timeout=self.timeout)
+                if response.status_code in RETRY_STATUS:
+                    retry_after = response.headers.get('Retry-After', '')
+                    if retry_after.replace('.', '', 1).isdigit():
+                        raise _RetryAfter(float(retry_after))
+                    raise requests.exceptions.RetryError(f"HTTP {response.status_code}")
+                response.raise_for_status()
+                data = response.json()
+                self.stats.record(time.time() - t0, len(data.get('results', [])))
+                return data
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout,
+                    requests.exceptions.RetryError,
+                    _RetryAfter) as e:
+                if attempt == self.max_retries:
+                    self.stats.add_error()
+                    raise
+                self.stats.add_retry()
+                delay = e.delay if isinstance(e, _RetryAfter) else min(30, 0.5 * 2 ** attempt)
+                time.sleep(delay)
+            except requests.exceptions.RequestException:
+                self.stats.add_error()
+                raise
+
+    def close(self):
+        self.session.close()
+
+
+class _RetryAfter(Exception):
+    """Server asked us to back off for an explicit number of seconds"""
+
+    def __init__(self, delay):
+        super().__init__(f"Retry-After {delay}s")
+        self.delay = delay
+
+
+def count_records(client, criteria):
+    """meta.total for a criteria set, using a one-record probe"""
+    data = client.search({"criteria": criteria, "offset": 0, "limit": 1})
+    return data.get("meta", {}).get("total", 0)
+
+
+def _date_range(criteria):
+    """Current award_notice_date range, or a generous default around the FY"""
+    if "award_notice_date" in criteria:
+        rng = criteria["award_notice_date"]
+        return date.fromisoformat(rng["from_date"]), date.fromisoformat(rng["to_date"])
+    years = criteria.get("fiscal_years")
+    if not years:
+        return None
+    return date(min(years) - 3, 1, 1), date(max(years), 12, 31)
+
+
+def split_candidates(criteria):
+    """
+    Yield (dimension, child criteria list) for each way of splitting `criteria`
+    IC first, then award notice date bisection, then activity code
+    """
+    if "agencies" not in criteria:
+        yield "ic", [dict(criteria, agencies=[ic]) for ic in SPLIT_AGENCIES]
+
+    rng = _date_range(criteria)
+    if rng and rng[0] < rng[1]:
+        start, end = rng
+        mid = start + (end - start) // 2
+        yield "award_notice_date", [
+            dict(criteria, award_notice_date={"from_date": start.isoformat(),
+                                              "to_date": mid.isoformat()}),
+            dict(criteria, award_notice_date={"from_date": (mid + timedelta(days=1)).isoformat(),
+                                              "to_date": end.isoformat()}),
+        ]
+
+    if "activity_codes" not in criteria:
+        yield "activity_code", [dict(criteria, activity_codes=[code])
+                                for code in SPLIT_ACTIVITY_CODES]
+
+
+def plan_slices(client, pool, criteria, total=None, limit=MAX_SLICE_RECORDS, depth=0):
+    """
+    Recursively split `criteria` until every slice's meta.total is <= limit
+    Count probes for each candidate split run in parallel on `pool`. A split
+    is accepted when its children's totals cover the parent total; otherwise
+    the next dimension is tried, falling back to the best partial split.
+    IC/activity splits where one child is as large as the parent are skipped;
+    a date bisection always narrows the range, so it is kept.
+    Returns a list of {'criteria', 'total', 'complete'} dicts.
+    """
+    if total is None:
+        total = count_records(client, criteria)
+    if total <= limit:
+        return [{"criteria": criteria, "total": total, "complete": True}] if total else []
+
+    best = None
+    for dimension, children in split_candidates(criteria):
+        child_totals = list(pool.map(lambda c: count_records(client, c), children))
+        if dimension != "award_notice_date" and max(child_totals, default=0) >= total:
+            continue  # no child is smaller than the parent: no progress
+        covered = sum(child_totals)
+        if best is None or covered > best[2]:
+            best = (dimension, list(zip(children, child_totals)), covered)
+        if covered >= total:
+            break
+
+    indent = "    " * (depth + 1)
+    if best is None:
+        print(f"{indent}⚠ Cannot split slice of {total:,} further; "
+              f"only {limit:,} records reachable")
+        return [{"criteria": criteria, "total": total, "complete": False}]
+
+    dimension, children, covered = best
+    nonempty = [(c, t) for c, t in children if t > 0]
+    if len(nonempty) == 1 and covered >= total:
+        # Date bisection that only narrowed the range: keep bisecting quietly
+        child, child_total = nonempty[0]
+        return plan_slices(client, pool, child, total=child_total, limit=limit, depth=depth)
+    print(f"{indent}Split {total:,} records by {dimension} into {len(nonempty)} slices")
+    if covered < total:
+        print(f"{indent}⚠ Split by {dimension} only covers {covered:,} of {total:,} records")
+
+    slices = []
+    for child, child_total in nonempty:
+        slices.extend(plan_slices(client, pool, child, total=child_total,
+                                  limit=limit, depth=depth + 1))
+    return slices
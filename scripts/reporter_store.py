@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Checkpointed Parquet store for RePORTER downloads
+Project: od-cl-odss-conroyri-f75a
+Every fetched page is written as a Parquet fragment and recorded in a
+manifest, so a restarted run skips pages that already completed. Completed
+pages are appended to _fragments.jsonl, one line each, and folded into
+_manifest.json whenever the manifest itself is saved. Fragments
+are then compacted (de-duplicated on appl_id) into a YEAR=-partitioned
+dataset with typed columns:
+
+    data/raw/reporter/{kind}/YEAR={year}/{kind}_{year}.parquet
+
+Later stages read it with column pruning via read_dataset().
+Delta runs add fragments for changed records only; compaction keeps the
+latest fetch per appl_id, which makes them an upsert. The per-year
+high-water mark used to select changed records is kept in the manifest.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime, timezone
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+STORE_DIR = "data/raw/reporter"
+
+# Column typing rules for flattened RePORTER records; anything else is a string
+INT_COLUMNS = {'appl_id', 'fiscal_year'}
+FLOAT_COLUMNS = {'award_amount', 'direct_cost_amt', 'indirect_cost_amt'}
+BOOL_COLUMNS = {'is_active', 'is_new'}
+TIMESTAMP_COLUMNS = {'budget_start', 'budget_end', 'date_added'}
+
+
+def _column_type(name):
+    if name in INT_COLUMNS:
+        return pa.int64()
+    if name in FLOAT_COLUMNS:
+        return pa.float64()
+    if name in BOOL_COLUMNS:
+        return pa.bool_()
+    if name in TIMESTAMP_COLUMNS or name.endswith('_date') or name == '_fetched_at':
+        return pa.timestamp('us')
+    return pa.string()
+
+
+def _flatten(record):
+    """One level of dict flattening (organization.org_name -> organization_org_name)"""
+    flat = {}
+    for key, value in record.items():
+        if isinstance(value, dict):
+            for sub_key, sub_value in value.items():
+                flat[f"{key}_{sub_key}"] = sub_value
+        else:
+            flat[key] = value
+    return flat
+
+
+def records_to_table(records):
+    """Convert RePORTER JSON records to a typed Arrow table"""
+    df = pd.DataFrame([_flatten(r) for r in records])
+    df['_fetched_at'] = datetime.now(timezone.utc).replace(tzinfo=None)
+
+    arrays = []
+    fields = []
+    for name in sorted(df.columns):
+        col = df[name]
+        pa_type = _column_type(name)
+        if pa.types.is_timestamp(pa_type):
+            col = pd.to_datetime(col, errors='coerce', utc=True, format='ISO8601').dt.tz_localize(None)
+        elif pa.types.is_integer(pa_type):
+            col = pd.to_numeric(col, errors='coerce').astype('Int64')
+        elif pa.types.is_floating(pa_type):
+            col = pd.to_numeric(col, errors='coerce')
+        elif pa.types.is_string(pa_type):
+            col = col.map(lambda v: None if v is None or (isinstance(v, float) and pd.isna(v))
+                          else json.dumps(v) if isinstance(v, (list, dict)) else str(v))
+        arrays.append(pa.array(col, type=pa_type, from_pandas=True))
+        fields.append(pa.field(name, pa_type))
+
+    return pa.Table.from_arrays(arrays, schema=pa.schema(fields))
+
+
+def _write_json_atomic(path, obj):
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(obj, f, indent=2)
+    os.replace(tmp, path)
+
+
+class ReporterStore:
+    """
+    Fragment store plus manifest for one download root
+    Thread-safe: workers may write fragments concurrently.
+    """
+
+    def __init__(self, root=STORE_DIR):
+        self.root = root
+        self.manifest_path = os.path.join(root, '_manifest.json')
+        self.journal_path = os.path.join(root, '_fragments.jsonl')
+        self.lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+        else:
+            self.manifest = {'plans': {}, 'fragments': {}}
+        self.manifest.setdefault('sync', {})
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # line cut short by a crash: that page is fetched again
+                    self.manifest['fragments'][entry.pop('key')] = entry
+
+    @staticmethod
+    def page_key(kind, criteria, offset, plan_key=None):
+        """Stable key for one page of one slice within a plan"""
+        raw = json.dumps({'kind': kind, 'criteria': criteria, 'offset': offset,
+                          'plan': plan_key}, sort_keys=True)
+        return hashlib.sha1(raw.encode()).hexdigest()[:16]
+
+    def fragment_path(self, kind, fiscal_year, key):
+        return os.path.join(self.root, '_fragments', kind, f"YEAR={fiscal_year}", f"{key}.parquet")
+
+    def dataset_path(self, kind, fiscal_year):
+        return os.path.join(self.root, kind, f"YEAR={fiscal_year}", f"{kind}_{fiscal_year}.parquet")
+
+    def _save_manifest(self):
+        # Folds the journal in; a crash before the truncate only replays entries already saved
+        _write_json_atomic(self.manifest_path, self.manifest)
+        open(self.journal_path, 'w').close()
+
+    # Slice plans -----------------------------------------------------------
+
+    def get_plan(self, plan_key):
+        return self.manifest['plans'].get(plan_key)
+
+    def save_plan(self, plan_key, plan):
+        with self.lock:
+            self.manifest['plans'][plan_key] = plan
+            self._save_manifest()
+
+    # Delta sync state ------------------------------------------------------
+
+    def get_high_water_mark(self, fiscal_year, field):
+        """Last synced value of `field` for a fiscal year (ISO string), or None"""
+        state = self.get_sync_state(fiscal_year, field)
+        return state['high_water_mark'] if state else None
+
+    def get_sync_state(self, fiscal_year, field):
+        state = self.manifest['sync'].get(str(fiscal_year))
+        if state and state['field'] == field:
+            return state
+        return None
+
+    def update_high_water_mark(self, fiscal_year, field):
+        """Record max(`field`) of the compacted projects as the year's high-water mark"""
+        path = self.dataset_path('projects', fiscal_year)
+        if not os.path.exists(path) or field not in pq.read_schema(path).names:
+            return None
+        hwm = pc.max(pq.read_table(path, columns=[field])[field]).as_py()
+        if hwm is None:
+            return None
+        with self.lock:
+            self.manifest['sync'][str(fiscal_year)] = {
+                'field': field,
+                'high_water_mark': hwm.isoformat(),
+                'synced_at': datetime.now().isoformat()
+            }
+            self._save_manifest()
+        return hwm.isoformat()
+
+    # Fragments -------------------------------------------------------------
+
+    def is_done(self, key):
+        return key in self.manifest['fragments']
+
+    def write_fragment(self, kind, fiscal_year, key, records):
+        """Persist one page of records and mark it complete in the fragment journal"""
+        path = self.fragment_path(kind, fiscal_year, key)
+        if records:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.tmp"
+            pq.write_table(records_to_table(records), tmp, compression='snappy')
+            os.replace(tmp, path)
+
+        entry = {
+            'kind': kind,
+            'year': fiscal_year,
+            'rows': len(records),
+            'path': path if records else None,
+            'completed_at': datetime.now().isoformat()
+        }
+        with self.lock:
+            self.manifest['fragments'][key] = entry
+            with open(self.journal_path, 'a') as f:
+                f.write(json.dumps(dict(entry, key=key)) + '\n')
+        return len(records)
+
+    def fragment_ids(self, key):
+        """appl_ids stored in a completed fragment"""
+        entry = self.manifest['fragments'][key]
+        if not entry['path']:
+            return []
+        return pq.read_table(entry['path'], columns=['appl_id'])['appl_id'].to_pylist()
+
+    def fragments_for(self, kind, fiscal_year):
+        return [e['path'] for e in self.manifest['fragments'].values()
+                if e['kind'] == kind and e['year'] == fiscal_year and e['path']]
+
+    # Compaction and reads --------------------------------------------------
+
+    def compact(self, kind, fiscal_year):
+        """
+        Merge a year's fragments into {kind}/YEAR={year}/{kind}_{year}.parquet
+        Rows are de-duplicated on appl_id, keeping the most recently fetched.
+        Returns (path, rows) or (None, 0) if there is nothing to write.
+        """
+        paths = self.fragments_for(kind, fiscal_year)
+        if not paths:
+            return None, 0
+
+        table = pa.concat_tables([pq.read_table(p) for p in paths], promote_options='default')
+        df = table.to_pandas()
+        df = (df.sort_values('_fetched_at', kind='stable')
+                .drop_duplicates(subset=['appl_id'], keep='last')
+                .sort_values('appl_id'))
+        out = pa.Table.from_pandas(df, schema=table.schema, preserve_index=False)
+
+        path = self.dataset_path(kind, fiscal_year)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.tmp"
+        pq.write_table(out, tmp, compression='snappy')
+        os.replace(tmp, path)
+        return path, out.num_rows
+
+    def read_dataset(self, kind, columns=None, years=None):
+        """
+        Read the compacted {kind} dataset with column pruning
+        `years` filters on the YEAR= partition without opening other years.
+        """
+        dataset = ds.dataset(os.path.join(self.root, kind), format='parquet', partitioning='hive')
+        flt = ds.field('YEAR').isin(list(years)) if years else None
+        return dataset.to_table(columns=columns, filter=flt)
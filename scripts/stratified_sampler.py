@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+Single-pass stratified sampler
+Project: od-cl-odss-conroyri-f75a
+Replaces one `ORDER BY RAND() LIMIT n` query per (FY, IC_NAME) stratum with:
+  1. one stats pass (stratum sizes) -> allocate_quotas()
+  2. one scan that keeps, in every stratum, the `quota` grants with the
+     smallest hash rank
+
+The rank is a hash of (APPLICATION_ID, seed), so a given seed always picks
+the same grants, regardless of scan order or partitioning. The lake backend
+and the SQL backend use different hash functions (splitmix64 vs
+FARM_FINGERPRINT), so each is deterministic on its own but they do not
+select the same grants.
+
+  from stratified_sampler import sample_lake
+  sample, quotas = sample_lake(ExporterLake(), 100_000, seed=42, columns=[...])
+
+Nested samples (create_nested_samples.py) use nested_order(): one
+stratified permutation whose every prefix is itself proportionally
+stratified, so the 25k sample is the first 25k rows of the 50k sample, and
+so on. split_cached() lets a stage reuse per-grant outputs already computed
+for a smaller sample and process only the new rows.
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as ds
+
+STRATA = ['FY', 'IC_NAME']
+FY_RANGE = (1990, 2024)
+OVERSAMPLE_WARN = 0.95  # Warn when a stratum needs more than this share of its grants
+OVERSAMPLE_CAP = 0.9    # ...and cap such strata at this share
+NESTED_SIZES = [25_000, 50_000, 100_000, 250_000]
+
+_MASK64 = np.uint64(0xFFFFFFFFFFFFFFFF)
+
+
+def hash_rank(app_ids, seed):
+    """
+    Deterministic 64-bit rank per APPLICATION_ID (splitmix64 of id ^ seed)
+    Sorting by rank gives a seed-specific uniform random permutation.
+    """
+    x = np.asarray(app_ids, dtype=np.int64).astype(np.uint64)
+    with np.errstate(over='ignore'):
+        x = x ^ np.uint64(seed * 0x9E3779B97F4A7C15 & 0xFFFFFFFFFFFFFFFF)
+        x = (x + np.uint64(0x9E3779B97F4A7C15)) & _MASK64
+        x = ((x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)) & _MASK64
+        x = ((x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)) & _MASK64
+        x = x ^ (x >> np.uint64(31))
+    return x
+
+
+def allocate_quotas(stats_df, sample_size, strata=STRATA, verbose=True):
+    """
+    Proportional allocation over strata with the small-stratum cap
+    stats_df has one row per stratum with an `n_grants` column. Returns a copy
+    with `target_sample` summing to exactly `sample_size`.
+    """
+    stats_df = stats_df.copy()
+    total_grants = stats_df['n_grants'].sum()
+    stats_df['target_sample'] = np.ceil(
+        stats_df['n_grants'] / total_grants * sample_size
+    ).astype(int)
+
+    stats_df['sample_rate'] = stats_df['target_sample'] / stats_df['n_grants']
+    oversample = stats_df[stats_df['sample_rate'] > OVERSAMPLE_WARN]
+    if len(oversample) > 0:
+        if verbose:
+            print(f"  WARNING: {len(oversample)} strata require >{OVERSAMPLE_WARN:.0%} sampling:")
+            print(oversample[strata + ['n_grants', 'target_sample']].head(10))
+            print("  Adjusting sample allocation...")
+        capped = stats_df['sample_rate'] > OVERSAMPLE_CAP
+        stats_df.loc[capped, 'target_sample'] = (stats_df.loc[capped, 'n_grants'] * OVERSAMPLE_CAP).astype(int)
+
+    # Normalize to exactly sample_size
+    adjustment = sample_size / stats_df['target_sample'].sum()
+    stats_df['target_sample'] = (stats_df['target_sample'] * adjustment).round().astype(int)
+
+    # Final adjustment to hit exact count: add/subtract from largest strata
+    diff = sample_size - stats_df['target_sample'].sum()
+    if diff != 0:
+        largest_idx = stats_df.nlargest(abs(diff), 'n_grants').index
+        stats_df.loc[largest_idx, 'target_sample'] += np.sign(diff)
+
+    stats_df['target_sample'] = stats_df['target_sample'].clip(lower=0, upper=stats_df['n_grants'])
+    return stats_df
+
+
+def select_by_rank(frame, quotas, strata=STRATA, rank_col='_rank'):
+    """Rows whose within-stratum rank position is below the stratum's target_sample"""
+    frame = frame.sort_values(strata + [rank_col], kind='stable')
+    position = frame.groupby(strata, sort=False).cumcount()
+    target = frame[strata].merge(quotas[strata + ['target_sample']], on=strata, how='left')['target_sample']
+    keep = position.to_numpy() < target.fillna(0).to_numpy()
+    return frame[keep]
+
+
+def nested_order(narrow, strata=STRATA, rank_col='_rank'):
+    """
+    Stratified permutation: sort by (within-stratum position + 0.5) / stratum size
+    Grant r of a stratum of size n sits at fraction (r + 0.5) / n of the
+    order, so any prefix of m rows holds m * n / N grants of that stratum,
+    +/- 1. Ties break on the hash rank. Adds `sample_position` (0-based).
+    """
+    frame = narrow.sort_values(strata + [rank_col], kind='stable')
+    grouped = frame.groupby(strata, sort=False)
+    frame = frame.assign(_key=(grouped.cumcount() + 0.5) / grouped[rank_col].transform('size'))
+    frame = frame.sort_values(['_key', rank_col], kind='stable').drop(columns='_key')
+    frame['sample_position'] = np.arange(len(frame), dtype=np.int64)
+    return frame.reset_index(drop=True)
+
+
+def cache_metadata(path):
+    """
+    What produced a cache file: its {path}.json sidecar, else the manifest of
+    the embedding store it was exported from (text_recipe read as text_column);
+    None when neither exists
+    """
+    from embedding_store import manifest_path, store_prefix
+
+    sidecar = f"{path}.json"
+    if os.path.exists(sidecar):
+        with open(sidecar) as f:
+            return json.load(f)
+    manifest = manifest_path(store_prefix(path))
+    if os.path.exists(manifest):
+        with open(manifest) as f:
+            meta = json.load(f)
+        return dict(meta, text_column=meta.get('text_recipe'))
+    return None
+
+
+def split_cached(sample, cache_paths, key='APPLICATION_ID', columns=None, expect=None):
+    """
+    Reuse per-grant artifacts computed for other (nested) samples
+    Reads each existing Parquet in `cache_paths` and returns (cached, missing):
+    cached holds the cache rows for ids in `sample` (first file wins), missing
+    the sample rows that still need computing. With `expect` (e.g. model name
+    and text column for embeddings), a cache file is skipped unless every item
+    matches its cache_metadata(); a file with no metadata is skipped too.
+    """
+    ids = set(sample[key])
+    cached = []
+    for path in cache_paths or []:
+        if not os.path.exists(path):
+            print(f"  Skipping cache {path}: not found")
+            continue
+        if expect:
+            meta = cache_metadata(path)
+            if meta is None:
+                print(f"  Skipping cache {path}: no {path}.json sidecar or store manifest to check {expect}")
+                continue
+            mismatched = {k: meta.get(k) for k, v in expect.items() if meta.get(k) != v}
+            if mismatched:
+                print(f"  Skipping cache {path}: {mismatched} != {expect}")
+                continue
+        part = pd.read_parquet(path, columns=columns)
+        part = part[part[key].isin(ids)]
+        ids -= set(part[key])
+        cached.append(part)
+        print(f"  Reusing {len(part):,} rows from {path}")
+
+    cached = pd.concat(cached, ignore_index=True) if cached else pd.DataFrame(columns=columns or [key])
+    missing = sample[sample[key].isin(ids)]
+    return cached, missing
+
+
+# Local lake backend -------------------------------------------------------------
+
+def population_where(fy_range=FY_RANGE):
+    """Population filter shared by the stats pass and the sampling scan"""
+    return (ds.field('FY').isin(list(range(fy_range[0], fy_range[1] + 1)))
+            & ds.field('APPLICATION_ID').is_valid()
+            & ds.field('PROJECT_TITLE').is_valid()
+            & ds.field('IC_NAME').is_valid())
+
+
+def lake_stats(lake, strata=STRATA, fy_range=FY_RANGE, seed=None):
+    """
+    Stats pass over the lake: stratum sizes plus funding
+    Only the stratum columns, APPLICATION_ID and TOTAL_COST are read. With a
+    seed, also returns the narrow frame with hash ranks for select_by_rank().
+    """
+    narrow = lake.scan(
+        'projects', columns=['APPLICATION_ID', 'TOTAL_COST'] + strata,
+        years=range(fy_range[0], fy_range[1] + 1), where=population_where(fy_range)
+    ).to_pandas()
+    stats_df = (narrow.groupby(strata)
+                .agg(n_grants=('APPLICATION_ID', 'size'), total_funding=('TOTAL_COST', 'sum'))
+                .reset_index().sort_values(strata).reset_index(drop=True))
+    if seed is not None:
+        narrow['_rank'] = hash_rank(narrow['APPLICATION_ID'].to_numpy(), seed)
+    return stats_df, narrow
+
+
+def sample_lake(lake, sample_size, seed, columns, strata=STRATA, fy_range=FY_RANGE, verbose=True):
+    """
+    Stratified sample from the local lake in one stats pass and one scan
+    Returns (sample DataFrame, quota DataFrame).
+    """
+    stats_df, narrow = lake_stats(lake, strata, fy_range, seed=seed)
+    quotas = allocate_quotas(stats_df, sample_size, strata, verbose=verbose)
+    chosen = select_by_rank(narrow, quotas, strata)
+
+    # Fetch the full rows for the chosen ids only (APPLICATION_ID pushdown)
+    sample = lake.lookup('projects', chosen['APPLICATION_ID'], columns=columns)
+    sample = sample.merge(chosen[['APPLICATION_ID', '_rank']], on='APPLICATION_ID')
+    sample = sample.sort_values(strata + ['_rank']).drop(columns='_rank').reset_index(drop=True)
+    return sample, quotas
+
+
+def nested_lake(lake, max_size, seed, strata=STRATA, fy_range=FY_RANGE):
+    """First `max_size` rows of the nested stratified order over the lake population"""
+    _, narrow = lake_stats(lake, strata, fy_range, seed=seed)
+    order = nested_order(narrow[['APPLICATION_ID', '_rank'] + strata], strata)
+    return order.head(max_size).drop(columns='_rank')
+
+
+# SQL backend ----------------------------------------------------------------------
+
+def stats_sql(table, strata=STRATA, fy_range=FY_RANGE):
+    group = ', '.join(strata)
+    return f"""
+SELECT
+  {group},
+  COUNT(*) as n_grants,
+  SUM(TOTAL_COST) as total_funding
+FROM `{table}`
+WHERE FY BETWEEN {fy_range[0]} AND {fy_range[1]}
+  AND PROJECT_TITLE IS NOT NULL
+  AND IC_NAME IS NOT NULL
+GROUP BY {group}
+ORDER BY {group}
+"""
+
+
+def sample_sql(table, quotas, seed, columns, fy_range=FY_RANGE):
+    """
+    One BigQuery statement that draws every (FY, IC_NAME) stratum in one scan
+    Quotas are passed as three aligned array parameters; returns
+    (sql, [(name, type, values), ...]) for bigquery.ArrayQueryParameter.
+    """
+    select = ',\n  '.join(f"p.{c}" for c in columns)
+    sql = f"""
+WITH quotas AS (
+  SELECT fy AS FY, @quota_ics[OFFSET(i)] AS IC_NAME, @quota_targets[OFFSET(i)] AS quota
+  FROM UNNEST(@quota_fys) AS fy WITH OFFSET i
+)
+SELECT
+  {select}
+FROM `{table}` p
+JOIN quotas q ON p.FY = q.FY AND p.IC_NAME = q.IC_NAME
+WHERE p.FY BETWEEN {fy_range[0]} AND {fy_range[1]}
+  AND p.PROJECT_TITLE IS NOT NULL
+QUALIFY ROW_NUMBER() OVER (
+  PARTITION BY p.FY, p.IC_NAME
+  ORDER BY FARM_FINGERPRINT(CONCAT(CAST(CAST(p.APPLICATION_ID AS INT64) AS STRING), ':', '{int(seed)}'))
+) <= q.quota
+"""
+    active = quotas[quotas['target_sample'] > 0]
+    params = [
+        ('quota_fys', 'FLOAT64', [float(v) for v in active['FY']]),
+        ('quota_ics', 'STRING', [str(v) for v in active['IC_NAME']]),
+        ('quota_targets', 'INT64', [int(v) for v in active['target_sample']]),
+    ]
+    return sql, params
+
+
+def nested_sql(table, max_size, seed, columns, fy_range=FY_RANGE):
+    """One BigQuery statement returning the nested stratified order (see nested_order)"""
+    select = ',\n  '.join(f"p.{c}" for c in columns)
+    return f"""
+WITH ranked AS (
+  SELECT
+    p.*,
+    FARM_FINGERPRINT(CONCAT(CAST(CAST(p.APPLICATION_ID AS INT64) AS STRING), ':', '{int(seed)}')) AS _rank
+  FROM `{table}` p
+  WHERE p.FY BETWEEN {fy_range[0]} AND {fy_range[1]}
+    AND p.PROJECT_TITLE IS NOT NULL
+    AND p.IC_NAME IS NOT NULL
+),
+keyed AS (
+  SELECT
+    p.*,
+    (ROW_NUMBER() OVER (PARTITION BY p.FY, p.IC_NAME ORDER BY p._rank) - 0.5)
+      / COUNT(*) OVER (PARTITION BY p.FY, p.IC_NAME) AS _key
+  FROM ranked p
+)
+SELECT
+  {select},
+  ROW_NUMBER() OVER (ORDER BY p._key, p._rank) - 1 AS sample_position
+FROM keyed p
+ORDER BY sample_position
+LIMIT {int(max_size)}
+"""
@@ -0,0 +1,416 @@
+#!/usr/bin/env python3
+"""
+Concurrent Vertex AI text-embedding client with adaptive batching
+Project: od-cl-odss-conroyri-f75a
+Replaces the synchronous `model.get_embeddings(batch)` loops in
+vm_process_250k.py and generate_embeddings_50k_vertex.py:
+
+  - `concurrency` batches in flight at once (asyncio; the Vertex SDK's
+    get_embeddings_async, or HTTP to the local stand-in)
+  - batch size adapts AIMD-style: +step after responses faster than
+    target_latency, x0.8 after slow ones, halved on oversized requests and
+    timeouts, x0.75 on 5xx errors (at most once per round of in-flight
+    requests); batches also stay under the 20,000-token limit
+  - 429s pause every worker for Retry-After; they neither shrink batches nor
+    count as attempts
+  - texts of a failed batch go to a retry queue and come back in batches half
+    that size, so one bad text cannot fail the rest; a text failing on its
+    own is retried with exponential backoff
+  - a text that still fails after max_attempts comes back as a NaN row, never
+    a zero vector: embedding_cache does not cache it and the scripts drop it,
+    so it is retried on the next run instead of being clustered
+
+Usage:
+  client = VertexEmbeddingClient(VertexTransport('text-embedding-005', PROJECT_ID))
+  vectors = client.embed(texts)          # (n, 768) float32, NaN rows for failed texts
+  client.report()
+
+  # Offline load test against mock_embedding_server.py (started in-process)
+  python3 scripts/vertex_embedder.py bench --texts 20000 --latency 0.3 --error-rate 0.05 --rate-limit 20
+"""
+
+import argparse
+import asyncio
+import heapq
+import json
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+from reporter_client import FetchStats
+
+MODEL = 'text-embedding-005'
+LOCATION = 'us-central1'
+MAX_BATCH = 250
+MAX_REQUEST_TOKENS = 20_000
+CHARS_PER_TOKEN = 3  # conservative; the request limit is checked on the estimate
+
+
+class RequestError(Exception):
+    """A failed embedding request: HTTP-style status (None for timeouts/connection errors)"""
+
+    def __init__(self, status, message='', retry_after=None):
+        super().__init__(f"HTTP {status}: {message}" if status else message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+# Transports -----------------------------------------------------------------
+
+class VertexTransport:
+    """Vertex AI SDK (TextEmbeddingModel.get_embeddings_async)"""
+
+    def __init__(self, model=MODEL, project=None, location=LOCATION, auto_truncate=True):
+        import vertexai
+        from vertexai.language_models import TextEmbeddingModel
+
+        vertexai.init(project=project, location=location)
+        self.model = TextEmbeddingModel.from_pretrained(model)
+        self.auto_truncate = auto_truncate
+
+    async def embed(self, texts):
+        try:
+            embeddings = await self.model.get_embeddings_async(texts, auto_truncate=self.auto_truncate)
+        except Exception as e:
+            # google.api_core exceptions carry the HTTP status as .code
+            status = getattr(e, 'code', None)
+            raise RequestError(status if isinstance(status, int) else None, str(e)) from e
+        return [e.values for e in embeddings]
+
+    def close(self):
+        pass
+
+
+class HttpTransport:
+    """Vertex `:predict` over plain HTTP (no auth), for mock_embedding_server.py"""
+
+    def __init__(self, base_url, model=MODEL, project='local', location=LOCATION, concurrency=8, timeout=60):
+        self.url = (f"{base_url}/v1/projects/{project}/locations/{location}"
+                    f"/publishers/google/models/{model}:predict")
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.pool = ThreadPoolExecutor(max_workers=concurrency)
+
+    def _post(self, texts):
+        try:
+            response = self.session.post(self.url, json={'instances': [{'content': t} for t in texts]},
+                                         timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            raise RequestError(None, str(e)) from e
+        if response.status_code != 200:
+            retry_after = response.headers.get('Retry-After', '')
+            raise RequestError(response.status_code, response.text[:200],
+                               float(retry_after) if retry_after.replace('.', '', 1).isdigit() else None)
+        return [p['embeddings']['values'] for p in response.json()['predictions']]
+
+    async def embed(self, texts):
+        return await asyncio.get_running_loop().run_in_executor(self.pool, self._post, texts)
+
+    def close(self):
+        self.pool.shutdown(wait=False)
+        self.session.close()
+
+
+# Client ---------------------------------------------------------------------
+
+class AdaptiveBatchSize:
+    """
+    AIMD batch size
+    Failures only shrink the size once per round: a failure of a batch sent
+    before the last decrease is already accounted for.
+    """
+
+    def __init__(self, initial=100, minimum=1, maximum=MAX_BATCH, step=10, target_latency=2.0):
+        self.size = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.step = step
+        self.target_latency = target_latency
+        self.decreased_at = 0.0
+        self.history = [initial]
+
+    def _set(self, size):
+        self.size = int(min(self.maximum, max(self.minimum, size)))
+        self.history.append(self.size)
+
+    def success(self, latency):
+        if latency > self.target_latency:
+            self._set(self.size * 0.8)
+        else:
+            self._set(self.size + self.step)
+
+    def failure(self, sent_at, factor=0.5):
+        if sent_at >= self.decreased_at:
+            self._set(self.size * factor)
+            self.decreased_at = time.monotonic()
+
+
+class VertexEmbeddingClient:
+    """Embeds lists of texts with several adaptive batches in flight"""
+
+    def __init__(self, transport, concurrency=8, batch_size=100, max_batch=MAX_BATCH,
+                 max_request_tokens=MAX_REQUEST_TOKENS, target_latency=2.0, step=10,
+                 max_attempts=6, timeout=120, dim=None, adaptive=True):
+        self.transport = transport
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.max_batch = max_batch
+        self.max_request_tokens = max_request_tokens
+        self.target_latency = target_latency
+        self.step = step
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+        self.dim = dim
+        self.adaptive = adaptive
+        self.stats = FetchStats()
+        self.throttled = 0
+        self.failed = 0
+        self.batches = AdaptiveBatchSize(batch_size, maximum=max_batch, step=step, target_latency=target_latency)
+
+    def embed(self, texts):
+        """(n, dim) float32 for texts, in order; rows of texts that could not be embedded are NaN"""
+        return asyncio.run(self.embed_async(list(texts)))
+
+    async def embed_async(self, texts):
+        self._texts = texts
+        self._tokens = [min(len(t) // CHARS_PER_TOKEN + 1, 2048) for t in texts]
+        self._fresh = deque(range(len(texts)))
+        self._retry = []                 # heap of (ready_at, index)
+        self._attempts = {}              # failed attempts on its own, per text
+        self._caps = {}                  # batch size limit per text after a failed batch
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._vectors = None if self.dim is None else np.full((len(texts), self.dim), np.nan, dtype=np.float32)
+        self._failed_rows = []
+        if texts:
+            await asyncio.gather(*[self._worker() for _ in range(self.concurrency)])
+        if self._vectors is None:
+            self._vectors = np.full((len(texts), self.dim or 0), np.nan, dtype=np.float32)
+        self.failed += len(self._failed_rows)
+        return self._vectors
+
+    def _next_batch(self):
+        """Indices for the next request: ready retries first, then fresh texts"""
+        now = time.monotonic()
+        limit = self.batches.size if self.adaptive else self.batch_size
+        batch, tokens = [], 0
+        while len(batch) < limit:
+            if self._retry and self._retry[0][0] <= now:
+                index = self._retry[0][1]
+            elif self._fresh:
+                index = self._fresh[0]
+            else:
+                break
+            # Texts from a failed batch carry the (halved) size of that batch
+            cap = min(limit, self._caps.get(index, limit))
+            if batch and (len(batch) >= cap or tokens + self._tokens[index] > self.max_request_tokens):
+                break
+            if self._retry and self._retry[0][1] == index and self._retry[0][0] <= now:
+                heapq.heappop(self._retry)
+            else:
+                self._fresh.popleft()
+            batch.append(index)
+            tokens += self._tokens[index]
+            limit = cap
+        return batch
+
+    def _store(self, rows, values):
+        values = np.asarray(values, dtype=np.float32)
+        if self._vectors is None:
+            self.dim = values.shape[1]
+            self._vectors = np.full((len(self._texts), self.dim), np.nan, dtype=np.float32)
+        self._vectors[rows] = values
+
+    def _fail(self, index):
+        self._failed_rows.append(index)
+        self.stats.add_error()
+
+    def _retry_later(self, batch, delay):
+        ready_at = time.monotonic() + delay
+        for index in batch:
+            heapq.heappush(self._retry, (ready_at, index))
+
+    def _handle_failure(self, batch, error):
+        status = getattr(error, 'status', None)
+        if status == 429:
+            # Throttling is a rate signal, not a failure of these texts
+            self.throttled += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + (error.retry_after or 1.0))
+            self._retry_later(batch, 0.0)
+        elif len(batch) > 1:
+            # Bisect: retry in batches half this size, so one bad text cannot sink the others
+            for index in batch:
+                self._caps[index] = len(batch) // 2
+            self._retry_later(batch, 0.0 if status == 400 else 0.5)
+        elif status == 400:
+            # A single text the service rejects will not succeed on retry
+            self._fail(batch[0])
+        else:
+            index = batch[0]
+            self._attempts[index] = self._attempts.get(index, 0) + 1
+            if self._attempts[index] >= self.max_attempts:
+                self._fail(index)
+            else:
+                self._retry_later(batch, min(30.0, 0.5 * 2 ** (self._attempts[index] - 1)))
+
+    async def _worker(self):
+        while True:
+            wait = self._paused_until - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            batch = self._next_batch()
+            if not batch:
+                if not self._fresh and not self._retry and self._in_flight == 0:
+                    return
+                ready = self._retry[0][0] - time.monotonic() if self._retry else 0.05
+                await asyncio.sleep(min(max(ready, 0.01), 0.5))
+                continue
+
+            self._in_flight += 1
+            sent_at = time.monotonic()
+            try:
+                values = await asyncio.wait_for(self.transport.embed([self._texts[i] for i in batch]),
+                                                self.timeout)
+                if len(values) != len(batch):
+                    raise RequestError(None, f"{len(values)} vectors for {len(batch)} texts")
+            except (RequestError, asyncio.TimeoutError) as e:
+                error = e if isinstance(e, RequestError) else RequestError(None, f"timeout after {self.timeout}s")
+                self.stats.add_retry()
+                # Oversized requests and timeouts halve the batch, 5xx shrink it by a quarter; 429s
+                # only pause (the quota counts requests, so smaller batches would not help)
+                if error.status != 429:
+                    self.batches.failure(sent_at, 0.5 if error.status in (400, None) else 0.75)
+                self._handle_failure(batch, error)
+            else:
+                latency = time.monotonic() - sent_at
+                self.stats.record(latency, len(batch))
+                self.batches.success(latency)
+                self._store(batch, values)
+            finally:
+                self._in_flight -= 1
+
+    def summary(self):
+        s = self.stats.summary()
+        s.update(throttled=self.throttled, failed=self.failed, batch_size=self.batches.size,
+                 mean_batch=s['records'] / s['requests'] if s['requests'] else 0.0)
+        return s
+
+    def report(self, label="Vertex embeddings"):
+        self.stats.report(label)
+        s = self.summary()
+        print(f"    throttled={s['throttled']}, failed texts={s['failed']}, "
+              f"mean batch={s['mean_batch']:.0f}, final batch size={s['batch_size']}")
+
+    def close(self):
+        self.transport.close()
+
+
+# Benchmark ------------------------------------------------------------------
+
+def synthetic_titles(n, seed=42):
+    """Grant-title-like strings from a small biomedical vocabulary"""
+    rng = np.random.default_rng(seed)
+    words = ("cellular molecular mechanisms regulation cancer tumor immune response t-cell neural "
+             "circuits cognitive aging alzheimer disease cardiovascular risk diabetes obesity "
+             "metabolism genomic sequencing variants clinical trial intervention community health "
+             "disparities hiv prevention vaccine development imaging biomarkers microbiome infection "
+             "antibiotic resistance stem cell therapy kidney liver lung injury repair training program "
+             "career development center core resources data science").split()
+    return [' '.join(rng.choice(words, size=rng.integers(4, 16))).capitalize() for _ in range(n)]
+
+
+def run_bench(args):
+    from mock_embedding_server import build_state, start_server
+
+    if args.sample:
+        import pandas as pd
+        texts = pd.read_parquet(args.sample, columns=[args.column])[args.column].fillna('').astype(str).tolist()
+        texts = texts[:args.texts] if args.texts else texts
+    else:
+        texts = synthetic_titles(args.texts)
+
+    state = build_state(args)
+    server, base_url = start_server(state)
+    print(f"\n{'='*78}")
+    print(f"Vertex embedding client benchmark against {base_url} ({len(texts):,} texts)")
+    print(f"latency={args.latency}s+{args.per_text}s/text+{args.jitter}s error_rate={args.error_rate} "
+          f"poison_rate={args.poison_rate} rate_limit={args.rate_limit or 'none'}")
+    print(f"{'='*78}\n")
+
+    configs = {
+        # The old loop: one request at a time, fixed 250-text batches
+        'sequential': dict(concurrency=1, batch_size=MAX_BATCH, adaptive=False),
+        'concurrent': dict(concurrency=args.concurrency, batch_size=args.batch_size, adaptive=True,
+                           target_latency=args.target_latency),
+    }
+    results, vectors = [], {}
+    for name in args.only:
+        client = VertexEmbeddingClient(HttpTransport(base_url, concurrency=configs[name]['concurrency']),
+                                       max_attempts=args.max_attempts, **configs[name])
+        start = time.time()
+        vectors[name] = client.embed(texts)
+        elapsed = time.time() - start
+        client.close()
+        client.report(name)
+        s = client.summary()
+        results.append({'client': name, 'texts': len(texts), 'elapsed_sec': elapsed,
+                        'texts_per_sec': len(texts) / elapsed, **s})
+    with state.lock:
+        server_stats = dict(state.stats)
+    server.shutdown()
+
+    print(f"\n{'client':<12}{'texts/s':>10}{'reqs':>7}{'retries':>9}{'429s':>7}{'failed':>8}"
+          f"{'batch':>7}{'p50':>8}{'p95':>8}")
+    for r in results:
+        print(f"{r['client']:<12}{r['texts_per_sec']:>10.1f}{r['requests']:>7}{r['retries']:>9}"
+              f"{r['throttled']:>7}{r['failed']:>8}{r['mean_batch']:>7.0f}"
+              f"{r['latency_p50']:>8.3f}{r['latency_p95']:>8.3f}")
+    ok = {name: np.isfinite(v).all(axis=1) for name, v in vectors.items()}
+    for name, v in vectors.items():
+        zero = int((np.abs(np.nan_to_num(v)).sum(axis=1) == 0)[ok[name]].sum())
+        print(f"  {name}: {int(ok[name].sum()):,} embedded, {int((~ok[name]).sum()):,} failed (NaN), "
+              f"{zero} zero vectors")
+    if len(vectors) == 2:
+        a, b = vectors.values()
+        both = np.logical_and(*ok.values())
+        print(f"  Rows identical across clients: {np.allclose(a[both], b[both])} ({int(both.sum()):,} compared)")
+    print(f"  Server: {server_stats}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'results': results, 'server': server_stats}, f, indent=2)
+    return results
+
+
+def main():
+    from mock_embedding_server import add_server_args
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    sub = parser.add_subparsers(dest='command', required=True)
+    bench = sub.add_parser('bench', help='Sequential vs concurrent client against the local stand-in')
+    add_server_args(bench)
+    bench.add_argument('--texts', type=int, default=20_000, help='Synthetic titles (or first N of --sample)')
+    bench.add_argument('--sample', help='Parquet to take texts from instead of synthetic titles')
+    bench.add_argument('--column', default='PROJECT_TITLE')
+    bench.add_argument('--only', nargs='+', choices=['sequential', 'concurrent'],
+                       default=['sequential', 'concurrent'])
+    bench.add_argument('--concurrency', type=int, default=8)
+    bench.add_argument('--batch-size', type=int, default=100, help='Initial adaptive batch size')
+    bench.add_argument('--target-latency', type=float, default=2.0)
+    bench.add_argument('--max-attempts', type=int, default=6)
+    bench.add_argument('--json', help='Also write results to this JSON file')
+    args = parser.parse_args()
+
+    run_bench(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
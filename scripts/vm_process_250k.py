@@ -5,8 +5,6 @@ Full 250k pipeline: embeddings + clustering + UMAP
 from google.cloud import storage
 import pandas as pd
 import numpy as np
-import vertexai
-from vertexai.language_models import TextEmbeddingModel
 from scipy.cluster.hierarchy import linkage, fcluster
 from sklearn.preprocessing import StandardScaler, MultiLabelBinarizer
 from sklearn.feature_extraction.text import TfidfVectorizer
@@ -15,6 +13,10 @@ import nltk
 from nltk.stem import WordNetLemmatizer
 import time
 
+import embedding_store
+from embedding_cache import cached_embed
+from vertex_embedder import VertexEmbeddingClient, VertexTransport
+
 PROJECT_ID = 'od-cl-odss-conroyri-f75a'
 BUCKET = 'od-cl-odss-conroyri-nih-embeddings'
 
@@ -46,42 +48,31 @@ print(f"  Loaded: {len(df):,} grants")
 print("\n[2/6] Generating embeddings via Vertex AI...")
 print(f"  Started: {time.strftime('%H:%M:%S')}")
 
-vertexai.init(project=PROJECT_ID, location='us-central1')
-model = TextEmbeddingModel.from_pretrained("text-embedding-005")
-
 texts = df['PROJECT_TITLE'].fillna('').astype(str).tolist()
-embeddings = []
 
-batch_size = 250
-total_batches = (len(texts) + batch_size - 1) // batch_size
+# Several adaptive batches in flight; failed titles come back as NaN rows (never zero vectors)
+client = VertexEmbeddingClient(VertexTransport("text-embedding-005", PROJECT_ID, 'us-central1'),
+                               concurrency=8)
 
-for i in range(0, len(texts), batch_size):
-    batch = texts[i:i+batch_size]
-    batch_num = i // batch_size + 1
-    
-    try:
-        batch_embs = model.get_embeddings(batch)
-        embeddings.extend([e.values for e in batch_embs])
-        
-        if batch_num % 10 == 0:
-            pct = 100 * batch_num / total_batches
-            print(f"    Batch {batch_num}/{total_batches} ({pct:.1f}%) - {len(embeddings):,} done")
-            
-    except Exception as e:
-        print(f"    Batch {batch_num} failed, retrying individually...")
-        for text in batch:
-            try:
-                emb = model.get_embeddings([text])[0]
-                embeddings.append(emb.values)
-            except:
-                embeddings.append([0.0] * 768)
-    
-    if batch_num % 20 == 0:
-        time.sleep(2)
 
-df['embedding'] = embeddings
+def embed_texts(texts):
+    vectors = client.embed(texts)
+    client.report(f"{len(texts):,} titles")
+    return vectors
+
+
+# Same cache namespace as generate_embeddings_50k_vertex.py: titles embedded there are reused
+embeddings, cache_stats = cached_embed(texts, embed_texts, model="text-embedding-005", recipe="PROJECT_TITLE")
 print(f"  Completed: {time.strftime('%H:%M:%S')}")
-print(f"  Total embeddings: {len(embeddings):,}")
+print(f"  Total embeddings: {len(embeddings):,} ({cache_stats['cache_hits']:,} from cache)")
+
+# Titles that failed every retry are not cached; leave them out of this run
+# rather than clustering placeholders (the next run retries them)
+if cache_stats['failed']:
+    embedded = np.isfinite(embeddings).all(axis=1)
+    print(f"  ⚠️  {cache_stats['failed']:,} titles could not be embedded; dropped from this run")
+    df = df[embedded].reset_index(drop=True)
+    embeddings = embeddings[embedded]
 
 # Step 3: Features
 print("\n[3/6] Creating hybrid features...")
@@ -239,10 +230,18 @@ output.to_csv('hierarchical_250k_with_umap.csv', index=False)
 blob = bucket.blob('hierarchical_250k_with_umap.csv')
 blob.upload_from_filename('hierarchical_250k_with_umap.csv')
 
-emb_df = df[['APPLICATION_ID', 'embedding']].copy()
-emb_df.to_parquet('embeddings_250k.parquet', index=False)
-blob = bucket.blob('embeddings_250k.parquet')
-blob.upload_from_filename('embeddings_250k.parquet')
+# float32 store + list-column Parquet, and an int8 tier (4x smaller) with its accuracy report
+embedding_store.write('embeddings_250k', df['APPLICATION_ID'], embeddings_array,
+                      model="text-embedding-005", text_recipe="PROJECT_TITLE")
+embedding_store.export_parquet('embeddings_250k', 'embeddings_250k.parquet')
+tier = embedding_store.quantize('embeddings_250k', mode='int8', report=True)
+embedding_store.print_report(tier.manifest['accuracy'])
+
+for path in ['embeddings_250k.parquet', embedding_store.matrix_path(tier.prefix),
+             embedding_store.scale_path(tier.prefix), embedding_store.ids_path(tier.prefix),
+             embedding_store.manifest_path(tier.prefix)]:
+    blob = bucket.blob(path)
+    blob.upload_from_filename(path)
 
 print("\n" + "=" * 80)
 print("250K PIPELINE COMPLETE!")